@@ -5,4 +5,71 @@ app_object = Flask(__name__)
 database_string = "verdicts.db"
 monitored_service_path = None
 
+# "sqlite" stores verdicts in the database file database_string,
+# "memory" holds them in memory (under the name database_string) until the server stops,
+# "partitioned" stores function calls, verdicts and observations in a new database file for each partition_period
+# ("day" or "week"), and everything else in database_string
+storage_engine = "sqlite"
+partition_period = "day"
+# number of partitions attached to a connection at once (sqlite allows at most 10) - queries without a time range
+# are run over this many partitions at a time
+partitions_attached = 8
+
+# pragmas applied to each connection to the verdict database when it's opened, and the number of idle
+# connections kept open for reuse
+sqlite_pragmas = [
+    ("journal_mode", "wal"),
+    ("synchronous", "normal"),
+    ("busy_timeout", 5000),
+    ("cache_size", -65536),
+    ("temp_store", "memory"),
+    ("mmap_size", 268435456)
+]
+connection_pool_size = 16
+
+# "synchronous" performs each insertion inside its request,
+# "queued" hands insertions to a background writer that commits them in groups,
+# "spooled" appends insertions to a journal on disk and applies them in the background
+ingestion_mode = "synchronous"
+write_queue_size = 10000
+group_commit_size = 500
+group_commit_interval = 0.05
+
+# the spool is stored in numbered segment files starting with spool_path (by default, database_string followed by
+# .spool), and insertions are performed synchronously while it holds more than spool_max_size bytes
+spool_path = None
+spool_max_size = 256 * 1024 * 1024
+spool_segment_size = 16 * 1024 * 1024
+# whether each append is flushed to the device before it is acknowledged
+spool_sync = True
+
+# observations older than observation_retention_days are replaced by aggregates over buckets of
+# compaction_bucket_size seconds, in batches of compaction_batch_size, every compaction_interval seconds
+# (compaction is disabled if observation_retention_days is None)
+observation_retention_days = None
+compaction_interval = 3600
+compaction_bucket_size = 3600
+compaction_batch_size = 1000
+
+# number of worker processes serving requests, each reading the verdict database through its own connections while
+# a separate writer process performs every write (with 0, the Flask development server is used instead),
+# and the time in seconds a stopping worker waits for the requests it's handling and for its writes
+worker_processes = 0
+worker_shutdown_timeout = 30
+
+# maximum number of rows in a page of a list given by the analysis API,
+# and the number of rows read from the database at a time while a list is sent
+max_page_size = 10000
+stream_chunk_size = 1000
+# maximum number of ids in a batch lookup
+max_batch_size = 10000
+
+# maximum size in bytes of the (decompressed) body of a request to an insertion or event stream end point
+max_request_body_size = 64 * 1024 * 1024
+
+# maximum number of entries held by the in-memory caches used during insertion
+assignment_cache_size = 100000
+transaction_cache_size = 10000
+program_path_cache_size = 10000
+
 from app import routes
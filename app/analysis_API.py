@@ -1,10 +1,83 @@
 """
 Functions that make up the analysis API.
 """
+import app
 from app import app_object
 from . import database
+import functools
 import json
-from flask import request
+from flask import request, Response, stream_with_context
+from .request_body import get_request_data
+
+
+def get_listing():
+    """
+    Read how a list should be given from the request.
+    A page of the list is requested through the limit and after_id query parameters.  Paged lists are given as
+    {"results": [...], "next": after_id}, where after_id gives the next page,
+    eg, /client/observation/?limit=1000 followed by /client/observation/?limit=1000&after_id=<next>
+    until next is null.  If neither parameter is given, every row is listed.
+    The fields query parameter gives a comma-separated list of the fields to include in each row,
+    eg, /client/observation/?fields=id,numeric_value
+    The format query parameter is json (the default), ndjson for newline-delimited json, or compact for
+    {"columns": [...], "rows": [...]}, with the values of each row in an array.  Newline-delimited json is also
+    given if the request accepts application/x-ndjson in preference to application/json.
+    """
+    limit = request.args.get("limit", type=int)
+    after_id = request.args.get("after_id", type=int)
+    if limit is None and after_id is not None:
+        limit = app.max_page_size
+    if limit is not None:
+        limit = max(1, min(limit, app.max_page_size))
+    response_format = request.args.get("format")
+    if response_format is None:
+        preferred = request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+        response_format = "ndjson" if preferred == "application/x-ndjson" else "json"
+    fields = request.args.get("fields")
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(",") if field.strip() != ""]
+    return database.Listing(after_id, limit, response_format, fields)
+
+
+def list_end_point(view):
+    """
+    Decorator for end points giving lists, which streams the json generated by the view
+    (see database.utils.stream_rows), or responds with 400 if the list requested can't be given.
+    """
+    @functools.wraps(view)
+    def streamed_view(*args, **kwargs):
+        listing = get_listing()
+        if listing.response_format not in ("json", "ndjson", "compact"):
+            return "Unknown format '%s'.  The format must be json, ndjson or compact." % listing.response_format, 400
+        try:
+            rows = view(*args, **kwargs)
+        except ValueError as e:
+            return str(e), 400
+        if isinstance(rows, str):
+            return rows
+        mimetype = "application/x-ndjson" if listing.response_format == "ndjson" else "application/json"
+        # the request context (and so the connection) is kept until every row has been sent
+        return Response(stream_with_context(rows), mimetype=mimetype)
+    return streamed_view
+
+
+def batch_end_point(view):
+    """
+    Decorator for batch lookups, which gives the view the list of ids sent as {"ids": [...]} in the body of a POST
+    request, or responds with 400 if they aren't given properly.  Views return a dictionary from each id to the row
+    (or list of rows) for that id, eg, a POST to /client/verdict/batch/ with {"ids": [1, 2]} gives
+    {"1": {"id": 1, ...}, "2": null} if there is no verdict with id 2.
+    """
+    @functools.wraps(view)
+    def batch_view():
+        try:
+            ids = [int(batch_id) for batch_id in json.loads(get_request_data())["ids"]]
+        except (ValueError, KeyError, TypeError):
+            return 'The body must be a json dictionary {"ids": [...]} holding a list of ids.', 400
+        if len(ids) > app.max_batch_size:
+            return "At most %i ids can be looked up at once." % app.max_batch_size, 400
+        return Response(view(ids), mimetype="application/json")
+    return batch_view
 
 
 """
@@ -45,8 +118,9 @@ Queries based on the function table.
 
 
 @app_object.route("/client/function/")
+@list_end_point
 def list_functions():
-    return database.list_functions()
+    return database.list_functions(get_listing())
 
 @app_object.route("/client/function/id/<function_id>/properties/")
 def list_properties_from_function(function_id):
@@ -54,18 +128,21 @@ def list_properties_from_function(function_id):
 
 
 @app_object.route("/client/function/id/<function_id>/transaction/id/<transaction_id>/function_calls/")
+@list_end_point
 def list_function_calls_transaction_id(transaction_id, function_id):
-    return database.list_calls_transactionid(transaction_id, function_id)
+    return database.list_calls_transactionid(transaction_id, function_id, get_listing())
 
 
 @app_object.route("/client/function/name/<function_name>/")
+@list_end_point
 def get_function_by_name(function_name):
-    return database.get_f_byname(function_name)
+    return database.get_f_byname(function_name, get_listing())
 
 
 @app_object.route("/client/function/id/<id>/function_calls/")
+@list_end_point
 def get_function_calls_from_function_id(id):
-    return database.list_calls_function(id)
+    return database.list_calls_function(id, get_listing())
 
 
 @app_object.route("/client/function/id/<function_id>/")
@@ -73,20 +150,29 @@ def get_function_by_id(function_id):
     return database.get_f_byid(function_id)
 
 
+@app_object.route("/client/function/batch/", methods=["POST"])
+@batch_end_point
+def get_functions_by_ids(ids):
+    return database.get_functions_byids(ids)
+
+
 @app_object.route("/client/function/id/<id>/bindings/")
+@list_end_point
 def get_bindings_from_function_property_pair(id):
     #TODO CHANGE
-    return database.get_bindings_from_function_property_pair(id)
+    return database.get_bindings_from_function_property_pair(id, get_listing())
 
 
 @app_object.route("/client/function/id/<function_id>/verdicts/")
+@list_end_point
 def list_verdicts_of_function(function_id):
-    return database.list_verdicts_of_function(function_id)
+    return database.list_verdicts_of_function(function_id, get_listing())
 
 
 @app_object.route("/client/function/id/<function_id>/verdict/value/<verdict_value>/")
+@list_end_point
 def list_verdicts_of_function_with_value(function_id, verdict_value):
-    return database.list_verdicts_of_function_with_value(function_id, verdict_value)
+    return database.list_verdicts_of_function_with_value(function_id, verdict_value, get_listing())
 
 
 """
@@ -105,8 +191,9 @@ Queries based on the transaction table.
 
 
 @app_object.route("/client/transaction/id/<transaction_id>/function_calls/")
+@list_end_point
 def list_function_calls_transaction(transaction_id):
-    return database.list_calls_transaction(transaction_id)
+    return database.list_calls_transaction(transaction_id, get_listing())
 
 
 @app_object.route("/client/transaction/id/<transaction_id>/")
@@ -114,13 +201,20 @@ def get_transaction_by_id(transaction_id):
     return database.get_transaction_byid(transaction_id)
 
 
+@app_object.route("/client/transaction/batch/", methods=["POST"])
+@batch_end_point
+def get_transactions_by_ids(ids):
+    return database.get_transactions_byids(ids)
+
+
 @app_object.route("/client/transaction/time/<time_of_request>/")
 def get_transaction_by_time(time_of_request):
     return database.get_transaction_bytime(time_of_request)
 
 @app_object.route("/client/transaction/time/between/<lower_bound>/<upper_bound>/")
+@list_end_point
 def get_transaction_in_interval(lower_bound, upper_bound):
-    return database.get_transaction_in_interval(lower_bound, upper_bound)
+    return database.get_transaction_in_interval(lower_bound, upper_bound, get_listing())
 
 
 """
@@ -133,19 +227,34 @@ def get_call_by_id(call_id):
     return database.get_call_byid(call_id)
 
 
+@app_object.route("/client/function_call/batch/", methods=["POST"])
+@batch_end_point
+def get_calls_by_ids(ids):
+    return database.get_calls_byids(ids)
+
+
 @app_object.route("/client/function_call/id/<call_id>/verdicts/")
+@list_end_point
 def list_verdicts_of_call(call_id):
-    return database.list_verdicts_call(call_id)
+    return database.list_verdicts_call(call_id, get_listing())
+
+
+@app_object.route("/client/function_call/verdicts/batch/", methods=["POST"])
+@batch_end_point
+def list_verdicts_of_calls(ids):
+    return database.list_verdicts_calls(ids)
 
 
 @app_object.route("/client/function_call/id/<call_id>/observations/")
+@list_end_point
 def list_observations_during_call(call_id):
-    return database.list_observations_call(call_id)
+    return database.list_observations_call(call_id, get_listing())
 
 
 @app_object.route("/client/function_call/id/<call_id>/verdict/value/<verdict_value>/")
+@list_end_point
 def list_verdicts_with_value_of_call(call_id, verdict_value):
-    return database.list_verdicts_with_value_of_call(call_id, verdict_value)
+    return database.list_verdicts_with_value_of_call(call_id, verdict_value, get_listing())
 
 @app_object.route("/client/function_call/id/<call_id>/hash/<property_hash>/verdicts/")
 def list_verdicts_of_call_property(call_id, property_hash):
@@ -156,8 +265,9 @@ def list_verdicts_with_value_of_call_property(call_id, verdict_value, property_h
     return database.list_verdicts_with_value_of_call_by_property(call_id, verdict_value, property_hash)
 
 @app_object.route("/client/function_call/between/<start_time>/<end_time>/")
+@list_end_point
 def list_function_calls_between_times(start_time, end_time):
-    return database.list_function_calls_between_times(start_time, end_time)
+    return database.list_function_calls_between_times(start_time, end_time, get_listing())
 
 
 """
@@ -170,9 +280,22 @@ def get_verdict_by_id(verdict_id):
     return database.get_verdict_byid(verdict_id)
 
 
+@app_object.route("/client/verdict/batch/", methods=["POST"])
+@batch_end_point
+def get_verdicts_by_ids(ids):
+    return database.get_verdicts_byids(ids)
+
+
 @app_object.route("/client/verdict/id/<verdict_id>/observations/")
+@list_end_point
 def get_observations_from_verdict(verdict_id):
-    return database.get_observations_from_verdict(verdict_id)
+    return database.get_observations_from_verdict(verdict_id, get_listing())
+
+
+@app_object.route("/client/verdict/observations/batch/", methods=["POST"])
+@batch_end_point
+def get_observations_from_verdicts(ids):
+    return database.list_observations_verdicts(ids)
 
 
 """
@@ -185,6 +308,12 @@ def get_atom_by_id(atom_id):
     return database.get_atom_byid(atom_id)
 
 
+@app_object.route("/client/atom/batch/", methods=["POST"])
+@batch_end_point
+def get_atoms_by_ids(ids):
+    return database.get_atoms_byids(ids)
+
+
 @app_object.route("/client/atom/index/<atom_index>/property/<property_hash>/")
 def get_atom_by_index_and_property(atom_index, property_hash):
     return database.get_atom_by_index_and_property(atom_index, property_hash)
@@ -210,9 +339,40 @@ def get_instrumentation_point_by_id(point_id):
     return database.get_point_byid(point_id)
 
 
+@app_object.route("/client/instrumentation_point/batch/", methods=["POST"])
+@batch_end_point
+def get_instrumentation_points_by_ids(ids):
+    return database.get_points_byids(ids)
+
+
 @app_object.route("/client/instrumentation_point/id/<point_id>/observations/")
+@list_end_point
 def list_observations_of_point(point_id):
-    return database.list_observations_of_point(point_id)
+    return database.list_observations_of_point(point_id, get_listing())
+
+
+@app_object.route("/client/instrumentation_point/id/<point_id>/atom/<atom_index>/observations/range/")
+@list_end_point
+def list_observations_of_point_in_range(point_id, atom_index):
+    """
+    Lists the observations of the given atom at the given instrumentation point whose numeric values
+    lie between the (optional) lower and upper query parameters.
+    """
+    return database.list_observations_of_point_in_range(
+        point_id, atom_index, request.args.get("lower", type=float), request.args.get("upper", type=float),
+        get_listing()
+    )
+
+
+@app_object.route("/client/instrumentation_point/id/<point_id>/atom/<atom_index>/observations/summary/")
+def list_observation_summary(point_id, atom_index):
+    """
+    Summarises the observations of the given atom at the given instrumentation point over buckets of time,
+    between the (optional) start and end query parameters, including observations that have been compacted.
+    """
+    return json.dumps(database.list_observation_summary(
+        point_id, atom_index, request.args.get("start"), request.args.get("end")
+    ))
 
 
 """
@@ -225,9 +385,16 @@ def get_binding_by_id(binding_id):
     return database.get_binding_byid(binding_id)
 
 
+@app_object.route("/client/binding/batch/", methods=["POST"])
+@batch_end_point
+def get_bindings_by_ids(ids):
+    return database.get_bindings_byids(ids)
+
+
 @app_object.route("/client/binding/id/<binding_id>/verdicts/")
+@list_end_point
 def list_verdicts_from_binding(binding_id):
-    return database.list_verdicts_from_binding(binding_id)
+    return database.list_verdicts_from_binding(binding_id, get_listing())
 
 
 """
@@ -240,14 +407,41 @@ def get_observation_by_id(observation_id):
     return database.get_observation_byid(observation_id)
 
 
+@app_object.route("/client/observation/batch/", methods=["POST"])
+@batch_end_point
+def get_observations_by_ids(ids):
+    return database.get_observations_byids(ids)
+
+
 @app_object.route("/client/observation/id/<observation_id>/assignments/")
+@list_end_point
 def list_assignments_given_observation(observation_id):
-    return database.list_assignments_obs(observation_id)
+    return database.list_assignments_obs(observation_id, get_listing())
+
+
+@app_object.route("/client/observation/assignments/batch/", methods=["POST"])
+@batch_end_point
+def list_assignments_given_observations(ids):
+    return database.list_assignments_observations(ids)
 
 
 @app_object.route("/client/observation/")
+@list_end_point
 def list_observations():
-    return database.list_observations()
+    return database.list_observations(get_listing())
+
+
+@app_object.route("/client/atom/id/<atom_id>/observations/range/")
+@list_end_point
+def list_observations_of_atom_in_range(atom_id):
+    """
+    Lists the observations of the given atom whose numeric values lie between the (optional) lower and upper
+    query parameters, eg, /client/atom/id/1/observations/range/?lower=2.5
+    """
+    return database.list_observations_of_atom_in_range(
+        atom_id, request.args.get("lower", type=float), request.args.get("upper", type=float),
+        get_listing()
+    )
 
 
 """
@@ -260,6 +454,12 @@ def get_assignment_by_id(assignment_id):
     return database.get_assignment_byid(assignment_id)
 
 
+@app_object.route("/client/assignment/batch/", methods=["POST"])
+@batch_end_point
+def get_assignments_by_ids(ids):
+    return database.get_assignments_byids(ids)
+
+
 """
 Queries based on the path_condition table.
 """
@@ -280,6 +480,12 @@ def get_path_condition_structure_by_id(pcs_id):
     return database.get_pcs_byid(pcs_id)
 
 
+@app_object.route("/client/path_condition_structure/batch/", methods=["POST"])
+@batch_end_point
+def get_path_condition_structures_by_ids(ids):
+    return database.get_pcs_byids(ids)
+
+
 @app_object.route("/client/path_condition_structure/function_call/<call_id>/")
 def get_path_conditions_by_function_call_id(call_id):
     return database.get_path_conditions_by_function_call_id(call_id)
\ No newline at end of file
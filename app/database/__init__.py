@@ -4,4 +4,11 @@ Central database package.
 from .analysis import *
 from .insertion import *
 from .web import *
-from .path_reconstruction import *
\ No newline at end of file
+from .path_reconstruction import *
+from .catalog import load_catalog
+from .spool import spool_statistics
+from .writer import write_queue_depth
+from .engine import get_engine
+from .utils import Listing, upgrade_database
+from .compact import *
+from .compaction import compact_observations, start_compaction, list_observation_summary
\ No newline at end of file
@@ -1,40 +1,61 @@
 """
 Module to provide functions to query the verdict database for the analysis library.
 """
-from .utils import get_connection, query_db_all, query_db_one
+from .utils import get_connection, query_db_all, query_db_one, query_db_batch
+from .values import timestamp_to_microseconds
 import sqlite3
 import json
 
 
-def list_functions():
+def list_functions(listing=None):
     query_string = "select * from function"
-    return query_db_all(query_string, [])
+    return query_db_all(query_string, [], listing=listing, key="function.id")
 
 
-def list_calls_function(function_name):
+def list_calls_function(function_name, listing=None):
     # based on the name of the function, list all function calls of the function with that name
     query_string = """select function_call.id, function_call.function, function_call.time_of_call, 
-    function_call.end_time_of_call, function_call.trans, function_call.path_condition_id_sequence
+    function_call.end_time_of_call, function_call.trans,
+    (select path_condition_id_sequence from program_path where program_path.id = function_call.program_path)
+    as path_condition_id_sequence
     from (function inner join function_call on function.id=function_call.function)
     where function.fully_qualified_name like ? """
-    return query_db_all(query_string, [function_name])
+    return query_db_all(query_string, [function_name], listing=listing, key="function_call.id")
 
 
-def list_calls_transaction(transaction_id):
+def list_calls_transaction(transaction_id, listing=None):
     # list all function_calls during the given transaction
     query_string = """
     select function_call.id, function_call.function, function_call.time_of_call,
-    function_call.end_time_of_call, function_call.trans, function_call.path_condition_id_sequence
+    function_call.end_time_of_call, function_call.trans,
+    (select path_condition_id_sequence from program_path where program_path.id = function_call.program_path)
+    as path_condition_id_sequence
     from (trans inner join function_call on
         trans.id=function_call.trans)
     where trans.id=?"""
-    return query_db_all(query_string, [transaction_id])
+    return query_db_all(query_string, [transaction_id], listing=listing, key="function_call.id")
 
 
-def list_calls_transactionid(transaction_id, function_id):
+def list_calls_transactionid(transaction_id, function_id, listing=None):
     # a combination of the previous two functions: lists calls of given function during the given request
-    query_string = "select * from function_call where trans=? and function=?"
-    return query_db_all(query_string, [transaction_id, function_id])
+    query_string = """select function_call.id, function_call.function, function_call.time_of_call,
+    function_call.end_time_of_call, function_call.trans,
+    (select path_condition_id_sequence from program_path where program_path.id = function_call.program_path)
+    as path_condition_id_sequence
+    from function_call where trans=? and function=?"""
+    return query_db_all(query_string, [transaction_id, function_id], listing=listing, key="function_call.id")
+
+
+def list_function_calls_between_times(start_time, end_time, listing=None):
+    # lists all function calls that began between the given times,
+    # querying only the partitions covering those times if verdicts are partitioned
+    query_string = """select function_call.id, function_call.function, function_call.time_of_call,
+    function_call.end_time_of_call, function_call.trans,
+    (select path_condition_id_sequence from program_path where program_path.id = function_call.program_path)
+    as path_condition_id_sequence
+    from function_call where time_of_call_us >= ? and time_of_call_us <= ?"""
+    return query_db_all(query_string, [timestamp_to_microseconds(start_time), timestamp_to_microseconds(end_time)],
+                        time_range=(start_time, end_time), listing=listing, key="function_call.id")
 
 
 def list_calls_verdict(function_id, verdict_value):
@@ -42,16 +63,18 @@ def list_calls_verdict(function_id, verdict_value):
     # such that their verdict value is 0 or 1 (verdict_value)
     query_string = """select function_call.id, function_call.function,
     function_call.time_of_call, function_call.end_time_of_call,
-    function_call.trans, function_call.path_condition_id_sequence from
+    function_call.trans,
+    (select path_condition_id_sequence from program_path where program_path.id = function_call.program_path)
+    as path_condition_id_sequence from
     function_call inner join verdict on verdict.function_call=function_call.id
     inner join function on function_call.function=function.id
     where function.id=? and verdict.verdict=?"""
     return query_db_all(query_string, [function_id, verdict_value])
 
 
-def get_f_byname(function_name):
+def get_f_byname(function_name, listing=None):
     query_string = "select * from function where fully_qualified_name like ?"
-    return query_db_all(query_string, [function_name])
+    return query_db_all(query_string, [function_name], listing=listing, key="function.id")
 
 
 def get_f_byid(function_id):
@@ -64,14 +87,23 @@ def get_transaction_byid(transaction_id):
     return query_db_one(query_string, [transaction_id])
 
 
-def get_transaction_in_interval(lower_bound, upper_bound):
-    query_string = "select * from trans where time_of_transaction >= ? and time_of_transaction <= ?"
-    print(lower_bound, upper_bound)
-    return query_db_all(query_string, [lower_bound, upper_bound])
+def get_transaction_in_interval(lower_bound, upper_bound, listing=None):
+    query_string = """select id, time_of_transaction from trans
+    where time_of_transaction_us >= ? and time_of_transaction_us <= ?"""
+    return query_db_all(query_string, [timestamp_to_microseconds(lower_bound), timestamp_to_microseconds(upper_bound)],
+                        listing=listing, key="trans.id")
+
+
+# the columns of function_call, with the path condition sequence read from the call's program path
+function_call_columns = """function_call.id, function_call.function, function_call.time_of_call,
+    function_call.end_time_of_call, function_call.trans,
+    (select path_condition_id_sequence from program_path where program_path.id = function_call.program_path)
+    as path_condition_id_sequence, function_call.program_path, function_call.time_of_call_us,
+    function_call.end_time_of_call_us, function_call.duration_us"""
 
 
 def get_call_byid(call_id):
-    query_string = "select * from function_call where id=?"
+    query_string = "select %s from function_call where id=?" % function_call_columns
     return query_db_one(query_string, [call_id])
 
 
@@ -132,9 +164,9 @@ def get_binding_byid(id):
     return query_db_one(query_string, [id])
 
 
-def get_bindings_from_function_property_pair(id):
+def get_bindings_from_function_property_pair(id, listing=None):
     query_string = "select * from binding where function=?"
-    return query_db_all(query_string, [id])
+    return query_db_all(query_string, [id], listing=listing, key="binding.id")
 
 
 def get_observation_byid(id):
@@ -165,7 +197,10 @@ def get_path_conditions_by_function_call_id(call_id):
     cursor = connection.cursor()
     path_condition_ids =\
         json.loads(
-            cursor.execute("select path_condition_id_sequence from function_call where id = ?", [call_if]).fetchone()[0]
+            cursor.execute(
+                "select program_path.path_condition_id_sequence from function_call inner join program_path "
+                "on function_call.program_path = program_path.id where function_call.id = ?", [call_id]
+            ).fetchone()[0]
         )
     # extract the path condition ids, then get the serialised path conditions
     serialised_conditions = list(map(
@@ -194,13 +229,13 @@ def get_intersection_byid(id):
     return query_db_one(query_string, [id])
 
 
-def list_assignments_obs(observation_id):
+def list_assignments_obs(observation_id, listing=None):
     query_string = """select assignment.id, assignment.variable,
     assignment.value,assignment.type
     from assignment inner join observation_assignment_pair
     on assignment.id=observation_assignment_pair.assignment
     where observation_assignment_pair.observation =?"""
-    return query_db_all(query_string, [observation_id])
+    return query_db_all(query_string, [observation_id], listing=listing, key="assignment.id")
 
 
 def list_verdicts_byvalue(value):
@@ -218,56 +253,104 @@ def list_verdicts_function_property_byvalue(value):
     return query_db_all(query_string, [value])
 
 
-def list_verdicts_call(call_id):
+def list_verdicts_call(call_id, listing=None):
     query_string = "select * from verdict where function_call=?"
-    return query_db_all(query_string, [call_id])
+    return query_db_all(query_string, [call_id], listing=listing, key="verdict.id")
 
 
-def list_verdicts_from_binding(binding_id):
+def list_verdicts_from_binding(binding_id, listing=None):
     query_string = "select * from verdict where binding=?"
-    return query_db_all(query_string, [binding_id])
+    return query_db_all(query_string, [binding_id], listing=listing, key="verdict.id")
 
 
-def list_observations_call(call_id):
+def list_observations_call(call_id, listing=None):
     query_string = """select observation.id, observation.instrumentation_point,
     observation.verdict,observation.observed_value,observation.atom_index,
     observation.previous_condition_offset from
     observation inner join verdict on observation.verdict=verdict.id
     inner join function_call on verdict.function_call=function_call.id
     where function_call.id=?"""
-    return query_db_all(query_string, [call_id])
+    return query_db_all(query_string, [call_id], listing=listing, key="observation.id")
 
 
-def list_observations():
+def list_observations(listing=None):
     query_string = "select * from observation;"
-    return query_db_all(query_string, [])
+    return query_db_all(query_string, [], listing=listing, key="observation.id")
 
 
-def list_observations_of_point(point_id):
+def list_observations_of_point(point_id, listing=None):
     query_string = """select observation.id, observation.instrumentation_point,
     observation.verdict,observation.observed_value,observation.atom_index,
     observation.previous_condition_offset from observation
     where observation.instrumentation_point=?"""
-    return query_db_all(query_string, [point_id])
+    return query_db_all(query_string, [point_id], listing=listing, key="observation.id")
+
+
+def list_observations_in_range(point_ids, atom_index, lower, upper, listing=None):
+    """
+    Given a list of instrumentation point ids and an atom index, list the observations of that atom
+    whose numeric values lie between lower and upper (either of which can be None to leave the range open),
+    ordered by their values.
+    """
+    query_string = """select observation.id, observation.instrumentation_point,
+    observation.verdict, observation.observed_value, observation.numeric_value, observation.atom_index,
+    observation.sub_index, observation.previous_condition_offset from observation
+    where observation.instrumentation_point in (%s) and observation.atom_index = ?
+    and observation.numeric_value >= ? and observation.numeric_value <= ?""" % ", ".join(["?"] * len(point_ids))
+    if listing is None:
+        query_string += " order by observation.numeric_value"
+    return query_db_all(query_string, list(point_ids) + [
+        atom_index,
+        lower if lower is not None else float("-inf"),
+        upper if upper is not None else float("inf")
+    ], listing=listing, key="observation.id", order=["observation.numeric_value", "observation.id"])
+
+
+def list_observations_of_point_in_range(point_id, atom_index, lower, upper, listing=None):
+    return list_observations_in_range([point_id], atom_index, lower, upper, listing)
+
+
+def list_observations_of_atom_in_range(atom_id, lower, upper, listing=None):
+    """
+    List the observations of the given atom, at every instrumentation point placed for it,
+    whose numeric values lie between lower and upper.
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
+    atom = cursor.execute("select index_in_atoms from atom where id = ?", [atom_id]).fetchone()
+    point_ids = [row[0] for row in cursor.execute(
+        "select instrumentation_point from atom_instrumentation_point_pair where atom = ?", [atom_id]
+    ).fetchall()]
+    connection.close()
+    if atom is None:
+        return "None"
+    return list_observations_in_range(point_ids, atom[0], lower, upper, listing)
 
 
-def list_verdicts_with_value_of_call(call_id, verdict_value):
+def list_verdicts_with_value_of_call(call_id, verdict_value, listing=None):
     query_string = "select * from verdict where function_call=? and verdict=?"
-    return query_db_all(query_string, [call_id, verdict_value])
+    return query_db_all(query_string, [call_id, verdict_value], listing=listing, key="verdict.id")
 
 
-def list_verdicts_of_function(function_id):
-    query_string = """select * from verdict inner join binding
+def list_verdicts_of_function(function_id, listing=None):
+    # the columns are given explicitly, since the id of the binding would otherwise be given as the id
+    query_string = """select verdict.id, verdict.binding, verdict.verdict, verdict.time_obtained,
+    verdict.function_call, verdict.collapsing_atom, verdict.collapsing_atom_sub_index, verdict.time_obtained_us,
+    binding.binding_space_index, binding.function, binding.property_hash, binding.binding_statement_lines
+    from verdict inner join binding
     on verdict.binding=binding.id
     where binding.function=?"""
-    return query_db_all(query_string, [function_id])
+    return query_db_all(query_string, [function_id], listing=listing, key="verdict.id")
 
 
-def list_verdicts_of_function_with_value(function_id, verdict_value):
-    query_string = """select * from verdict inner join binding
+def list_verdicts_of_function_with_value(function_id, verdict_value, listing=None):
+    query_string = """select verdict.id, verdict.binding, verdict.verdict, verdict.time_obtained,
+    verdict.function_call, verdict.collapsing_atom, verdict.collapsing_atom_sub_index, verdict.time_obtained_us,
+    binding.binding_space_index, binding.function, binding.property_hash, binding.binding_statement_lines
+    from verdict inner join binding
     on verdict.binding=binding.id
     where binding.function=? and verdict.verdict=?"""
-    return query_db_all(query_string, [function_id, verdict_value])
+    return query_db_all(query_string, [function_id, verdict_value], listing=listing, key="verdict.id")
 
 
 def get_assignment_dict_from_observation(id):
@@ -295,9 +378,83 @@ where observation.id = ?
     return json.dumps(final_dict)
 
 
-def get_observations_from_verdict(verdict_id):
+def get_observations_from_verdict(verdict_id, listing=None):
     """
     Given a verdict ID, return a list of verdict dictionaries.
     """
     query_string = "select * from observation where verdict = ?"
-    return query_db_all(query_string, [verdict_id])
\ No newline at end of file
+    return query_db_all(query_string, [verdict_id], listing=listing, key="observation.id")
+
+
+# batch lookups, each given a list of ids and returning a json dictionary from each id to the row with that id
+# (or None), or to the list of rows belonging to it
+
+def get_functions_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, function.* from temp.batch_ids
+    inner join function on function.id = batch_ids.id""")
+
+
+def get_transactions_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, trans.* from temp.batch_ids
+    inner join trans on trans.id = batch_ids.id""")
+
+
+def get_calls_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, %s from temp.batch_ids
+    inner join function_call on function_call.id = batch_ids.id""" % function_call_columns)
+
+
+def get_verdicts_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, verdict.* from temp.batch_ids
+    inner join verdict on verdict.id = batch_ids.id""")
+
+
+def get_atoms_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, atom.* from temp.batch_ids
+    inner join atom on atom.id = batch_ids.id""")
+
+
+def get_points_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, instrumentation_point.* from temp.batch_ids
+    inner join instrumentation_point on instrumentation_point.id = batch_ids.id""")
+
+
+def get_bindings_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, binding.* from temp.batch_ids
+    inner join binding on binding.id = batch_ids.id""")
+
+
+def get_observations_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, observation.* from temp.batch_ids
+    inner join observation on observation.id = batch_ids.id""")
+
+
+def get_assignments_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, assignment.* from temp.batch_ids
+    inner join assignment on assignment.id = batch_ids.id""")
+
+
+def get_pcs_byids(ids):
+    return query_db_batch(ids, """select batch_ids.id as batch_id, path_condition_structure.* from temp.batch_ids
+    inner join path_condition_structure on path_condition_structure.id = batch_ids.id""")
+
+
+def list_verdicts_calls(call_ids):
+    return query_db_batch(call_ids, """select batch_ids.id as batch_id, verdict.* from temp.batch_ids
+    inner join verdict on verdict.function_call = batch_ids.id
+    order by batch_ids.id, verdict.id""", many=True)
+
+
+def list_observations_verdicts(verdict_ids):
+    return query_db_batch(verdict_ids, """select batch_ids.id as batch_id, observation.* from temp.batch_ids
+    inner join observation on observation.verdict = batch_ids.id
+    order by batch_ids.id, observation.id""", many=True)
+
+
+def list_assignments_observations(observation_ids):
+    return query_db_batch(observation_ids, """select batch_ids.id as batch_id, assignment.id, assignment.variable,
+    assignment.value, assignment.type
+    from temp.batch_ids inner join observation_assignment_pair
+    on observation_assignment_pair.observation = batch_ids.id
+    inner join assignment on assignment.id = observation_assignment_pair.assignment
+    order by batch_ids.id, assignment.id""", many=True)
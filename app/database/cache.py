@@ -0,0 +1,56 @@
+"""
+Module to provide the in-memory caches used to avoid repeated lookups in the verdict database.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded map that evicts the least recently used entry once it holds capacity entries.
+    Hits and misses are counted so the effectiveness of the cache can be reported.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the value stored for key, or None if there isn't one.
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            # re-insert the entry so it becomes the most recently used
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def statistics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups > 0 else None
+            }
@@ -0,0 +1,317 @@
+"""
+Module to provide an in-process catalog of the static metadata written to the verdict database at
+instrumentation time (functions, properties, bindings, atoms, instrumentation points and branching conditions).
+
+This data never changes once it has been written, so it is loaded once and then kept up to date by the
+insertion functions, allowing the insertion and analysis code to look it up without querying the database.
+Lookups that miss the catalog fall back to the database, in case the metadata was written by another process.
+Lookups of lists (the properties of a function and the bindings of a function and property) can't tell whether
+the catalog is missing an element, so they always read their key from the database.
+Rows read by lookups made during a write are only added once the write has been committed, since the write may
+have inserted them and may yet be rolled back.
+"""
+import functools
+import threading
+
+from .utils import get_connection
+from .writer import after_commit, in_write
+from .schema import content_hash
+
+
+class Catalog(object):
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        # map from fully qualified names to function ids, and back
+        self.function_ids = {}
+        self.function_names = {}
+        # map from function ids to lists of property hashes
+        self.function_properties = {}
+        # map from property hashes to (serialised_structure, index_in_specification_file) pairs
+        self.properties = {}
+        # map from (function, property_hash, binding_space_index) triples to binding ids
+        self.binding_ids = {}
+        # map from binding ids to (binding_space_index, function, property_hash, binding_statement_lines)
+        self.bindings = {}
+        # map from (property_hash, index_in_atoms) pairs to atom ids
+        self.atom_ids = {}
+        # map from atom ids to (property_hash, serialised_structure, index_in_atoms)
+        self.atoms = {}
+        # map from instrumentation point ids to (serialised_condition_sequence, reaching_path_length)
+        self.instrumentation_points = {}
+        # maps from instrumentation point ids to the ids of the atom and binding they belong to
+        self.instrumentation_point_atoms = {}
+        self.instrumentation_point_bindings = {}
+        # map from serialised branching conditions to their ids
+        self.condition_ids = {}
+
+    def load(self, cursor):
+        """
+        Read all static metadata from the database.
+        """
+        with self._lock:
+            for row in cursor.execute("select id, fully_qualified_name from function").fetchall():
+                self.add_function(row[0], row[1])
+            for row in cursor.execute("select function, property_hash from function_property_pair").fetchall():
+                self.add_function_property(row[0], row[1])
+            for row in cursor.execute(
+                    "select hash, serialised_structure, index_in_specification_file from property").fetchall():
+                self.add_property(row[0], row[1], row[2])
+            for row in cursor.execute(
+                    "select id, binding_space_index, function, property_hash, binding_statement_lines "
+                    "from binding order by id").fetchall():
+                self.add_binding(row[0], row[1], row[2], row[3], row[4])
+            for row in cursor.execute(
+                    "select id, property_hash, serialised_structure, index_in_atoms from atom").fetchall():
+                self.add_atom(row[0], row[1], row[2], row[3])
+            for row in cursor.execute(
+                    "select id, serialised_condition_sequence, reaching_path_length "
+                    "from instrumentation_point").fetchall():
+                self.add_instrumentation_point(row[0], row[1], row[2])
+            for row in cursor.execute(
+                    "select atom, instrumentation_point from atom_instrumentation_point_pair").fetchall():
+                self.instrumentation_point_atoms[row[1]] = row[0]
+            for row in cursor.execute(
+                    "select binding, instrumentation_point from binding_instrumentation_point_pair").fetchall():
+                self.instrumentation_point_bindings[row[1]] = row[0]
+            # duplicate conditions in older databases have no hash, and are never looked up
+            for row in cursor.execute(
+                    "select id, serialised_condition from path_condition_structure where hash is not null").fetchall():
+                self.add_condition(row[0], row[1])
+            self.loaded = True
+
+    def ensure_loaded(self, cursor):
+        # a write would also read the metadata it has inserted, so the catalog is only loaded outside writes
+        # (lookups during a write fall back to the database until it has been loaded)
+        if not self.loaded and not in_write():
+            self.load(cursor)
+
+    def add_found(self, add, *args):
+        """
+        Add metadata found in the database by a lookup, using the given add_* function, once it's known to
+        have been committed.
+        """
+        if in_write():
+            after_commit(functools.partial(add, *args))
+        else:
+            add(*args)
+
+    # functions to add metadata - these should only be called once the metadata has been committed
+
+    def add_function(self, function_id, fully_qualified_name):
+        with self._lock:
+            self.function_ids[fully_qualified_name] = function_id
+            self.function_names[function_id] = fully_qualified_name
+
+    def add_function_property(self, function_id, property_hash):
+        with self._lock:
+            property_hashes = self.function_properties.setdefault(function_id, [])
+            if property_hash not in property_hashes:
+                property_hashes.append(property_hash)
+
+    def add_property(self, property_hash, serialised_structure, index_in_specification_file):
+        with self._lock:
+            self.properties[property_hash] = (serialised_structure, index_in_specification_file)
+
+    def add_binding(self, binding_id, binding_space_index, function_id, property_hash, binding_statement_lines):
+        with self._lock:
+            # older databases can hold duplicate bindings, of which the first is the one used
+            key = (function_id, property_hash, binding_space_index)
+            self.binding_ids[key] = min(binding_id, self.binding_ids.get(key, binding_id))
+            self.bindings[binding_id] = (binding_space_index, function_id, property_hash, binding_statement_lines)
+
+    def add_atom(self, atom_id, property_hash, serialised_structure, index_in_atoms):
+        with self._lock:
+            self.atom_ids[(property_hash, index_in_atoms)] = atom_id
+            self.atoms[atom_id] = (property_hash, serialised_structure, index_in_atoms)
+
+    def add_instrumentation_point(self, point_id, serialised_condition_sequence, reaching_path_length,
+                                  atom_id=None, binding_id=None):
+        with self._lock:
+            self.instrumentation_points[point_id] = (serialised_condition_sequence, reaching_path_length)
+            if atom_id is not None:
+                self.instrumentation_point_atoms[point_id] = atom_id
+            if binding_id is not None:
+                self.instrumentation_point_bindings[point_id] = binding_id
+
+    def add_condition(self, condition_id, serialised_condition):
+        with self._lock:
+            self.condition_ids[serialised_condition] = condition_id
+
+    def add_instrumentation_point_binding(self, point_id, binding_id):
+        with self._lock:
+            self.instrumentation_point_bindings[point_id] = binding_id
+
+    # lookup functions - each takes a cursor so it can fall back to the database
+
+    def get_function_id(self, cursor, fully_qualified_name):
+        """
+        Given a fully qualified function name, return the function's id, or None if there is no such function.
+        """
+        self.ensure_loaded(cursor)
+        function_id = self.function_ids.get(fully_qualified_name)
+        if function_id is None:
+            row = cursor.execute("select id from function where fully_qualified_name = ?",
+                                 [fully_qualified_name]).fetchone()
+            if row is not None:
+                function_id = row[0]
+                self.add_found(self.add_function, function_id, fully_qualified_name)
+        return function_id
+
+    def get_function_name(self, cursor, function_id):
+        function_id = int(function_id)
+        self.ensure_loaded(cursor)
+        fully_qualified_name = self.function_names.get(function_id)
+        if fully_qualified_name is None:
+            row = cursor.execute("select fully_qualified_name from function where id = ?", [function_id]).fetchone()
+            if row is not None:
+                fully_qualified_name = row[0]
+                self.add_found(self.add_function, function_id, fully_qualified_name)
+        return fully_qualified_name
+
+    def get_property_hashes(self, cursor, function_id):
+        """
+        Given a function id, return the hashes of the properties monitored over that function.
+        """
+        function_id = int(function_id)
+        self.ensure_loaded(cursor)
+        # a property can have been added (by another process) to a function already in the catalog
+        property_hashes = []
+        for row in cursor.execute("select property_hash from function_property_pair where function = ? "
+                                  "order by rowid", [function_id]).fetchall():
+            self.add_found(self.add_function_property, function_id, row[0])
+            property_hashes.append(row[0])
+        return property_hashes
+
+    def get_binding_id(self, cursor, function_id, property_hash, binding_space_index):
+        """
+        Return the id of a binding, or None if there is no such binding.
+        """
+        function_id = int(function_id)
+        binding_space_index = int(binding_space_index)
+        self.ensure_loaded(cursor)
+        key = (function_id, property_hash, binding_space_index)
+        binding_id = self.binding_ids.get(key)
+        if binding_id is None:
+            row = cursor.execute(
+                "select id, binding_statement_lines from binding "
+                "where function = ? and property_hash = ? and binding_space_index = ? order by id limit 1",
+                [function_id, property_hash, binding_space_index]
+            ).fetchone()
+            if row is not None:
+                binding_id = row[0]
+                self.add_found(self.add_binding, binding_id, binding_space_index, function_id, property_hash, row[1])
+        return binding_id
+
+    def get_binding(self, cursor, binding_id):
+        """
+        Return (binding_space_index, function, property_hash, binding_statement_lines) for a binding id.
+        """
+        binding_id = int(binding_id)
+        self.ensure_loaded(cursor)
+        binding = self.bindings.get(binding_id)
+        if binding is None:
+            row = cursor.execute(
+                "select binding_space_index, function, property_hash, binding_statement_lines "
+                "from binding where id = ?", [binding_id]
+            ).fetchone()
+            if row is not None:
+                binding = tuple(row)
+                self.add_found(self.add_binding, binding_id, *binding)
+        return binding
+
+    def get_bindings_of_function(self, cursor, function_id, property_hash):
+        """
+        Return the ids of the bindings of the given function and property.
+        """
+        function_id = int(function_id)
+        self.ensure_loaded(cursor)
+        # a binding can have been added (by another process) to a function and property already in the catalog
+        binding_ids = []
+        for row in cursor.execute(
+                "select id, binding_space_index, binding_statement_lines from binding "
+                "where function = ? and property_hash = ? order by id", [function_id, property_hash]).fetchall():
+            self.add_found(self.add_binding, row[0], row[1], function_id, property_hash, row[2])
+            binding_ids.append(row[0])
+        return binding_ids
+
+    def get_atom_structure(self, cursor, property_hash, index_in_atoms):
+        """
+        Return the serialised structure of the atom at the given index in the given property.
+        """
+        index_in_atoms = int(index_in_atoms)
+        self.ensure_loaded(cursor)
+        atom_id = self.atom_ids.get((property_hash, index_in_atoms))
+        if atom_id is None:
+            row = cursor.execute(
+                "select id, serialised_structure from atom where property_hash = ? and index_in_atoms = ?",
+                [property_hash, index_in_atoms]
+            ).fetchone()
+            if row is None:
+                return None
+            self.add_found(self.add_atom, row[0], property_hash, row[1], index_in_atoms)
+            return row[1]
+        return self.atoms[atom_id][1]
+
+    def get_instrumentation_point(self, cursor, point_id):
+        """
+        Return (serialised_condition_sequence, reaching_path_length) for an instrumentation point id.
+        """
+        point_id = int(point_id)
+        self.ensure_loaded(cursor)
+        instrumentation_point = self.instrumentation_points.get(point_id)
+        if instrumentation_point is None:
+            row = cursor.execute(
+                "select serialised_condition_sequence, reaching_path_length from instrumentation_point "
+                "where id = ?", [point_id]
+            ).fetchone()
+            if row is not None:
+                instrumentation_point = tuple(row)
+                self.add_found(self.add_instrumentation_point, point_id, *instrumentation_point)
+        return instrumentation_point
+
+    def get_condition_id(self, cursor, serialised_condition):
+        """
+        Return the id of a branching condition, or None if the condition hasn't been inserted.
+        """
+        self.ensure_loaded(cursor)
+        condition_id = self.condition_ids.get(serialised_condition)
+        if condition_id is None:
+            row = cursor.execute("select id from path_condition_structure where hash = ?",
+                                 [content_hash(serialised_condition)]).fetchone()
+            if row is not None:
+                condition_id = row[0]
+                self.add_found(self.add_condition, condition_id, serialised_condition)
+        return condition_id
+
+    def get_property_hash_of_instrumentation_point(self, cursor, point_id):
+        """
+        Return the hash of the property for which an instrumentation point was placed.
+        """
+        point_id = int(point_id)
+        self.ensure_loaded(cursor)
+        binding_id = self.instrumentation_point_bindings.get(point_id)
+        if binding_id is None:
+            row = cursor.execute(
+                "select binding from binding_instrumentation_point_pair where instrumentation_point = ?",
+                [point_id]
+            ).fetchone()
+            if row is None:
+                return None
+            binding_id = row[0]
+            self.add_found(self.add_instrumentation_point_binding, point_id, binding_id)
+        binding = self.get_binding(cursor, binding_id)
+        return binding[2] if binding else None
+
+
+catalog = Catalog()
+
+
+def load_catalog():
+    """
+    Load the catalog from the verdict database, so that the first requests don't have to.
+    """
+    connection = get_connection()
+    catalog.load(connection.cursor())
+    connection.close()
@@ -0,0 +1,122 @@
+"""
+Module to provide the compact wire format for verdict and function call payloads.
+
+The json payloads sent by VyPR hold observations in nested dictionaries keyed by stringified indices.
+The compact format instead uses msgpack-encoded arrays, so that the rows to be inserted can be built
+straight from the decoded payload.
+
+A compact function call payload is the array
+    [transaction_time, function_name, time_of_call, end_time_of_call, program_path]
+to which an array of [property_hash, verdicts] pairs is appended when the verdicts are sent with the call,
+and a compact verdict payload is the array
+    [function_call_id, function_id, property_hash, verdicts]
+where each element of verdicts is
+    [bind_space_index, verdict, time_obtained, collapsing_atom_index, collapsing_atom_sub_index, observations]
+and each element of observations is
+    [atom_index, sub_index, instrumentation_point, observed_value, observation_time, observation_end_time,
+     previous_condition_offset, assignments]
+with assignments a (possibly empty) array of [variable, value] pairs.
+"""
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .writer import execute_write
+from .spool import get_spool
+from .catalog import catalog
+from .insertion import insert_verdict_rows, get_assignment_id
+from .values import typed_observation_values
+
+compact_content_type = "application/x-vypr-compact"
+
+
+def compact_format_available():
+    return msgpack is not None
+
+
+def decode_compact(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def encode_compact(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def decode_compact_function_call(data):
+    """
+    Given a compact function call payload, return call data of the form accepted by insert_function_call_data
+    (or insert_function_call_and_verdicts, if the payload holds verdicts).
+    """
+    call_array = decode_compact(data)
+    call_data = {
+        "transaction_time": call_array[0],
+        "function_name": call_array[1],
+        "time_of_call": call_array[2],
+        "end_time_of_call": call_array[3],
+        "program_path": call_array[4]
+    }
+    if len(call_array) > 5:
+        call_data["property_verdicts"] = call_array[5]
+    return call_data
+
+
+def insert_compact_verdicts(verdict_array):
+    """
+    Given a decoded compact verdict payload, insert its verdicts along with their observations and assignments.
+    """
+    execute_write(write_compact_verdicts, verdict_array, wait=False)
+
+
+def spool_compact_verdicts(verdict_array):
+    """
+    Append a decoded compact verdict payload to the spool.
+    Returns whether the verdicts were spooled - if the spool is full, they are inserted before returning.
+    """
+    if get_spool().append("compact_verdicts", verdict_array):
+        return True
+    execute_write(write_compact_verdicts, verdict_array)
+    return False
+
+
+def write_compact_verdicts(cursor, verdict_array):
+    insert_verdict_rows(cursor, [prepare_compact_verdict_rows(cursor, verdict_array)])
+
+
+def prepare_compact_verdict_rows(cursor, verdict_array, assignment_ids=None):
+    """
+    Build the same rows as prepare_verdict_rows, from a decoded compact verdict payload.
+    """
+    if assignment_ids is None:
+        assignment_ids = {}
+
+    (function_call_id, function_id, property_hash, verdicts) = verdict_array
+    rows = []
+
+    for (bind_space_index, verdict_value, verdict_time_obtained, collapsing_atom_index, collapsing_atom_sub_index,
+         observations) in verdicts:
+
+        binding_id = catalog.get_binding_id(cursor, function_id, property_hash, bind_space_index)
+        if binding_id is None:
+            raise Exception(
+                "No binding was found at index %i for function ID %i and property hash '%s'" %
+                (bind_space_index, function_id, property_hash)
+            )
+
+        verdict_row = [binding_id, verdict_value, verdict_time_obtained, function_call_id,
+                       collapsing_atom_index, collapsing_atom_sub_index]
+
+        observation_rows = []
+        for (atom_index, sub_index, instrumentation_point, observed_value, observation_time, observation_end_time,
+             previous_condition_offset, assignments) in observations:
+            observation_row = [instrumentation_point, str(observed_value), observation_time, observation_end_time,
+                               previous_condition_offset, atom_index, sub_index] + \
+                list(typed_observation_values(observed_value))
+            observation_assignment_ids = [
+                get_assignment_id(cursor, variable, value, assignment_ids) for (variable, value) in assignments
+            ]
+            observation_rows.append((observation_row, observation_assignment_ids))
+
+        rows.append((verdict_row, observation_rows))
+
+    return rows
@@ -0,0 +1,219 @@
+"""
+Module to compact old observations into aggregates.
+
+Observations made before a cutoff are replaced, in small batches, by rows of observation_aggregate holding
+the number of observations, the number belonging to violations, and the minimum, maximum and sum of their
+numeric values, for each instrumentation point, atom, sub-atom, binding and bucket of app.compaction_bucket_size
+seconds.  Observations are compacted by observation_time_us, so the cutoff and buckets are in UTC.
+The links between compacted observations and assignments are removed with them, but assignments themselves
+are kept, since they are shared with newer observations (and held by the insertion cache).
+
+Each batch is applied as one write through the writer module, so ingestion waits for at most one batch.
+Summaries over time (see list_observation_summary) combine the aggregates with observations that haven't been
+compacted, bucketed in the same way, so they are unaffected by compaction.
+"""
+import datetime
+import threading
+import time
+import traceback
+
+import app
+from .values import timestamp_to_microseconds
+from .writer import execute_write
+from .partition import get_table_schemas
+from .utils import get_connection
+
+
+def get_bucket_start_us(column):
+    """
+    Return an SQL expression for the start of the bucket holding the time in the given column, which holds
+    microseconds since the epoch.  The expression is null if the column is.
+    """
+    bucket_size_us = app.compaction_bucket_size * 1000000
+    return "strftime('%%Y-%%m-%%dT%%H:%%M:%%S', (%s / %i) * %i, 'unixepoch')" % (
+        column, bucket_size_us, app.compaction_bucket_size
+    )
+
+
+def write_compaction_batch(cursor, batch):
+    """
+    Given a (cutoff, batch size) pair, the cutoff in microseconds since the epoch, compact up to that many
+    observations made before the cutoff.  Returns the number of observations compacted.
+    """
+    (cutoff, batch_size) = batch
+    cursor.execute("create temp table if not exists compaction_batch (id integer not null primary key)")
+
+    # with the partitioned storage engine, observations are held by each attached partition
+    for schema in get_table_schemas(cursor, "observation"):
+        cursor.execute("delete from temp.compaction_batch")
+        # the oldest observations are read from the index on observation_time_us, so the last batch of a pass
+        # reads no more than the first observation that is kept.  Observations without a time (which would have
+        # no bucket) are never selected, so they're never removed without being counted in an aggregate
+        cursor.execute(
+            "insert into temp.compaction_batch (id) select id from %s.observation "
+            "where observation_time_us < ? order by observation_time_us limit ?" % schema,
+            [cutoff, batch_size]
+        )
+        compacted = cursor.execute("select count(*) from temp.compaction_batch").fetchone()[0]
+        if compacted == 0:
+            continue
+
+        aggregates = cursor.execute(
+            """select observation.instrumentation_point, observation.atom_index, observation.sub_index,
+            verdict.binding, %s, count(*), sum(case when verdict.verdict = 0 then 1 else 0 end),
+            min(observation.numeric_value), max(observation.numeric_value), sum(observation.numeric_value)
+            from %s.observation as observation inner join verdict on observation.verdict = verdict.id
+            where observation.id in (select id from temp.compaction_batch)
+            group by 1, 2, 3, 4, 5""" % (get_bucket_start_us("observation.observation_time_us"), schema)
+        ).fetchall()
+        for (point, atom_index, sub_index, binding, bucket_start, count, violations, min_value, max_value,
+             sum_value) in aggregates:
+            cursor.execute(
+                "insert or ignore into observation_aggregate (instrumentation_point, atom_index, sub_index, "
+                "binding, bucket_start, observation_count, violation_count, min_value, max_value, sum_value) "
+                "values(?, ?, ?, ?, ?, 0, 0, null, null, null)",
+                [point, atom_index, sub_index, binding, bucket_start]
+            )
+            cursor.execute(
+                """update observation_aggregate set observation_count = observation_count + ?,
+                violation_count = violation_count + ?,
+                min_value = coalesce(min(min_value, ?), min_value, ?),
+                max_value = coalesce(max(max_value, ?), max_value, ?),
+                sum_value = coalesce(sum_value + ?, sum_value, ?)
+                where instrumentation_point = ? and atom_index = ? and sub_index = ? and binding = ?
+                and bucket_start = ?""",
+                [count, violations, min_value, min_value, max_value, max_value, sum_value, sum_value,
+                 point, atom_index, sub_index, binding, bucket_start]
+            )
+
+        cursor.execute("delete from %s.observation_assignment_pair "
+                       "where observation in (select id from temp.compaction_batch)" % schema)
+        cursor.execute("delete from %s.observation where id in (select id from temp.compaction_batch)" % schema)
+        return compacted
+
+    return 0
+
+
+def compact_observations(cutoff, batch_size=None):
+    """
+    Compact every observation made before the cutoff (a timestamp, treated as UTC if it has no time zone),
+    one batch at a time.  Returns the number of observations compacted.
+    """
+    if batch_size is None:
+        batch_size = app.compaction_batch_size
+    cutoff_us = timestamp_to_microseconds(cutoff)
+    if cutoff_us is None:
+        raise ValueError("The compaction cutoff '%s' isn't a timestamp." % cutoff)
+    total = 0
+    while True:
+        compacted = execute_write(write_compaction_batch, [cutoff_us, batch_size])
+        if compacted == 0:
+            return total
+        total += compacted
+
+
+def get_retention_cutoff():
+    # observation times without a time zone are taken to be in UTC
+    return (datetime.datetime.utcnow() - datetime.timedelta(days=app.observation_retention_days)).isoformat()
+
+
+compaction_thread = None
+
+
+def run_compaction():
+    while True:
+        try:
+            compacted = compact_observations(get_retention_cutoff())
+            if compacted > 0:
+                print("Compacted %i observations" % compacted)
+        except:
+            print("ERROR OCCURRED DURING COMPACTION:")
+            traceback.print_exc()
+        time.sleep(app.compaction_interval)
+
+
+def start_compaction():
+    """
+    Start compacting observations older than app.observation_retention_days every app.compaction_interval seconds,
+    if a retention period is set.
+    """
+    global compaction_thread
+    if app.observation_retention_days is None or compaction_thread is not None:
+        return
+    compaction_thread = threading.Thread(target=run_compaction)
+    compaction_thread.daemon = True
+    compaction_thread.start()
+
+
+def list_compacted_observations(cursor, point_ids, atom_index, sub_index, call_ids, binding_index):
+    """
+    Return rows of the form (value, start time, end time, verdict) standing in for observations of the given atom
+    at the given instrumentation points that were made for the binding with the given index during the given calls,
+    but have been compacted.  Aggregates don't record the calls during which their observations were made, so each
+    bucket overlapping one of the calls is given, by the mean of its values, and is false if it holds a violation.
+    """
+    call_list = ", ".join(["?"] * len(call_ids))
+    bucket_start_us = "cast(strftime('%s', observation_aggregate.bucket_start) as integer) * 1000000"
+    return cursor.execute(
+        """select sum_value / observation_count, bucket_start, bucket_start,
+        case when violation_count > 0 then 0 else 1 end
+        from observation_aggregate
+        where instrumentation_point in (%s) and atom_index = ? and sub_index = ? and sum_value is not null
+        and binding in (select binding.id from binding where binding.binding_space_index = ?
+                        and binding.function in (select function from function_call where id in (%s)))
+        and exists (select 1 from function_call where function_call.id in (%s)
+                    and function_call.time_of_call_us < %s + %i and function_call.end_time_of_call_us >= %s)""" %
+        (", ".join(["?"] * len(point_ids)), call_list, call_list, bucket_start_us,
+         app.compaction_bucket_size * 1000000, bucket_start_us),
+        list(point_ids) + [atom_index, sub_index, binding_index] + list(call_ids) + list(call_ids)
+    ).fetchall()
+
+
+def list_observation_summary(point_id, atom_index, start=None, end=None):
+    """
+    Summarise the observations of the given atom at the given instrumentation point in buckets of
+    app.compaction_bucket_size seconds, between the (optional) start and end timestamps,
+    combining observations that haven't been compacted with the aggregates of those that have.
+    Both are bucketed by observation_time_us, in UTC, so an observation is counted in the same bucket before
+    and after it's compacted.
+    Returns a list of dictionaries, ordered by bucket.
+    """
+    # numbers smaller and larger than any time in microseconds stand in for a missing start or end
+    start_us = timestamp_to_microseconds(start) if start is not None else -2 ** 62
+    end_us = timestamp_to_microseconds(end) if end is not None else 2 ** 62
+    # partitions are chosen by comparing full timestamps with their periods
+    time_range = None
+    if start is not None or end is not None:
+        time_range = (start if start is not None else "0001-01-01T00:00:00",
+                      end if end is not None else "9999-12-31T23:59:59")
+    connection = get_connection(time_range=time_range)
+    cursor = connection.cursor()
+    rows = cursor.execute(
+        """select bucket_start, sum(observation_count), sum(violation_count), min(min_value), max(max_value),
+        sum(sum_value) from (
+            select %s as bucket_start, count(*) as observation_count,
+            sum(case when verdict.verdict = 0 then 1 else 0 end) as violation_count,
+            min(observation.numeric_value) as min_value, max(observation.numeric_value) as max_value,
+            sum(observation.numeric_value) as sum_value
+            from observation inner join verdict on observation.verdict = verdict.id
+            where observation.instrumentation_point = ? and observation.atom_index = ?
+            and observation.observation_time_us >= ? and observation.observation_time_us < ?
+            group by 1
+            union all
+            select bucket_start, observation_count, violation_count, min_value, max_value, sum_value
+            from observation_aggregate
+            where instrumentation_point = ? and atom_index = ?
+            and cast(strftime('%%s', bucket_start) as integer) * 1000000 >= ?
+            and cast(strftime('%%s', bucket_start) as integer) * 1000000 < ?
+        ) group by bucket_start order by bucket_start""" % get_bucket_start_us("observation.observation_time_us"),
+        [point_id, atom_index, start_us, end_us, point_id, atom_index, start_us, end_us]
+    ).fetchall()
+    connection.close()
+    return [{
+        "bucket_start": bucket_start,
+        "count": count,
+        "violations": violations,
+        "min": min_value,
+        "max": max_value,
+        "sum": sum_value
+    } for (bucket_start, count, violations, min_value, max_value, sum_value) in rows]
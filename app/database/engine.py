@@ -0,0 +1,98 @@
+"""
+Module to provide the storage engines behind the verdict database.
+
+All access to the verdict database goes through connections opened by the engine chosen by app.storage_engine,
+so an engine only has to provide connections that accept the SQL used by this package (another engine,
+such as a server-based SQL database, can be added to storage_engines).
+"""
+import os
+import sqlite3
+import threading
+
+import app
+
+schema_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           "verdict-schema.sql")
+
+
+class SQLiteEngine(object):
+    """
+    Verdicts stored in the sqlite database file app.database_string.
+    """
+
+    def __init__(self, database_string):
+        self.database_string = database_string
+
+    def connect(self):
+        # connections are only ever used by one thread at a time, but not always the thread that opened them
+        return sqlite3.connect(self.database_string, check_same_thread=False)
+
+    def prepare(self, connection, time_range=None, group=None):
+        """
+        Prepare a connection for a query over the given time range (a pair of timestamps), or over the given group
+        of partitions - this is only needed by engines that store rows from different times separately.
+        """
+        pass
+
+    def partition_groups(self, time_range=None, query_string=None):
+        """
+        Return the groups of partitions over which a query must be run in turn, to read every row it selects
+        (see PartitionedEngine.partition_groups).  Verdicts are stored in one database here, so there's one group.
+        """
+        return [None]
+
+    def upgrade(self):
+        """
+        Bring anything stored outside of the verdict database up to date, once its migrations have been applied -
+        this is only needed by engines that store rows from different times separately.
+        """
+        pass
+
+
+class MemoryEngine(SQLiteEngine):
+    """
+    Verdicts held in memory by sqlite, in a database created from verdict-schema.sql that lasts as long as the process.
+    Nothing is written to disk, so this suits benchmarks and short-lived monitoring runs.
+    Requires sqlite 3.36 or later, so that each connection sees the same database.
+    """
+
+    def __init__(self, database_string):
+        if sqlite3.sqlite_version_info < (3, 36, 0):
+            raise Exception("The memory storage engine requires sqlite 3.36 or later (found %s)" %
+                            sqlite3.sqlite_version)
+        super(MemoryEngine, self).__init__(database_string)
+        # the database is discarded when its last connection is closed, so one is held open
+        self._connection = self.connect()
+        with open(schema_path) as schema_file:
+            self._connection.executescript(schema_file.read())
+        self._connection.commit()
+
+    def connect(self):
+        return sqlite3.connect("file:/%s?vfs=memdb" % self.database_string.lstrip("/"), uri=True,
+                               check_same_thread=False)
+
+
+# imported here, since the partitioned engine builds on SQLiteEngine
+from .partition import PartitionedEngine
+
+storage_engines = {
+    "sqlite": SQLiteEngine,
+    "memory": MemoryEngine,
+    "partitioned": PartitionedEngine
+}
+
+engines = {}
+engines_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Get the engine holding the verdict database named by app.database_string, creating it if necessary.
+    """
+    key = (app.storage_engine, app.database_string)
+    with engines_lock:
+        engine = engines.get(key)
+        if engine is None:
+            engine = storage_engines[app.storage_engine](app.database_string)
+            engines[key] = engine
+    return engine
@@ -1,46 +1,88 @@
 """
 Module to provide functions for verdict database insertion.
+
+Each insert_* function hands a write_* function to the writer module, which either runs it straight away
+in its own transaction or queues it for the background writer.  The write_* functions only use the cursor
+they are given and never commit, so several of them can share one transaction.
+The spool_* functions are used instead of the insert_* functions in the "spooled" ingestion mode.
 """
+from .writer import execute_write, after_commit, transaction_state
+from .spool import get_spool
+from .cache import LRUCache
+from .catalog import catalog
+from .schema import content_hash
+from .values import typed_observation_values, timestamp_to_microseconds
+from .partition import get_insert_table, get_table_schemas
 from .utils import get_connection
+import app
+import functools
 import json
 import traceback
 import pickle
 
+# map from (variable, serialised value) pairs to assignment ids
+assignment_cache = LRUCache(app.assignment_cache_size)
+# map from transaction times to the ids of recent transactions
+transaction_cache = LRUCache(app.transaction_cache_size)
+# map from serialised sequences of path condition ids to program path ids
+program_path_cache = LRUCache(app.program_path_cache_size)
+
 
 def insert_function_call_data(call_data):
     """
     Given function call data, create the transaction, function call and program path.
     """
+    return execute_write(write_function_call_data, call_data)
+
+
+def insert_function_call_and_verdicts(call_data):
+    """
+    Given function call data along with the verdicts obtained during the call, insert the transaction,
+    function call and verdicts in one transaction.
+    """
+    return execute_write(write_function_call_and_verdicts, call_data)
+
+
+def spool_function_call_data(call_data, kind="function_call"):
+    """
+    Given function call data, allocate the function call's id and append the data to the spool.
+    Returns the insertion result and whether the data was spooled - if the spool is full,
+    the insertion is performed before returning.
+    kind is either "function_call", or "function_call_and_verdicts" if call_data also holds verdicts.
+    """
+    spool = get_spool()
+
     connection = get_connection()
-    cursor = connection.cursor()
+    function_id = catalog.get_function_id(connection.cursor(), call_data["function_name"])
+    connection.close()
+    if function_id is None:
+        raise Exception(
+            "Function '%s' not found.  The problem is probably that instrumentation was not run." %
+            call_data["function_name"]
+        )
+
+    call_data = dict(call_data, function_call_id=spool.allocate_function_call_id())
+    if spool.append(kind, call_data):
+        return {"function_call_id": call_data["function_call_id"], "function_id": function_id}, True
+    if kind == "function_call":
+        return execute_write(write_function_call_data, call_data), False
+    return execute_write(write_function_call_and_verdicts, call_data), False
 
+
+def write_function_call_data(cursor, call_data):
+    """
+    If call_data contains a function_call_id (allocated by the spool), the function call is inserted with that id.
+    """
     # insert transaction
     # since this data is received from the monitored service potentially
-    # multiple times per transaction, we have to check whether a transaction
-    # already exists in the database
-
-    transactions = cursor.execute("select * from trans where time_of_transaction = ?",
-                                  [call_data["transaction_time"]]).fetchall()
-    if len(transactions) == 0:
-        cursor.execute("insert into trans (time_of_transaction) values(?)",
-                       [call_data["transaction_time"]])
-        transaction_id = cursor.lastrowid
-        connection.commit()
-    else:
-        transaction_id = transactions[0][0]
-
-    # insert call
+    # multiple times per transaction, the transaction may already exist
 
-    try:
+    transaction_id = get_transaction_id(cursor, call_data["transaction_time"])
 
-        function_id = cursor.execute(
-            "select id from function where fully_qualified_name = ?",
-            [
-                call_data["function_name"]
-            ]
-        ).fetchall()[0][0]
+    # insert call
 
-    except Exception:
+    function_id = catalog.get_function_id(cursor, call_data["function_name"])
+    if function_id is None:
         raise Exception(
             "Function '%s' not found.  The problem is probably that instrumentation was not run." %
             call_data["function_name"]
@@ -50,48 +92,205 @@ def insert_function_call_data(call_data):
 
     program_path = call_data["program_path"]
 
-    # check for the empty condition
-    empty_condition = cursor.execute(
-        "select * from path_condition_structure where serialised_condition = ''").fetchall()
-    if len(empty_condition) == 0:
-        cursor.execute("insert into path_condition_structure (serialised_condition) values('')")
-        empty_condition_id = cursor.lastrowid
-    else:
-        empty_condition_id = empty_condition[0][0]
+    # find the empty condition
+    empty_condition_id = get_condition_id(cursor, "")
 
     new_program_path = [empty_condition_id] + program_path
+    program_path_id = get_program_path_id(cursor, json.dumps(new_program_path))
 
     # perform the function call insertion
+    # the sequence is held by the program path, so path_condition_id_sequence is left empty
+    # the id is allocated here, since the database may not allocate ids (see get_next_id)
 
-    cursor.execute(
-        "insert into function_call (function, time_of_call, end_time_of_call, trans, path_condition_id_sequence)"
-        "values(?, ?, ?, ?, ?)",
-        [function_id, call_data["time_of_call"], call_data["end_time_of_call"], transaction_id,
-         json.dumps(new_program_path)])
-    function_call_id = cursor.lastrowid
+    function_call_id = call_data.get("function_call_id")
+    if function_call_id is None:
+        function_call_id = get_next_id(cursor, "function_call")
 
-    connection.commit()
-    connection.close()
+    time_of_call_us = timestamp_to_microseconds(call_data["time_of_call"])
+    end_time_of_call_us = timestamp_to_microseconds(call_data["end_time_of_call"])
+    duration_us = end_time_of_call_us - time_of_call_us \
+        if time_of_call_us is not None and end_time_of_call_us is not None else None
+
+    cursor.execute(
+        "insert into %s (id, function, time_of_call, end_time_of_call, trans, path_condition_id_sequence,"
+        " program_path, time_of_call_us, end_time_of_call_us, duration_us) values(?, ?, ?, ?, ?, '', ?, ?, ?, ?)" %
+        get_insert_table(cursor, "function_call"),
+        [function_call_id, function_id, call_data["time_of_call"], call_data["end_time_of_call"],
+         transaction_id, program_path_id, time_of_call_us, end_time_of_call_us, duration_us])
 
     return {"function_call_id": function_call_id, "function_id": function_id}
 
 
+def write_function_call_and_verdicts(cursor, call_data):
+    """
+    call_data["property_verdicts"] holds a verdict dictionary of the form accepted by insert_verdicts for each
+    property monitored over the call, without the function_call_id and function_id, which are filled in here.
+    Each element can instead be a [property_hash, verdicts] array in the compact format.
+    """
+    from .compact import prepare_compact_verdict_rows
+
+    insertion_result = write_function_call_data(cursor, call_data)
+    function_call_id = insertion_result["function_call_id"]
+    function_id = insertion_result["function_id"]
+
+    prepared_rows = []
+    assignment_ids = {}
+    for property_verdicts in call_data["property_verdicts"]:
+        if isinstance(property_verdicts, dict):
+            verdict_dictionary = dict(property_verdicts, function_call_id=function_call_id, function_id=function_id)
+            prepared_rows.append(prepare_verdict_rows(cursor, verdict_dictionary, assignment_ids))
+        else:
+            (property_hash, verdicts) = property_verdicts
+            prepared_rows.append(prepare_compact_verdict_rows(
+                cursor, [function_call_id, function_id, property_hash, verdicts], assignment_ids
+            ))
+
+    insert_verdict_rows(cursor, prepared_rows)
+
+    return insertion_result
+
+
+def get_transaction_id(cursor, time_of_transaction):
+    """
+    Given the time of a transaction, find the ID of the transaction, inserting it if needed.
+    Recent transactions are held in the transaction cache, and the unique index on trans(time_of_transaction)
+    means the insertion is ignored for an existing transaction.
+    """
+    transaction_id = transaction_cache.get(time_of_transaction)
+    if transaction_id is not None:
+        return transaction_id
+
+    cursor.execute("insert or ignore into trans (time_of_transaction, time_of_transaction_us) values(?, ?)",
+                   [time_of_transaction, timestamp_to_microseconds(time_of_transaction)])
+    if cursor.rowcount == 1:
+        transaction_id = cursor.lastrowid
+    else:
+        transaction_id = cursor.execute("select id from trans where time_of_transaction = ?",
+                                        [time_of_transaction]).fetchone()[0]
+
+    after_commit(functools.partial(transaction_cache.put, time_of_transaction, transaction_id))
+
+    return transaction_id
+
+
+def get_program_path_id(cursor, path_condition_id_sequence):
+    """
+    Given a serialised sequence of path condition ids, find the ID of the program path, inserting it if needed.
+    """
+    program_path_id = program_path_cache.get(path_condition_id_sequence)
+    if program_path_id is not None:
+        return program_path_id
+
+    hash = content_hash(path_condition_id_sequence)
+    cursor.execute("insert or ignore into program_path (hash, path_condition_id_sequence) values(?, ?)",
+                   [hash, path_condition_id_sequence])
+    if cursor.rowcount == 1:
+        program_path_id = cursor.lastrowid
+    else:
+        program_path_id = cursor.execute("select id from program_path where hash = ?", [hash]).fetchone()[0]
+
+    after_commit(functools.partial(program_path_cache.put, path_condition_id_sequence, program_path_id))
+
+    return program_path_id
+
+
 def insert_verdicts(verdict_dictionary):
-    connection = get_connection()
-    cursor = connection.cursor()
+    """
+    Given the verdicts obtained during a single function call, insert them along with their observations
+    and assignments.
+    Nothing is returned, so when the background writer is in use we don't wait for the insertion.
+    """
+    execute_write(write_verdicts, verdict_dictionary, wait=False)
+
+
+def spool_verdicts(verdict_dictionary):
+    """
+    Append the verdicts obtained during a single function call to the spool.
+    Returns whether the verdicts were spooled - if the spool is full, they are inserted before returning.
+    """
+    if get_spool().append("verdicts", verdict_dictionary):
+        return True
+    execute_write(write_verdicts, verdict_dictionary)
+    return False
+
+
+def write_verdicts(cursor, verdict_dictionary):
+    insert_verdict_rows(cursor, [prepare_verdict_rows(cursor, verdict_dictionary)])
+
+
+def insert_verdicts_batch(verdict_dictionaries):
+    """
+    Given a list of verdict dictionaries, each of the form accepted by insert_verdicts,
+    insert the verdicts for all function calls in a single transaction.
+    Returns a list containing a status dictionary for each function call, in the order given.
+    """
+    try:
+        return execute_write(write_verdicts_batch, verdict_dictionaries)
+    except:
+        print("ERROR OCCURRED DURING INSERTION:")
+        traceback.print_exc()
+        return [
+            {
+                "function_call_id": verdict_dictionary.get("function_call_id"),
+                "status": "failure",
+                "error": "The batch could not be committed."
+            }
+            for verdict_dictionary in verdict_dictionaries
+        ]
+
+
+def write_verdicts_batch(cursor, verdict_dictionaries):
+    statuses = []
+    prepared_rows = []
+    assignment_ids = {}
+
+    for verdict_dictionary in verdict_dictionaries:
+        status = {"function_call_id": verdict_dictionary.get("function_call_id")}
+        # each call is prepared inside its own savepoint, so a call that fails leaves no assignments behind,
+        # and the cache callbacks and assignment ids it registered are discarded along with them
+        cursor.execute("savepoint verdict_batch_call")
+        callback_count = len(transaction_state.callbacks)
+        call_assignment_ids = dict(assignment_ids)
+        try:
+            prepared_rows.append(prepare_verdict_rows(cursor, verdict_dictionary, call_assignment_ids))
+            cursor.execute("release verdict_batch_call")
+            assignment_ids = call_assignment_ids
+            status["status"] = "success"
+        except Exception as e:
+            # the rest of the batch can still be inserted
+            cursor.execute("rollback to verdict_batch_call")
+            cursor.execute("release verdict_batch_call")
+            del transaction_state.callbacks[callback_count:]
+            status["status"] = "failure"
+            status["error"] = str(e)
+        statuses.append(status)
+
+    insert_verdict_rows(cursor, prepared_rows)
+
+    return statuses
+
+
+def prepare_verdict_rows(cursor, verdict_dictionary, assignment_ids=None):
+    """
+    Given the verdicts obtained during a single function call, resolve bindings and assignments and
+    build the rows to be inserted into the verdict, observation and observation_assignment_pair tables.
+    Verdict and observation rows are built without ids - these are allocated by insert_verdict_rows.
+    assignment_ids is an optional map from (variable, serialised value) pairs to assignment ids found
+    earlier in the same write.
+    """
+    if assignment_ids is None:
+        assignment_ids = {}
 
     function_call_id = verdict_dictionary["function_call_id"]
+    rows = []
 
     for verdict in verdict_dictionary["verdicts"]:
 
         # use the binding space index and the function id to get the binding id
-        try:
-            results = cursor.execute(
-                "select * from binding where binding_space_index = ? and function = ? and property_hash = ?",
-                [verdict["bind_space_index"], verdict_dictionary["function_id"], verdict_dictionary["property_hash"]]
-            ).fetchall()
-            new_binding_id = int(results[0][0])
-        except:
+        new_binding_id = catalog.get_binding_id(
+            cursor, verdict_dictionary["function_id"], verdict_dictionary["property_hash"], verdict["bind_space_index"]
+        )
+        if new_binding_id is None:
             raise Exception(
                 "No binding was found at index %i for function ID %i and property hash '%s'" %
                 (verdict["bind_space_index"], verdict_dictionary["function_id"], verdict_dictionary["property_hash"])
@@ -106,77 +305,169 @@ def insert_verdicts(verdict_dictionary):
         collapsing_atom_sub_index = verdict["verdict"][5]
         atom_to_state_dict_map = verdict["verdict"][6]
 
-        # create the verdict
         # we don't check for an existing verdict - there won't be repetitions here
-        cursor.execute(
-            "insert into verdict (binding, verdict, time_obtained, function_call, collapsing_atom,"
-            "collapsing_atom_sub_index) values (?, ?, ?, ?, ?, ?)",
-            [new_binding_id, verdict_value, verdict_time_obtained, function_call_id, collapsing_atom_index,
-             collapsing_atom_sub_index])
-        new_verdict_id = cursor.lastrowid
+        verdict_row = [new_binding_id, verdict_value, verdict_time_obtained, function_call_id,
+                       collapsing_atom_index, collapsing_atom_sub_index]
 
+        observation_rows = []
         for atom_index in observations_map:
-            # insert observation(s) for this atom_index
             for sub_index in observations_map[atom_index].keys():
+                observation = observations_map[atom_index][sub_index]
                 last_condition = path_map[atom_index][sub_index]
-                cursor.execute(
-                    "insert into observation (instrumentation_point, verdict, observed_value, observation_time, "
-                    "observation_end_time, previous_condition_offset, atom_index, sub_index) "
-                    "values(?, ?, ?, ?, ?, ?, ?, ?)",
-                    [observations_map[atom_index][sub_index][1], new_verdict_id,
-                     str(observations_map[atom_index][sub_index][0]), observations_map[atom_index][sub_index][2],
-                     observations_map[atom_index][sub_index][3], last_condition, atom_index, sub_index]
-                )
-                observation_id = cursor.lastrowid
-
-                # insert assignments (if they don't exist yet), and link them
-                # to the observation we just inserted
+                observation_row = [observation[1], str(observation[0]), observation[2], observation[3],
+                                   last_condition, atom_index, sub_index] + \
+                    list(typed_observation_values(observation[0]))
 
+                # find assignments (inserting them if they don't exist yet) to link to the observation
+                observation_assignment_ids = []
                 state_dict = atom_to_state_dict_map[atom_index][sub_index]
                 if state_dict:
                     for var in state_dict.keys():
-                        # check if this assignment already exists
-                        assignments = cursor.execute(
-                            "select id from assignment where variable = ? and value = ?",
-                            [var, pickle.dumps(state_dict[var])]
-                        ).fetchall()
-
-                        # either take the existing ID, or insert a new assignment and use the new ID
-                        if len(assignments) > 0:
-                            # the assignment already exists - get its ID and link it to the observation
-                            assignment_id = assignments[0][0]
-                        else:
-                            # create a new assignment
-                            cursor.execute(
-                                "insert into assignment (variable, value, type) values(?, ?, ?)",
-                                [var, pickle.dumps(state_dict[var]), str(type(state_dict[var]))]
-                            )
-                            assignment_id = cursor.lastrowid
-
-                        # insert the link
-                        cursor.execute(
-                            "insert into observation_assignment_pair (observation, assignment) values(?, ?)",
-                            [observation_id, assignment_id]
+                        observation_assignment_ids.append(
+                            get_assignment_id(cursor, var, state_dict[var], assignment_ids)
                         )
 
-        # commit for this verdict
-        connection.commit()
+                observation_rows.append((observation_row, observation_assignment_ids))
+
+        rows.append((verdict_row, observation_rows))
+
+    return rows
+
+
+def get_assignment_id(cursor, variable, value, assignment_ids):
+    """
+    Given a variable and its value, find the ID of the corresponding assignment, inserting it if needed.
+    assignment_ids is a map from (variable, serialised value) pairs to ids found during the current write,
+    which is checked before the assignment cache (the cache is only updated once the write is committed).
+    """
+    serialised_value = pickle.dumps(value)
+    key = (variable, serialised_value)
+    if key in assignment_ids:
+        return assignment_ids[key]
+
+    assignment_id = assignment_cache.get(key)
+    if assignment_id is None:
+        assignment_id = write_assignment(cursor, variable, value, serialised_value)
+        after_commit(functools.partial(assignment_cache.put, key, assignment_id))
+
+    assignment_ids[key] = assignment_id
+    return assignment_id
+
+
+def write_assignment(cursor, variable, value, serialised_value):
+    """
+    Insert an assignment if it doesn't exist yet and return its ID.
+    The unique index on assignment(variable, value) means the insertion is ignored for an existing assignment.
+    """
+    cursor.execute(
+        "insert or ignore into assignment (variable, value, type) values(?, ?, ?)",
+        [variable, serialised_value, str(type(value))]
+    )
+    if cursor.rowcount == 1:
+        return cursor.lastrowid
+
+    return cursor.execute(
+        "select id from assignment where variable = ? and value = ?",
+        [variable, serialised_value]
+    ).fetchone()[0]
+
+
+def insert_verdict_rows(cursor, prepared_rows):
+    """
+    Given a list of results from prepare_verdict_rows, allocate verdict and observation ids
+    and insert all rows with one executemany per table.
+    This must be called inside a transaction that holds the write lock, otherwise the allocated ids could clash.
+    """
+    next_verdict_id = get_next_id(cursor, "verdict")
+    next_observation_id = get_next_id(cursor, "observation")
+
+    # with the partitioned storage engine, rows are inserted alongside their function call (see get_insert_table),
+    # so they're gathered by the tables into which they're inserted
+    tables_of_calls = {}
+    rows_by_tables = {}
+
+    for rows in prepared_rows:
+        for (verdict_row, verdict_observation_rows) in rows:
+            function_call_id = verdict_row[3]
+            tables = tables_of_calls.get(function_call_id)
+            if tables is None:
+                tables = tuple(get_insert_table(cursor, table_name, function_call_id)
+                               for table_name in ["verdict", "observation", "observation_assignment_pair"])
+                tables_of_calls[function_call_id] = tables
+            (verdict_rows, observation_rows, observation_assignment_rows) = \
+                rows_by_tables.setdefault(tables, ([], [], []))
+            # the time obtained and observation time are also stored in microseconds since the epoch
+            verdict_rows.append([next_verdict_id] + verdict_row + [timestamp_to_microseconds(verdict_row[2])])
+            for (observation_row, assignment_ids) in verdict_observation_rows:
+                observation_rows.append([next_observation_id, next_verdict_id] + observation_row +
+                                        [timestamp_to_microseconds(observation_row[2])])
+                for assignment_id in assignment_ids:
+                    observation_assignment_rows.append([next_observation_id, assignment_id])
+                next_observation_id += 1
+            next_verdict_id += 1
+
+    for ((verdict_table, observation_table, observation_assignment_table),
+         (verdict_rows, observation_rows, observation_assignment_rows)) in rows_by_tables.items():
+        cursor.executemany(
+            "insert into %s (id, binding, verdict, time_obtained, function_call, collapsing_atom,"
+            "collapsing_atom_sub_index, time_obtained_us) values (?, ?, ?, ?, ?, ?, ?, ?)" % verdict_table,
+            verdict_rows
+        )
+        cursor.executemany(
+            "insert into %s (id, verdict, instrumentation_point, observed_value, observation_time, "
+            "observation_end_time, previous_condition_offset, atom_index, sub_index, numeric_value, time_value, "
+            "observation_time_us) values(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)" % observation_table,
+            observation_rows
+        )
+        cursor.executemany(
+            "insert into %s (observation, assignment) values(?, ?)" % observation_assignment_table,
+            observation_assignment_rows
+        )
 
-    connection.close()
+
+def get_next_id(cursor, table_name):
+    """
+    Given the name of a table with an autoincrement id, find the next id that would be allocated.
+    With the partitioned storage engine, the table is held by several attached databases, each with
+    its own sequence, so ids must be allocated with this rather than by the database.
+    """
+    last_id = 0
+    for schema in get_table_schemas(cursor, table_name):
+        schema_last_id = cursor.execute(
+            "select max(coalesce((select seq from %s.sqlite_sequence where name = ?), 0), "
+            "coalesce((select max(id) from %s.%s), 0))" % (schema, schema, table_name),
+            [table_name]
+        ).fetchone()[0]
+        last_id = max(last_id, schema_last_id)
+    return last_id + 1
 
 
 def insert_property(property_dictionary):
     """
     Given a dictionary describing a property (hash + serialised structure), insert into the database.
     """
+    try:
+        return execute_write(write_property, property_dictionary)
+    except:
+        # for now, the error was probably because of dupicate properties if instrumentation was run again.
+        # instrumentation should only ever be run for new versions of code, so at some point
+        # we will need to integrate version distinction into the schema.
 
-    connection = get_connection()
-    cursor = connection.cursor()
+        print("ERROR OCCURRED DURING INSERTION:")
 
-    try:
+        traceback.print_exc()
+        return "failure"
+
+
+def write_property(cursor, property_dictionary):
+    # insert property, unless it already exists
 
-        # insert property
+    existing_property = cursor.execute(
+        "select hash from property where hash = ?", [property_dictionary["formula_hash"]]
+    ).fetchall()
+    property_is_new = len(existing_property) == 0
 
+    if property_is_new:
         serialised_structure = {
             "bind_variables": property_dictionary["serialised_bind_variables"],
             "property": property_dictionary["serialised_formula_structure"]
@@ -190,117 +481,80 @@ def insert_property(property_dictionary):
                 property_dictionary["formula_index"]
             ]
         )
-        # try to commit the insertion
-        connection.commit()
 
-        property_is_new = True
-    except:
-        # the property probably already existed, so we skip insertion
-        property_is_new = False
+    # insert atoms
 
-    try:
+    # maintaining a list allows us to have a map from atom indices in the formula
+    # to atom IDs in the database
+    atom_index_to_db_index = []
 
-        # insert atoms
+    if property_is_new:
 
-        # maintaining a list allows us to have a map from atom indices in the formula
-        # to atom IDs in the database
-        atom_index_to_db_index = []
+        # build up the atom_index_to_db_index map by inserting atoms into the db and taking their IDs
 
-        if property_is_new:
-
-            # build up the atom_index_to_db_index map by inserting atoms into the db and taking their IDs
+        serialised_atom_list = property_dictionary["serialised_atom_list"]
+        for pair in serialised_atom_list:
+            cursor.execute(
+                "insert into atom (property_hash, serialised_structure, index_in_atoms) values (?, ?, ?)",
+                [property_dictionary["formula_hash"], pair[1], pair[0]]
+            )
+            atom_index_to_db_index.append(cursor.lastrowid)
 
-            serialised_atom_list = property_dictionary["serialised_atom_list"]
-            for pair in serialised_atom_list:
-                cursor.execute(
-                    "insert into atom (property_hash, serialised_structure, index_in_atoms) values (?, ?, ?)",
-                    [property_dictionary["formula_hash"], pair[1], pair[0]]
-                )
-                atom_index_to_db_index.append(cursor.lastrowid)
+    else:
 
-        else:
+        # build up the atom_index_to_db_index map by querying for the atoms belonging to this property
+        # in order of index_in_atoms
+        atoms = cursor.execute(
+            "select id from atom where property_hash = ? order by index_in_atoms asc",
+            [property_dictionary["formula_hash"]]
+        ).fetchall()
+        atom_index_to_db_index = [atom_row[0] for atom_row in atoms]
 
-            # build up the atom_index_to_db_index map by querying for the atoms belonging to this property
-            # in order of index_in_atoms
-            atoms = cursor.execute(
-                "select id from atom where property_hash = ? order by index_in_atoms asc",
-                [property_dictionary["formula_hash"]]
-            ).fetchall()
-            atoms = map(lambda atom_row : atom_row[0], atoms)
-            atom_index_to_db_index = atoms
+    # link property to existing or new function
 
-        # link property to existing or new function
+    # check for existence of the function
+    function_check = cursor.execute(
+        "select * from function where fully_qualified_name = ?", [property_dictionary["function"]]
+    ).fetchall()
 
-        # check for existence of the function
-        function_check = cursor.execute(
-            "select * from function where fully_qualified_name = ?", [property_dictionary["function"]]
-        ).fetchall()
+    # if the function exists, use its ID, otherwise insert a new function and use the new ID
+    if len(function_check) == 0:
+        # insert the function
+        cursor.execute("insert into function (fully_qualified_name) values (?)", [property_dictionary["function"]])
+        function_id = cursor.lastrowid
+    else:
+        # the function already exists
+        function_id = function_check[0][0]
 
-        # if the function exists, use its ID, otherwise insert a new function and use the new ID
-        if len(function_check) == 0:
-            # insert the function
-            cursor.execute("insert into function (fully_qualified_name) values (?)", [property_dictionary["function"]])
-            function_id = cursor.lastrowid
-            # insert the function/property pair
-            cursor.execute(
-                "insert into function_property_pair values (?, ?)",
-                [
-                    function_id,
-                    property_dictionary["formula_hash"]
-                ]
-            )
-        else:
-            # the function already exists
-            function_id = function_check[0][0]
-            # check if the property is new - we only insert a new link if it's new
-            if property_is_new:
-                # insert the function/property pair
-                cursor.execute(
-                    "insert into function_property_pair values (?, ?)",
-                    [
-                        function_id,
-                        property_dictionary["formula_hash"]
-                    ]
-                )
-
-        # commit the insertions
-        connection.commit()
-        connection.close()
-        return atom_index_to_db_index, function_id
-    except:
-        # for now, the error was probably because of dupicate properties if instrumentation was run again.
-        # instrumentation should only ever be run for new versions of code, so at some point
-        # we will need to integrate version distinction into the schema.
+    # insert the function/property pair, unless the property was already registered for the function
+    cursor.execute(
+        "insert or ignore into function_property_pair values (?, ?)",
+        [
+            function_id,
+            property_dictionary["formula_hash"]
+        ]
+    )
+
+    def update_catalog():
+        catalog.add_function(function_id, property_dictionary["function"])
+        catalog.add_function_property(function_id, property_dictionary["formula_hash"])
+        if property_is_new:
+            catalog.add_property(property_dictionary["formula_hash"], serialised_structure,
+                                 property_dictionary["formula_index"])
+            for (pair, atom_id) in zip(property_dictionary["serialised_atom_list"], atom_index_to_db_index):
+                catalog.add_atom(atom_id, property_dictionary["formula_hash"], pair[1], pair[0])
 
-        print("ERROR OCCURRED DURING INSERTION:")
+    after_commit(update_catalog)
 
-        traceback.print_exc()
-        return "failure"
+    return atom_index_to_db_index, function_id
 
 
 def insert_binding(binding_dictionary):
     """
     Given a dictionary describing a binding (binding space index, function, lines), insert into the database.
     """
-
-    connection = get_connection()
-    cursor = connection.cursor()
-
     try:
-        cursor.execute(
-            "insert into binding (binding_space_index, function, binding_statement_lines, property_hash)"
-            " values (?, ?, ?, ?)",
-            [
-                binding_dictionary["binding_space_index"],
-                binding_dictionary["function"],
-                json.dumps(binding_dictionary["binding_statement_lines"]),
-                binding_dictionary["property_hash"]
-            ]
-        )
-        new_id = cursor.lastrowid
-        connection.commit()
-        connection.close()
-        return new_id
+        return execute_write(write_binding, binding_dictionary)
     except:
         # for now, the error was probably because of dupicate properties if instrumentation was run again.
         # instrumentation should only ever be run for new versions of code, so at some point
@@ -313,34 +567,44 @@ def insert_binding(binding_dictionary):
         return "failure"
 
 
-def insert_instrumentation_point(dictionary):
+def write_binding(cursor, binding_dictionary):
     """
-    Given a dictionary describing an instrumentation point, insert the instrumentation point,
-    the atom-instrumentation point and binding-instrumentation point pairs.
+    If the binding has already been registered (because instrumentation was registered again),
+    the existing binding's id is returned instead of inserting it again.
+    Writes hold the write lock for their whole transaction, so the check can't race with another insertion.
     """
+    existing_id = catalog.get_binding_id(cursor, binding_dictionary["function"], binding_dictionary["property_hash"],
+                                         binding_dictionary["binding_space_index"])
+    if existing_id is not None:
+        return existing_id
 
-    connection = get_connection()
-    cursor = connection.cursor()
+    cursor.execute(
+        "insert into binding (binding_space_index, function, binding_statement_lines, property_hash)"
+        " values (?, ?, ?, ?)",
+        [
+            binding_dictionary["binding_space_index"],
+            binding_dictionary["function"],
+            json.dumps(binding_dictionary["binding_statement_lines"]),
+            binding_dictionary["property_hash"]
+        ]
+    )
+    new_id = cursor.lastrowid
 
-    try:
-        # TODO: add existence checks
-        # insert instrumentation point
-        cursor.execute(
-            "insert into instrumentation_point (serialised_condition_sequence, reaching_path_length) values (?, ?)",
-            [json.dumps(dictionary["serialised_condition_sequence"]), dictionary["reaching_path_length"]])
-        new_id = cursor.lastrowid
+    after_commit(functools.partial(
+        catalog.add_binding, new_id, binding_dictionary["binding_space_index"], binding_dictionary["function"],
+        binding_dictionary["property_hash"], json.dumps(binding_dictionary["binding_statement_lines"])
+    ))
 
-        # insert the atom-instrumentation point link
-        cursor.execute("insert into atom_instrumentation_point_pair (atom, instrumentation_point) values (?, ?)",
-                       [dictionary["atom"], new_id])
+    return new_id
 
-        # insert the binding-instrumentation point link
-        cursor.execute("insert into binding_instrumentation_point_pair (binding, instrumentation_point) values (?, ?)",
-                       [dictionary["binding"], new_id])
 
-        connection.commit()
-        connection.close()
-        return new_id
+def insert_instrumentation_point(dictionary):
+    """
+    Given a dictionary describing an instrumentation point, insert the instrumentation point,
+    the atom-instrumentation point and binding-instrumentation point pairs.
+    """
+    try:
+        return execute_write(write_instrumentation_point, dictionary)
     except:
         # for now, the error was probably because of dupicate properties if instrumentation was run again.
         # instrumentation should only ever be run for new versions of code, so at some point
@@ -353,56 +617,177 @@ def insert_instrumentation_point(dictionary):
         return "failure"
 
 
+def write_instrumentation_point(cursor, dictionary):
+    """
+    If an instrumentation point with the same condition sequence and reaching path length has already been
+    registered for the atom and binding, the existing point's id is returned instead of inserting it again.
+    """
+    serialised_condition_sequence = json.dumps(dictionary["serialised_condition_sequence"])
+    existing_point = cursor.execute(
+        """select instrumentation_point.id from
+        (atom_instrumentation_point_pair inner join binding_instrumentation_point_pair
+            on binding_instrumentation_point_pair.instrumentation_point =
+                atom_instrumentation_point_pair.instrumentation_point)
+        inner join instrumentation_point
+            on instrumentation_point.id = atom_instrumentation_point_pair.instrumentation_point
+        where atom_instrumentation_point_pair.atom = ? and binding_instrumentation_point_pair.binding = ?
+        and instrumentation_point.serialised_condition_sequence = ? and instrumentation_point.reaching_path_length = ?
+        order by instrumentation_point.id limit 1""",
+        [dictionary["atom"], dictionary["binding"], serialised_condition_sequence, dictionary["reaching_path_length"]]
+    ).fetchone()
+    if existing_point is not None:
+        return existing_point[0]
+
+    # insert instrumentation point
+    cursor.execute(
+        "insert into instrumentation_point (serialised_condition_sequence, reaching_path_length) values (?, ?)",
+        [serialised_condition_sequence, dictionary["reaching_path_length"]])
+    new_id = cursor.lastrowid
+
+    # insert the atom-instrumentation point link
+    cursor.execute("insert into atom_instrumentation_point_pair (atom, instrumentation_point) values (?, ?)",
+                   [dictionary["atom"], new_id])
+
+    # insert the binding-instrumentation point link
+    cursor.execute("insert into binding_instrumentation_point_pair (binding, instrumentation_point) values (?, ?)",
+                   [dictionary["binding"], new_id])
+
+    after_commit(functools.partial(
+        catalog.add_instrumentation_point, new_id, serialised_condition_sequence,
+        dictionary["reaching_path_length"], dictionary["atom"], dictionary["binding"]
+    ))
+
+    return new_id
+
+
 def insert_branching_condition(dictionary):
     """
     Given a dictionary describing a branching condition, perform the insertion.
     """
-    connection = get_connection()
-    cursor = connection.cursor()
     try:
-        # check for existence
-        result = cursor.execute("select * from path_condition_structure where serialised_condition = ?",
-                                [dictionary["serialised_condition"]]).fetchall()
-        if len(result) > 0:
-            # condition already exists - return the existing ID
-            return result[0][0]
-        else:
-            # condition is new - insert it
-            cursor.execute("insert into path_condition_structure (serialised_condition) values (?)",
-                           [dictionary["serialised_condition"]])
-            new_id = cursor.lastrowid
-            connection.commit()
-            connection.close()
-            return new_id
+        return execute_write(write_branching_condition, dictionary)
     except:
         print("ERROR OCCURED DURING INSERTION:")
         traceback.print_exc()
         return "failure"
 
 
-def insert_test_call_data(test_data):
+def write_branching_condition(cursor, dictionary):
+    return get_condition_id(cursor, dictionary["serialised_condition"])
+
+
+def get_condition_id(cursor, serialised_condition):
     """
-    Given a dictionary of data derived from execution of a test case, insert it and return the new ID.
-    :param test_data:
-    :return: json list
+    Given a serialised branching condition, find the ID of the condition, inserting it if needed.
+    The unique index on path_condition_structure(hash) means the insertion is ignored for an existing condition,
+    so concurrent instrumentation can't insert a condition twice.
     """
+    condition_id = catalog.get_condition_id(cursor, serialised_condition)
+    if condition_id is not None:
+        return condition_id
+
+    hash = content_hash(serialised_condition)
+    cursor.execute("insert or ignore into path_condition_structure (serialised_condition, hash) values (?, ?)",
+                   [serialised_condition, hash])
+    if cursor.rowcount == 1:
+        condition_id = cursor.lastrowid
+    else:
+        condition_id = cursor.execute("select id from path_condition_structure where hash = ?",
+                                      [hash]).fetchone()[0]
 
-    connection = get_connection()
-    cursor = connection.cursor()
+    after_commit(functools.partial(catalog.add_condition, condition_id, serialised_condition))
+
+    return condition_id
+
+
+def insert_instrumentation_manifest(manifest):
+    """
+    Given everything registered during instrumentation of a single function, insert it all in one transaction.
+    The manifest holds:
+     - "function": the fully qualified name of the function,
+     - "properties": a list of property dictionaries of the form accepted by insert_property,
+     - "bindings": a list of binding dictionaries of the form accepted by insert_binding,
+     - "instrumentation_points": a list of instrumentation point dictionaries of the form accepted by
+       insert_instrumentation_point, except that atoms and bindings can be given by "property_hash" with
+       "atom_index" and "binding_space_index" instead of by id,
+     - "branching_conditions": a list of branching condition dictionaries.
+    The function can be left out of property and binding dictionaries.
+    Returns a map from each part of the manifest to the ids of the rows inserted (or found) for it, in the order given.
+    """
     try:
+        return execute_write(write_instrumentation_manifest, manifest)
+    except:
+        print("ERROR OCCURRED DURING INSERTION:")
+        traceback.print_exc()
+        return "failure"
 
-        print (test_data)
 
-        # condition is new - insert it
-        cursor.execute("insert into test_data (test_name, test_result, start_time, end_time) values (? , ? , ?, ?)",
-                       [test_data["test_name"], test_data["test_result"], test_data['start_time'],
-                        test_data['end_time']]
-                       )
+def write_instrumentation_manifest(cursor, manifest):
+    function_id = None
+    atom_ids = {}
+    property_ids = {}
+    for property_dictionary in manifest.get("properties", []):
+        property_dictionary = dict(property_dictionary, function=manifest["function"])
+        atom_index_to_db_index, function_id = write_property(cursor, property_dictionary)
+        atom_ids[property_dictionary["formula_hash"]] = atom_index_to_db_index
+        property_ids[property_dictionary["formula_hash"]] = {
+            "atom_index_to_db_index": atom_index_to_db_index,
+            "function_id": function_id
+        }
+
+    if function_id is None:
+        function_id = catalog.get_function_id(cursor, manifest["function"])
+
+    # bindings and instrumentation points that were registered before are resolved to their existing ids,
+    # so the manifest can be sent again (when a request is retried, for example)
+    binding_ids = {}
+    manifest_binding_ids = []
+    for binding_dictionary in manifest.get("bindings", []):
+        binding_dictionary = dict(binding_dictionary, function=function_id)
+        binding_id = write_binding(cursor, binding_dictionary)
+        binding_ids[(binding_dictionary["property_hash"], binding_dictionary["binding_space_index"])] = binding_id
+        manifest_binding_ids.append(binding_id)
+
+    instrumentation_point_ids = []
+    for dictionary in manifest.get("instrumentation_points", []):
+        if "atom" not in dictionary:
+            dictionary = dict(dictionary, atom=atom_ids[dictionary["property_hash"]][dictionary["atom_index"]])
+        if "binding" not in dictionary:
+            dictionary = dict(
+                dictionary, binding=binding_ids[(dictionary["property_hash"], dictionary["binding_space_index"])]
+            )
+        instrumentation_point_ids.append(write_instrumentation_point(cursor, dictionary))
 
-        connection.commit()
-        connection.close()
-        return {"row_id": cursor.lastrowid}
+    branching_condition_ids = [
+        write_branching_condition(cursor, dictionary) for dictionary in manifest.get("branching_conditions", [])
+    ]
+
+    return {
+        "function_id": function_id,
+        "properties": property_ids,
+        "bindings": manifest_binding_ids,
+        "instrumentation_points": instrumentation_point_ids,
+        "branching_conditions": branching_condition_ids
+    }
+
+
+def insert_test_call_data(test_data):
+    """
+    Given a dictionary of data derived from execution of a test case, insert it and return the new ID.
+    :param test_data:
+    :return: json list
+    """
+    try:
+        return execute_write(write_test_call_data, test_data)
     except:
         print("ERROR OCCURED DURING INSERTION:")
         traceback.print_exc()
         return "failure"
+
+
+def write_test_call_data(cursor, test_data):
+    cursor.execute("insert into test_data (test_name, test_result, start_time, end_time) values (? , ? , ?, ?)",
+                   [test_data["test_name"], test_data["test_result"], test_data['start_time'],
+                    test_data['end_time']]
+                   )
+    return {"row_id": cursor.lastrowid}
@@ -0,0 +1,311 @@
+"""
+Module to provide the partitioned storage engine.
+
+Function calls, verdicts, observations and their links to assignments are stored in a separate database file
+for each app.partition_period, named after app.database_string, while app.database_string holds everything else
+(the catalog, along with any of those rows stored before partitioning was used).
+
+Partitions are attached to each connection, and the partitioned tables are replaced by temporary views over
+the catalog and the attached partitions, so queries don't need to know which partitions they read.
+Function calls are inserted into the partition for the current period, which is attached as current_partition,
+and their verdicts, observations and links to assignments are inserted alongside them (see get_insert_table),
+so the rows related to a function call can be joined within one partition.
+
+By default, connections attach the most recent app.partitions_attached partitions.  Queries over a time range
+attach the partitions whose periods overlap the range instead (along with the partition that follows them,
+which holds rows for function calls that were inserted around the end of a period), and a range covering more
+partitions than can be attached at once is refused with PartitionRangeError.  Queries without a time range
+are run over every group of partitions in turn (see partition_groups, and its use in utils), so they also
+find rows held by older partitions.
+
+Partitions are listed in the verdict_partition table of the catalog, and one can be archived by setting its
+archived column - it is no longer attached once connections are next prepared, and its file can then be moved.
+"""
+import datetime
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import app
+from .engine import SQLiteEngine, schema_path
+from .schema import add_epoch_columns, backfill_epoch_columns_batch
+
+partitioned_tables = ["function_call", "verdict", "observation", "observation_assignment_pair"]
+current_schema = "current_partition"
+
+# how often in seconds the list of partitions is read again from the catalog, so archived partitions are detached
+partition_refresh_interval = 60
+
+
+def get_period(moment):
+    """
+    Given a datetime, return the name, start and end of the partition period containing it.
+    """
+    day = datetime.datetime(moment.year, moment.month, moment.day)
+    if app.partition_period == "day":
+        start = day
+        end = start + datetime.timedelta(days=1)
+        name = start.strftime("%Y%m%d")
+    elif app.partition_period == "week":
+        start = day - datetime.timedelta(days=day.weekday())
+        end = start + datetime.timedelta(days=7)
+        (year, week, _) = start.isocalendar()
+        name = "%04iW%02i" % (year, week)
+    else:
+        raise Exception("Partition period '%s' is not supported.  It must be 'day' or 'week'." % app.partition_period)
+    return (name, start.isoformat(), end.isoformat())
+
+
+def get_partition_schema():
+    """
+    Return the statements from verdict-schema.sql that create the partitioned tables and their indices.
+    """
+    with open(schema_path) as schema_file:
+        statements = schema_file.read().split(";")
+    partition_statements = []
+    for statement in statements:
+        table = re.match(r"\s*CREATE TABLE (\w+)", statement)
+        index = re.match(r"\s*CREATE (UNIQUE )?INDEX \w+ ON (\w+)\(", statement)
+        if table is not None and table.group(1) in partitioned_tables:
+            partition_statements.append(statement.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+        elif index is not None and index.group(2) in partitioned_tables:
+            partition_statements.append(re.sub(r"INDEX", "INDEX IF NOT EXISTS", statement, count=1))
+    return ";".join(partition_statements) + ";"
+
+
+def get_schema_name(partition_name, current_partition):
+    # the partition for the current period is always attached under the same name, so inserts can refer to it
+    if partition_name == current_partition:
+        return current_schema
+    return "partition_%s" % partition_name
+
+
+def get_table_schemas(cursor, table_name):
+    """
+    Return the names of the attached databases holding the given table - with the partitioned storage engine,
+    partitioned tables are held by the catalog and each attached partition.
+    """
+    schemas = []
+    for (_, schema, _) in cursor.execute("pragma database_list").fetchall():
+        if schema == "temp":
+            continue
+        tables = cursor.execute("select name from %s.sqlite_master where type = 'table' and name = ?" % schema,
+                                [table_name]).fetchall()
+        if len(tables) > 0:
+            schemas.append(schema)
+    return schemas
+
+
+class PartitionRangeError(ValueError):
+    """
+    Raised when a query's time range covers more partitions than can be attached at once.
+    """
+    pass
+
+
+@app.app_object.errorhandler(PartitionRangeError)
+def partition_range_error(error):
+    return str(error), 400
+
+
+def reads_partitioned_tables(query_string):
+    """
+    Return whether a query reads any of the partitioned tables.
+    """
+    return re.search(r"\b(from|join)\s+(%s)\b" % "|".join(partitioned_tables), query_string, re.IGNORECASE) \
+        is not None
+
+
+def get_insert_table(cursor, table_name, function_call_id=None):
+    """
+    Return the name of the table into which rows for the given table should be inserted - with the partitioned
+    storage engine, this is the table in the partition for the current period, rather than the view over partitions.
+    If the rows belong to a function call, they're inserted into the partition holding it instead, as long as that
+    partition is attached (verdicts for a function call in an older partition are otherwise held by the current one).
+    """
+    if table_name not in partitioned_tables:
+        return table_name
+    schemas = [row[1] for row in cursor.execute("pragma database_list").fetchall()
+               if row[1] == current_schema or row[1].startswith("partition_")]
+    if current_schema not in schemas:
+        return table_name
+    if function_call_id is not None:
+        for schema in [current_schema] + [schema for schema in schemas if schema != current_schema] + ["main"]:
+            if cursor.execute("select id from %s.function_call where id = ?" % schema,
+                              [function_call_id]).fetchone() is not None:
+                return "%s.%s" % (schema, table_name)
+    return "%s.%s" % (current_schema, table_name)
+
+
+class PartitionedEngine(SQLiteEngine):
+    """
+    Verdicts stored in a catalog database file and a database file per partition period.
+    """
+
+    def __init__(self, database_string):
+        super(PartitionedEngine, self).__init__(database_string)
+        self._lock = threading.Lock()
+        # list of (name, period start, period end) for each partition that isn't archived, oldest first
+        self._partitions = None
+        self._read_time = 0
+        self._current_partition = None
+        # partitions that have been brought up to date by this process
+        self._upgraded_partitions = set()
+
+    def partition_path(self, partition_name):
+        return "%s.%s" % (self.database_string, partition_name)
+
+    def create_partition(self, period):
+        """
+        Create the database file for the given partition period, and add it to the catalog.
+        """
+        (partition_name, period_start, period_end) = period
+        connection = sqlite3.connect(self.partition_path(partition_name))
+        connection.execute("pragma journal_mode = wal")
+        connection.executescript(get_partition_schema())
+        connection.close()
+
+        connection = self.connect()
+        connection.execute("insert or ignore into verdict_partition (name, period_start, period_end, archived) "
+                           "values(?, ?, ?, 0)", [partition_name, period_start, period_end])
+        connection.commit()
+        connection.close()
+
+    def upgrade_partition(self, partition_name):
+        """
+        Bring a partition created by an older version of the server up to date with verdict-schema.sql.
+        """
+        with self._lock:
+            if partition_name in self._upgraded_partitions:
+                return
+            connection = sqlite3.connect(self.partition_path(partition_name))
+            connection.isolation_level = None
+            cursor = connection.cursor()
+            for table in add_epoch_columns(cursor):
+                last_id = 0
+                while last_id is not None:
+                    cursor.execute("begin immediate")
+                    last_id = backfill_epoch_columns_batch(cursor, "main", table, last_id)
+                    cursor.execute("commit")
+            cursor.executescript(get_partition_schema())
+            connection.close()
+            self._upgraded_partitions.add(partition_name)
+
+    def upgrade(self):
+        """
+        Bring every partition that isn't archived up to date, so that no query has to wait for one to be upgraded.
+        """
+        for (partition_name, _, _) in self.get_partitions()[0]:
+            self.upgrade_partition(partition_name)
+
+    def get_partitions(self):
+        """
+        Return the partitions that can be attached, oldest first, creating the partition for the current period
+        if it doesn't exist yet.
+        """
+        period = get_period(datetime.datetime.now())
+        with self._lock:
+            if self._current_partition != period[0] or time.time() - self._read_time > partition_refresh_interval:
+                connection = self.connect()
+                existing = connection.execute("select name from verdict_partition where name = ?",
+                                              [period[0]]).fetchone()
+                connection.close()
+                if existing is None:
+                    self.create_partition(period)
+                connection = self.connect()
+                self._partitions = connection.execute(
+                    "select name, period_start, period_end from verdict_partition where archived = 0 "
+                    "order by period_start"
+                ).fetchall()
+                connection.close()
+                self._current_partition = period[0]
+                self._read_time = time.time()
+            return (self._partitions, self._current_partition)
+
+    def select_partitions(self, time_range=None):
+        """
+        Return the names of the partitions to attach for a query over the given time range, or over recent rows
+        if no range is given.  The partition for the current period is always included, since it receives inserts.
+        """
+        (partitions, current_partition) = self.get_partitions()
+        if time_range is None:
+            names = [partition[0] for partition in partitions[-app.partitions_attached:]]
+        else:
+            (range_start, range_end) = time_range
+            overlapping = [index for (index, (_, period_start, period_end)) in enumerate(partitions)
+                           if period_start <= range_end and period_end > range_start]
+            if len(overlapping) > 0:
+                overlapping.append(overlapping[-1] + 1)
+            names = [partitions[index][0] for index in overlapping if index < len(partitions)]
+        if current_partition not in names:
+            names.append(current_partition)
+        if len(names) > app.partitions_attached:
+            raise PartitionRangeError(
+                "The time range covers %i partitions, but at most %i can be queried at once." %
+                (len(names), app.partitions_attached)
+            )
+        return (names, current_partition)
+
+    def partition_groups(self, time_range=None, query_string=None):
+        """
+        Return the groups of partitions over which a query over the given time range is run, in turn.  Each group is
+        a pair (names, include_catalog) giving the partitions to attach, and whether the rows of partitioned tables
+        held by the catalog are included.
+        A query over a time range is run over the partitions selected for it.  Any other query reading partitioned
+        tables is run over every partition that isn't archived, at most app.partitions_attached at a time - the
+        recent partitions (attached by default) along with the catalog first, then older partitions, newest first.
+        """
+        (recent, _) = self.select_partitions(time_range)
+        groups = [(recent, True)]
+        if time_range is not None or (query_string is not None and not reads_partitioned_tables(query_string)):
+            return groups
+        (partitions, _) = self.get_partitions()
+        older = [name for (name, _, _) in reversed(partitions) if name not in recent]
+        for start in range(0, len(older), app.partitions_attached):
+            groups.append((older[start:start + app.partitions_attached], False))
+        return groups
+
+    def prepare(self, connection, time_range=None, group=None):
+        """
+        Attach the partitions in the given group (see partition_groups), or those needed for a query over the given
+        time range, replacing any other partitions, and create the views over the partitioned tables.
+        Nothing is done if the views already cover those partitions.
+        """
+        (names, include_catalog) = group if group is not None else (self.select_partitions(time_range)[0], True)
+        current_partition = self.get_partitions()[1]
+        wanted = dict((get_schema_name(name, current_partition), os.path.realpath(self.partition_path(name)))
+                      for name in names)
+        attached = dict((row[1], os.path.realpath(row[2]))
+                        for row in connection.execute("pragma database_list").fetchall()
+                        if row[1] == current_schema or row[1].startswith("partition_"))
+        existing_view = connection.execute("select sql from sqlite_temp_master where type = 'view' and name = ?",
+                                           [partitioned_tables[0]]).fetchone()
+        if wanted == attached and existing_view is not None and \
+                (" main.%s" % partitioned_tables[0] in existing_view[0]) == include_catalog:
+            return
+
+        for table in partitioned_tables:
+            connection.execute("drop view if exists temp.%s" % table)
+        for schema in attached:
+            if wanted.get(schema) != attached[schema]:
+                connection.execute("detach database %s" % schema)
+        for name in names:
+            schema = get_schema_name(name, current_partition)
+            if attached.get(schema) != wanted[schema]:
+                self.upgrade_partition(name)
+                connection.execute("attach database ? as %s" % schema, [self.partition_path(name)])
+                for (pragma, value) in app.sqlite_pragmas:
+                    if pragma == "synchronous":
+                        connection.execute("pragma %s.synchronous = %s" % (schema, value))
+
+        schemas = (["main"] if include_catalog else []) + sorted(wanted.keys())
+        for table in partitioned_tables:
+            columns = [row[1] for row in connection.execute("pragma main.table_info(%s)" % table).fetchall()]
+            column_list = ", ".join(columns)
+            connection.execute(
+                "create temp view %s as %s" %
+                (table, " union all ".join("select %s from %s.%s" % (column_list, schema, table)
+                                           for schema in schemas))
+            )
@@ -426,7 +426,8 @@ where observation.id == ?
 
     path_condition_id_sequence = json.loads(
         cursor.execute(
-            "select path_condition_id_sequence from function_call where id = ?", [function_call_id]
+            "select program_path.path_condition_id_sequence from function_call inner join program_path "
+            "on function_call.program_path = program_path.id where function_call.id = ?", [function_call_id]
         ).fetchone()[0]
     )
 
@@ -0,0 +1,609 @@
+"""
+Module to bring existing verdict databases up to date with changes made to verdict-schema.sql.
+
+Each migration is applied in its own transaction and recorded, with its version, in the schema_migration table,
+so it is applied once to each database.  Databases created from verdict-schema.sql already have the tables and
+indices that the migrations create, so each migration must also be safe to apply to a database that already has it.
+
+Migrations hold the write lock while they run, so the ones that touch large tables are kept to a single index
+or batched backfill each - writers wait (for up to busy_timeout) for each one in turn, rather than for the whole set.
+A migration that returns True has more to do, and is run again in a new transaction, so rows of large tables
+are rewritten in batches of migration_batch_size (recording how far they have got with set_migration_progress).
+The step building the index that depends on a backfill first applies it to any rows added since it finished.
+"""
+import datetime
+import hashlib
+import traceback
+
+from .values import typed_observation_values_from_text, timestamp_to_microseconds
+
+# timestamp columns of each table, along with the columns holding them in microseconds since the epoch
+epoch_columns = {
+    "function_call": [("time_of_call", "time_of_call_us"), ("end_time_of_call", "end_time_of_call_us")],
+    "verdict": [("time_obtained", "time_obtained_us")],
+    "observation": [("observation_time", "observation_time_us")],
+    "trans": [("time_of_transaction", "time_of_transaction_us")]
+}
+
+# the number of rows changed by each batch of a migration
+migration_batch_size = 10000
+
+
+def content_hash(text):
+    """
+    Hash used to look up interned text (branching conditions and program paths) by a unique index.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def index_exists(cursor, name):
+    return cursor.execute("select name from sqlite_master where type = 'index' and name = ?", [name]).fetchone() \
+        is not None
+
+
+def unless_index_exists(index_name, migration):
+    """
+    Return a migration applying the given one only if the given index doesn't yet exist.
+    The steps leading to an index are skipped by databases that have it - those created from verdict-schema.sql,
+    and those whose migration has finished.
+    """
+    def migrate(cursor):
+        if index_exists(cursor, index_name):
+            return False
+        return migration(cursor)
+    migrate.__name__ = migration.__name__
+    return migrate
+
+
+def batched_migration(name, batch):
+    """
+    Return a migration calling batch(cursor, position, batch_size) on the rows following position (usually an id),
+    which returns the position of the last row it changed, or None once there are none left.
+    Each batch is applied in its own transaction, and the position is recorded with set_migration_progress,
+    so a migration that is interrupted resumes where it stopped.
+    """
+    def migrate(cursor):
+        position = batch(cursor, get_migration_progress(cursor, name), migration_batch_size)
+        if position is None:
+            return False
+        set_migration_progress(cursor, name, position)
+        return True
+    migrate.__name__ = name
+    return migrate
+
+
+def finish_batched_migration(cursor, name, batch):
+    """
+    Apply the given batched migration to the rows added since it finished (by servers still running an older
+    version while the database was being upgraded), so that they are included when the index depending on it is built.
+    """
+    position = get_migration_progress(cursor, name)
+    while True:
+        position_after = batch(cursor, position, migration_batch_size)
+        if position_after is None:
+            break
+        position = position_after
+    set_migration_progress(cursor, name, position)
+
+
+def create_assignment_remap_table(cursor):
+    """
+    Assignments are looked up by (variable, value) whenever an observation is inserted.
+    The index on them is unique so that new assignments can be inserted with an upsert, so any duplicate assignments
+    in older databases are merged first - each duplicate is recorded in assignment_remap along with the assignment
+    that is kept, the links to it are moved to that assignment, and then it is removed.
+    An index (which is dropped once the unique index exists) makes finding duplicates cheap.
+    """
+    cursor.execute(
+        """create table if not exists assignment_remap (
+            old_id integer not null primary key,
+            keep_id integer not null
+        )"""
+    )
+    # links made after the merge starts are added with observations that don't exist yet
+    last_observation = cursor.execute("select max(observation) from observation_assignment_pair").fetchone()[0]
+    set_migration_progress(cursor, "assignment_links_before_merge", last_observation or 0)
+
+
+def find_duplicate_assignments_batch(cursor, last_id, batch_size):
+    rows = cursor.execute(
+        """select id, (select min(id) from assignment as original
+                       where original.variable = assignment.variable and original.value = assignment.value)
+        from assignment where id > ? order by id limit ?""",
+        [last_id, batch_size]
+    ).fetchall()
+    if len(rows) == 0:
+        return None
+    cursor.executemany(
+        "insert or ignore into assignment_remap (old_id, keep_id) values(?, ?)",
+        [(assignment_id, keep_id) for (assignment_id, keep_id) in rows if assignment_id != keep_id]
+    )
+    return rows[-1][0]
+
+
+def move_duplicate_assignment_links_batch(cursor, last_observation, batch_size):
+    """
+    Links are visited in order of observation (using the primary key of observation_assignment_pair),
+    since there is no index on the assignment they refer to.
+    """
+    rows = cursor.execute(
+        "select observation from observation_assignment_pair where observation > ? order by observation limit ?",
+        [last_observation, batch_size]
+    ).fetchall()
+    if len(rows) == 0:
+        return None
+    # the batch is extended to every link of its last observation
+    observation_range = [last_observation, rows[-1][0]]
+    cursor.execute(
+        """insert or ignore into observation_assignment_pair (observation, assignment)
+        select observation_assignment_pair.observation, assignment_remap.keep_id from
+        observation_assignment_pair inner join assignment_remap
+        on observation_assignment_pair.assignment = assignment_remap.old_id
+        where observation_assignment_pair.observation > ? and observation_assignment_pair.observation <= ?""",
+        observation_range
+    )
+    cursor.execute(
+        """delete from observation_assignment_pair where observation > ? and observation <= ?
+        and assignment in (select old_id from assignment_remap)""",
+        observation_range
+    )
+    return rows[-1][0]
+
+
+def move_duplicate_assignment_links(cursor):
+    name = "move_duplicate_assignment_links"
+    if get_migration_progress(cursor, name) == 0 and \
+            cursor.execute("select old_id from assignment_remap limit 1").fetchone() is None:
+        # there were no duplicates, so only links made since the merge started need to be visited
+        set_migration_progress(cursor, name, get_migration_progress(cursor, "assignment_links_before_merge"))
+        return False
+    return batched_migration(name, move_duplicate_assignment_links_batch)(cursor)
+
+
+def delete_duplicate_assignments_batch(cursor, last_id, batch_size):
+    rows = cursor.execute("select old_id from assignment_remap where old_id > ? order by old_id limit ?",
+                          [last_id, batch_size]).fetchall()
+    if len(rows) == 0:
+        return None
+    cursor.executemany("delete from assignment where id = ?", rows)
+    return rows[-1][0]
+
+
+def create_assignment_index(cursor):
+    finish_batched_migration(cursor, "find_duplicate_assignments", find_duplicate_assignments_batch)
+    finish_batched_migration(cursor, "move_duplicate_assignment_links", move_duplicate_assignment_links_batch)
+    finish_batched_migration(cursor, "delete_duplicate_assignments", delete_duplicate_assignments_batch)
+    cursor.execute("create unique index assignment_variable_value on assignment(variable, value)")
+    cursor.execute("drop index assignment_variable_value_duplicates")
+    cursor.execute("drop table assignment_remap")
+
+
+def merge_duplicate_transactions_batch(cursor, last_id, batch_size):
+    """
+    Transactions are looked up by time whenever a function call is inserted, and the index on them is unique
+    so that concurrent calls from the same transaction resolve to a single row.
+    Function calls belonging to duplicate transactions in older databases are moved to the transaction being kept
+    (using function_call_trans), and the duplicates are removed.
+    """
+    rows = cursor.execute(
+        """select id, (select min(id) from trans as original
+                       where original.time_of_transaction = trans.time_of_transaction)
+        from trans where id > ? order by id limit ?""",
+        [last_id, batch_size]
+    ).fetchall()
+    if len(rows) == 0:
+        return None
+    duplicates = [(keep_id, transaction_id) for (transaction_id, keep_id) in rows if transaction_id != keep_id]
+    cursor.executemany("update function_call set trans = ? where trans = ?", duplicates)
+    cursor.executemany("delete from trans where id = ?", [(transaction_id,) for (_, transaction_id) in duplicates])
+    return rows[-1][0]
+
+
+def create_transaction_index(cursor):
+    finish_batched_migration(cursor, "merge_duplicate_transactions", merge_duplicate_transactions_batch)
+    cursor.execute("create unique index trans_time_of_transaction on trans(time_of_transaction)")
+    cursor.execute("drop index trans_time_of_transaction_duplicates")
+
+
+def add_condition_hash_column(cursor):
+    """
+    Branching conditions are looked up by the hash of their serialised form, rather than by the serialised form itself.
+    Only the first of any duplicate conditions in older databases is given a hash - the others are still
+    referred to by existing function calls, but are never looked up again.
+    An index (which is dropped once the unique index exists) makes checking whether a hash is taken cheap.
+    """
+    columns = [row[1] for row in cursor.execute("pragma table_info(path_condition_structure)").fetchall()]
+    if "hash" not in columns:
+        cursor.execute("alter table path_condition_structure add column hash text")
+
+
+def hash_conditions_batch(cursor, last_id, batch_size):
+    rows = cursor.execute(
+        "select id, serialised_condition, hash from path_condition_structure where id > ? order by id limit ?",
+        [last_id, batch_size]
+    ).fetchall()
+    if len(rows) == 0:
+        return None
+    for (condition_id, serialised_condition, condition_hash) in rows:
+        if condition_hash is not None:
+            continue
+        condition_hash = content_hash(serialised_condition)
+        taken = cursor.execute("select id from path_condition_structure where hash = ?", [condition_hash]).fetchone()
+        if taken is None:
+            cursor.execute("update path_condition_structure set hash = ? where id = ?", [condition_hash, condition_id])
+    return rows[-1][0]
+
+
+def create_condition_hash_index(cursor):
+    finish_batched_migration(cursor, "hash_conditions", hash_conditions_batch)
+    cursor.execute("create unique index path_condition_structure_hash on path_condition_structure(hash)")
+    cursor.execute("drop index path_condition_structure_hash_duplicates")
+
+
+def create_program_path_table(cursor):
+    """
+    The sequences of branching condition ids followed by function calls are stored once in program_path,
+    and referred to by function_call.program_path.  Existing function calls are given program paths from their
+    path_condition_id_sequence, which is left as it is (new function calls leave it empty).
+    """
+    cursor.execute(
+        """create table if not exists program_path (
+            id integer not null primary key autoincrement,
+            hash text not null,
+            path_condition_id_sequence text not null
+        )"""
+    )
+    cursor.execute("create unique index if not exists program_path_hash on program_path(hash)")
+
+    columns = [row[1] for row in cursor.execute("pragma table_info(function_call)").fetchall()]
+    if "program_path" not in columns:
+        cursor.execute("alter table function_call add column program_path int references program_path(id)")
+
+
+def assign_program_paths_batch(cursor, last_id, batch_size):
+    # function calls that already have a program path are filtered out here, rather than in the query,
+    # so that each batch reads at most batch_size rows
+    rows = cursor.execute(
+        "select id, path_condition_id_sequence, program_path from function_call where id > ? order by id limit ?",
+        [last_id, batch_size]
+    ).fetchall()
+    if len(rows) == 0:
+        return None
+    program_paths = {}
+    for (function_call_id, sequence, program_path) in rows:
+        if program_path is not None:
+            continue
+        if sequence not in program_paths:
+            sequence_hash = content_hash(sequence)
+            cursor.execute("insert or ignore into program_path (hash, path_condition_id_sequence) values(?, ?)",
+                           [sequence_hash, sequence])
+            program_paths[sequence] = cursor.execute("select id from program_path where hash = ?",
+                                                     [sequence_hash]).fetchone()[0]
+        cursor.execute("update function_call set program_path = ? where id = ?",
+                       [program_paths[sequence], function_call_id])
+    return rows[-1][0]
+
+
+def create_program_path_index(cursor):
+    finish_batched_migration(cursor, "assign_program_paths", assign_program_paths_batch)
+    cursor.execute("create index function_call_program_path on function_call(program_path)")
+
+
+def add_observation_value_columns(cursor):
+    """
+    Observations hold a numeric value and, for transitions, the time of the transition (in seconds since the epoch),
+    derived from observed_value at insertion so that they can be compared in SQL.
+    These are filled in for existing observations, in batches.
+    """
+    columns = [row[1] for row in cursor.execute("pragma table_info(observation)").fetchall()]
+    if "numeric_value" not in columns:
+        cursor.execute("alter table observation add column numeric_value real")
+    if "time_value" not in columns:
+        cursor.execute("alter table observation add column time_value real")
+
+
+def backfill_observation_values_batch(cursor, last_id, batch_size):
+    rows = cursor.execute("select id, observed_value from observation where id > ? order by id limit ?",
+                          [last_id, batch_size]).fetchall()
+    if len(rows) == 0:
+        return None
+    cursor.executemany(
+        "update observation set numeric_value = ?, time_value = ? where id = ?",
+        [typed_observation_values_from_text(observed_value) + (observation_id,)
+         for (observation_id, observed_value) in rows]
+    )
+    return rows[-1][0]
+
+
+def create_observation_value_index(cursor):
+    finish_batched_migration(cursor, "backfill_observation_values", backfill_observation_values_batch)
+    cursor.execute("create index observation_point_atom_value "
+                   "on observation(instrumentation_point, atom_index, numeric_value)")
+
+
+def create_spool_checkpoint_table(cursor):
+    """
+    The spool drainer records the position up to which the spool has been applied in a single row.
+    """
+    cursor.execute(
+        """create table if not exists spool_checkpoint (
+            id integer not null primary key check (id = 0),
+            segment integer not null,
+            offset integer not null
+        )"""
+    )
+
+
+def create_index(name, table, columns, unique=False):
+    """
+    Return a migration creating the given index.
+    """
+    def create(cursor):
+        cursor.execute("create %sindex if not exists %s on %s(%s)" %
+                       ("unique " if unique else "", name, table, ", ".join(columns)))
+    create.__name__ = "create_index_%s" % name
+    return create
+
+
+def create_partition_table(cursor):
+    """
+    The partitioned storage engine lists its partitions in the catalog.
+    """
+    cursor.execute(
+        """create table if not exists verdict_partition (
+            name text not null primary key,
+            period_start timestamp not null,
+            period_end timestamp not null,
+            archived int not null
+        )"""
+    )
+
+
+def create_observation_aggregate_table(cursor):
+    """
+    Compaction replaces old observations with aggregates over buckets of time, for each binding.
+    """
+    cursor.execute(
+        """create table if not exists observation_aggregate (
+            instrumentation_point int not null,
+            atom_index int not null,
+            sub_index int not null,
+            binding int not null,
+            bucket_start timestamp not null,
+            observation_count int not null,
+            violation_count int not null,
+            min_value real,
+            max_value real,
+            sum_value real,
+            primary key(instrumentation_point, atom_index, sub_index, binding, bucket_start)
+        )"""
+    )
+
+
+def get_migration_progress(cursor, name):
+    row = cursor.execute("select position from schema_migration_progress where name = ?", [name]).fetchone()
+    return row[0] if row is not None else 0
+
+
+def set_migration_progress(cursor, name, position):
+    cursor.execute("insert or replace into schema_migration_progress (name, position) values(?, ?)", [name, position])
+
+
+def add_epoch_columns(cursor, schema="main"):
+    """
+    Timestamps are also held as integers (microseconds since the epoch, treating timestamps without a time zone
+    as UTC), so that time ranges can be filtered with indices and durations computed in SQL.
+    Function calls also hold their duration.  Returns the tables to which columns were added.
+    """
+    upgraded_tables = []
+    for (table, columns) in epoch_columns.items():
+        existing_columns = [row[1] for row in cursor.execute("pragma %s.table_info(%s)" % (schema, table)).fetchall()]
+        if len(existing_columns) == 0:
+            # partitions only hold some tables
+            continue
+        for (_, epoch_column) in columns:
+            if epoch_column not in existing_columns:
+                cursor.execute("alter table %s.%s add column %s integer" % (schema, table, epoch_column))
+                if table not in upgraded_tables:
+                    upgraded_tables.append(table)
+        if table == "function_call" and "duration_us" not in existing_columns:
+            cursor.execute("alter table %s.function_call add column duration_us integer" % schema)
+    return upgraded_tables
+
+
+def backfill_epoch_columns_batch(cursor, schema, table, last_id, batch_size=10000):
+    """
+    Fill in the epoch columns of the given table for the rows following last_id, up to batch_size of them.
+    Returns the id of the last row filled in, or None if there were none.
+    """
+    columns = epoch_columns[table]
+    rows = cursor.execute(
+        "select id, %s from %s.%s where id > ? order by id limit ?" %
+        (", ".join(column for (column, _) in columns), schema, table),
+        [last_id, batch_size]
+    ).fetchall()
+    if len(rows) == 0:
+        return None
+    values = [[timestamp_to_microseconds(value) for value in row[1:]] for row in rows]
+    assignments = ", ".join("%s = ?" % epoch_column for (_, epoch_column) in columns)
+    if table == "function_call":
+        assignments += ", duration_us = ? - ?"
+        values = [row_values + [row_values[1], row_values[0]] for row_values in values]
+    cursor.executemany(
+        "update %s.%s set %s where id = ?" % (schema, table, assignments),
+        [row_values + [row[0]] for (row, row_values) in zip(rows, values)]
+    )
+    return rows[-1][0]
+
+
+def backfill_epoch_columns(table):
+    """
+    Return a migration filling in the epoch columns of the given table for existing rows, a batch at a time.
+    """
+    return batched_migration(
+        "backfill_epoch_columns_%s" % table,
+        lambda cursor, last_id, batch_size: backfill_epoch_columns_batch(cursor, "main", table, last_id, batch_size)
+    )
+
+
+def analyze(cursor):
+    """
+    Gather the statistics used by the query planner to choose between indices.
+    The number of rows examined in each index is limited, so this is quick even on large databases
+    (versions of sqlite without analysis_limit ignore it, and examine every row).
+    """
+    cursor.execute("pragma analysis_limit = 1000")
+    cursor.execute("analyze")
+
+
+schema_migrations = [
+    # duplicate assignments are merged before the unique index on them is built
+    (1, unless_index_exists("assignment_variable_value", create_assignment_remap_table)),
+    (2, unless_index_exists("assignment_variable_value",
+                            create_index("assignment_variable_value_duplicates", "assignment", ["variable", "value"]))),
+    (3, unless_index_exists("assignment_variable_value",
+                            batched_migration("find_duplicate_assignments", find_duplicate_assignments_batch))),
+    (4, unless_index_exists("assignment_variable_value", move_duplicate_assignment_links)),
+    (5, unless_index_exists("assignment_variable_value",
+                            batched_migration("delete_duplicate_assignments", delete_duplicate_assignments_batch))),
+    (6, unless_index_exists("assignment_variable_value", create_assignment_index)),
+    # function calls are looked up by transaction, which is also used to merge duplicate transactions
+    (7, create_index("function_call_trans", "function_call", ["trans", "function"])),
+    (8, unless_index_exists("trans_time_of_transaction",
+                            create_index("trans_time_of_transaction_duplicates", "trans", ["time_of_transaction"]))),
+    (9, unless_index_exists("trans_time_of_transaction",
+                            batched_migration("merge_duplicate_transactions", merge_duplicate_transactions_batch))),
+    (10, unless_index_exists("trans_time_of_transaction", create_transaction_index)),
+    (11, create_spool_checkpoint_table),
+    (12, unless_index_exists("path_condition_structure_hash", add_condition_hash_column)),
+    (13, unless_index_exists("path_condition_structure_hash",
+                             create_index("path_condition_structure_hash_duplicates", "path_condition_structure",
+                                          ["hash"]))),
+    (14, unless_index_exists("path_condition_structure_hash",
+                             batched_migration("hash_conditions", hash_conditions_batch))),
+    (15, unless_index_exists("path_condition_structure_hash", create_condition_hash_index)),
+    (16, unless_index_exists("function_call_program_path", create_program_path_table)),
+    (17, unless_index_exists("function_call_program_path",
+                             batched_migration("assign_program_paths", assign_program_paths_batch))),
+    (18, unless_index_exists("function_call_program_path", create_program_path_index)),
+    (19, unless_index_exists("observation_point_atom_value", add_observation_value_columns)),
+    (20, unless_index_exists("observation_point_atom_value",
+                             batched_migration("backfill_observation_values", backfill_observation_values_batch))),
+    (21, unless_index_exists("observation_point_atom_value", create_observation_value_index)),
+    # verdicts are looked up by function call and by binding, usually along with their value
+    (22, create_index("verdict_function_call", "verdict", ["function_call", "verdict"])),
+    (23, create_index("verdict_binding", "verdict", ["binding", "verdict"])),
+    (24, create_index("observation_verdict", "observation", ["verdict"])),
+    # function calls are looked up by time range (by function, they're looked up through
+    # function_call_function_time_us, so version 25, which indexed function and time_of_call, was removed)
+    (26, create_index("function_call_time", "function_call", ["time_of_call"])),
+    (27, create_index("binding_function_property", "binding", ["function", "property_hash", "binding_space_index"])),
+    (28, create_index("function_fully_qualified_name", "function", ["fully_qualified_name"])),
+    (29, create_index("atom_property_index", "atom", ["property_hash", "index_in_atoms"])),
+    (30, analyze),
+    (31, create_partition_table),
+    (32, create_observation_aggregate_table),
+    (33, add_epoch_columns),
+    (34, backfill_epoch_columns("function_call")),
+    (35, backfill_epoch_columns("verdict")),
+    (36, backfill_epoch_columns("observation")),
+    (37, backfill_epoch_columns("trans")),
+    (38, create_index("function_call_function_time_us", "function_call", ["function", "time_of_call_us"])),
+    (39, create_index("function_call_time_us", "function_call", ["time_of_call_us"])),
+    (40, create_index("trans_time_of_transaction_us", "trans", ["time_of_transaction_us"])),
+    # version 41 dropped the index created by version 25, and was removed along with it
+    (42, analyze),
+    # indices giving the keyset pages of lists of function calls, verdicts and observations in order of id
+    (43, create_index("function_call_function_id", "function_call", ["function", "id"])),
+    (44, create_index("verdict_binding_id", "verdict", ["binding", "id"])),
+    (45, create_index("observation_point_id", "observation", ["instrumentation_point", "id"])),
+    (46, analyze),
+    # compaction finds the oldest observations, so a batch never reads observations that are kept
+    (47, create_index("observation_time_us", "observation", ["observation_time_us"]))
+]
+
+
+def create_schema_migration_table(cursor):
+    cursor.execute(
+        """create table if not exists schema_migration (
+            version integer not null primary key,
+            name text not null,
+            time_applied timestamp not null
+        )"""
+    )
+    cursor.execute(
+        """create table if not exists schema_migration_progress (
+            name text not null primary key,
+            position integer not null
+        )"""
+    )
+
+
+def get_schema_version(cursor):
+    """
+    Return the version of the last migration applied to the database behind the given cursor.
+    """
+    create_schema_migration_table(cursor)
+    version = cursor.execute("select max(version) from schema_migration").fetchone()[0]
+    return version if version is not None else 0
+
+
+def has_rows_to_migrate(cursor):
+    """
+    Return whether the database behind the given cursor holds any of the rows that are rewritten or indexed by
+    migrations, which can then take a long time.  A database just created from verdict-schema.sql holds none.
+    """
+    for table in ["trans", "function_call", "verdict", "observation", "assignment", "path_condition_structure"]:
+        if cursor.execute("select exists(select 1 from %s)" % table).fetchone()[0]:
+            return True
+    return False
+
+
+def list_pending_migrations(cursor):
+    applied = set(row[0] for row in cursor.execute("select version from schema_migration").fetchall())
+    return [(version, migration) for (version, migration) in schema_migrations if version not in applied]
+
+
+def upgrade_schema(connection, verbose=False):
+    """
+    Apply the migrations that haven't yet been applied to the database behind the given connection, in order.
+    Stops at the first migration that fails, since later migrations may depend on it.
+    Returns whether every migration has been applied.
+    """
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    cursor = connection.cursor()
+    try:
+        create_schema_migration_table(cursor)
+        for (version, migration) in list_pending_migrations(cursor):
+            try:
+                if verbose:
+                    print("Applying migration %i (%s)" % (version, migration.__name__))
+                while True:
+                    cursor.execute("begin immediate")
+                    # another process may have applied the migration since the pending migrations were listed
+                    applied = cursor.execute("select version from schema_migration where version = ?",
+                                             [version]).fetchone()
+                    if applied is not None:
+                        cursor.execute("rollback")
+                        break
+                    if migration(cursor):
+                        # commit this batch, so writers can proceed before the next one
+                        cursor.execute("commit")
+                        continue
+                    cursor.execute("insert into schema_migration (version, name, time_applied) values(?, ?, ?)",
+                                   [version, migration.__name__, datetime.datetime.now().isoformat()])
+                    cursor.execute("commit")
+                    break
+            except:
+                print("ERROR OCCURRED DURING SCHEMA MIGRATION %i:" % version)
+                traceback.print_exc()
+                try:
+                    cursor.execute("rollback")
+                except:
+                    # the migration failed before its transaction began
+                    pass
+                return False
+        return True
+    finally:
+        connection.isolation_level = isolation_level
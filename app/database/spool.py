@@ -0,0 +1,404 @@
+"""
+Module to provide the spool used by the "spooled" ingestion mode.
+
+Insertions are appended to a local, append-only journal and acknowledged straight away.  A background drainer
+applies the journal to the verdict database in groups, recording how far it has got (the checkpoint) in the same
+transaction as the rows it inserts, so after a crash the drainer replays exactly the records that weren't committed.
+
+The journal is split into numbered segment files, each holding one json record per line.  Once the drainer has
+applied a segment that is no longer being appended to, the segment is deleted.  Payloads sent in the compact format
+can hold binary values, which json can't represent, so these are written as objects holding their base64 encoding.
+
+Records that can't be applied (for example, verdicts for a binding that doesn't exist) have already been acknowledged,
+so rather than being dropped they are appended, along with the error, to the dead-letter file alongside the segments.
+"""
+import atexit
+import base64
+import collections
+import glob
+import json
+import os
+import threading
+import time
+
+import app
+from .utils import get_connection
+from .writer import apply_group
+
+
+def encode_binary(value):
+    """
+    Used as the default of json.dumps, to write the binary values of compact payloads.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return {"__binary__": base64.b64encode(bytes(value)).decode("ascii")}
+    raise TypeError("%r can't be spooled" % (value,))
+
+
+def decode_binary(dictionary):
+    """
+    Used as the object_hook of json.loads, to read back the binary values written by encode_binary.
+    """
+    if len(dictionary) == 1 and "__binary__" in dictionary:
+        return base64.b64decode(dictionary["__binary__"])
+    return dictionary
+
+
+def dump_record(record):
+    return (json.dumps(record, default=encode_binary) + "\n").encode("utf-8")
+
+
+class Spool(object):
+    """
+    Append-only journal of insertions waiting to be applied to the verdict database.
+    Positions in the journal are (segment, offset) pairs, where offset is in bytes.
+    """
+
+    def __init__(self, path, max_size, segment_size, sync):
+        self.path = path
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.sync = sync
+        self._lock = threading.Lock()
+        self._new_records = threading.Condition(self._lock)
+        self._file = None
+        self.segment = 0
+        # (time spooled, size in bytes) of each record that hasn't been applied yet, oldest first
+        self._pending = collections.deque()
+        self._pending_size = 0
+        self._next_function_call_id = None
+
+    def segment_path(self, segment):
+        return "%s.%i" % (self.path, segment)
+
+    def dead_letter_path(self):
+        return "%s.failed" % self.path
+
+    def segments(self):
+        """
+        Return the numbers of the segments on disk, in order.
+        """
+        segments = []
+        for segment_path in glob.glob("%s.*" % self.path):
+            suffix = segment_path[len(self.path) + 1:]
+            if suffix.isdigit():
+                segments.append(int(suffix))
+        return sorted(segments)
+
+    def recover(self, cursor, position):
+        """
+        Given the position up to which the journal has been applied, find the records still to be applied,
+        and get ready to append after them.
+        """
+        segments = [segment for segment in self.segments() if segment >= position[0]]
+        if len(segments) > 0:
+            self.segment = segments[-1]
+            # a crash can leave a partially written record at the end of the last segment
+            self._truncate_partial_record(self.segment_path(self.segment))
+        else:
+            self.segment = position[0]
+
+        largest_function_call_id = 0
+        for (record, _) in self.read(position):
+            if record is None:
+                continue
+            self._pending.append((record["time_spooled"], record["size"]))
+            self._pending_size += record["size"]
+            if record["kind"] in ("function_call", "function_call_and_verdicts"):
+                largest_function_call_id = max(largest_function_call_id, record["data"]["function_call_id"])
+
+        # function call ids are allocated here rather than by the database, so they can be returned immediately
+        from .insertion import get_next_id
+        self._next_function_call_id = max(get_next_id(cursor, "function_call"), largest_function_call_id + 1)
+
+        self._file = open(self.segment_path(self.segment), "ab")
+
+    def _truncate_partial_record(self, segment_path):
+        with open(segment_path, "rb+") as segment_file:
+            contents = segment_file.read()
+            if len(contents) > 0 and not contents.endswith(b"\n"):
+                segment_file.truncate(contents.rfind(b"\n") + 1)
+
+    def allocate_function_call_id(self):
+        with self._lock:
+            function_call_id = self._next_function_call_id
+            self._next_function_call_id += 1
+            return function_call_id
+
+    def append(self, kind, data):
+        """
+        Append a record to the journal, returning False without appending it if the spool is full.
+        The record is on disk (and, if sync is set, flushed to the device) when this returns True.
+        """
+        time_spooled = time.time()
+        line = dump_record({"kind": kind, "time_spooled": time_spooled, "data": data})
+        with self._lock:
+            if self._pending_size + len(line) > self.max_size:
+                return False
+            if self._file.tell() >= self.segment_size:
+                # the old segment is complete, so the drainer can delete it once it has been applied
+                self._file.close()
+                self.segment += 1
+                self._file = open(self.segment_path(self.segment), "ab")
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self._pending.append((time_spooled, len(line)))
+            self._pending_size += len(line)
+            self._new_records.notify()
+        return True
+
+    def read(self, position, max_records=None):
+        """
+        Read complete records from the given position onwards.
+        Returns a list of (record, position after record) pairs.
+        """
+        with self._lock:
+            current_segment = self.segment
+        (segment, offset) = position
+        records = []
+        while max_records is None or len(records) < max_records:
+            segment_path = self.segment_path(segment)
+            if os.path.exists(segment_path):
+                with open(segment_path, "rb") as segment_file:
+                    segment_file.seek(offset)
+                    for line in segment_file:
+                        if not line.endswith(b"\n") or (max_records is not None and len(records) == max_records):
+                            break
+                        offset += len(line)
+                        record = json.loads(line.decode("utf-8"), object_hook=decode_binary)
+                        record["size"] = len(line)
+                        records.append((record, (segment, offset)))
+            if segment >= current_segment or (max_records is not None and len(records) == max_records):
+                break
+            # earlier segments are never appended to again, so move on to the next one
+            segment += 1
+            offset = 0
+            if len(records) == 0:
+                records.append((None, (segment, offset)))
+        return records
+
+    def dead_letter(self, failures):
+        """
+        Given a list of (record, exception) pairs for records that couldn't be applied, append them to the
+        dead-letter file, with the error that each gave.
+        """
+        if len(failures) == 0:
+            return
+        with open(self.dead_letter_path(), "ab") as dead_letter_file:
+            for (record, exception) in failures:
+                dead_letter_file.write(dump_record({
+                    "kind": record["kind"],
+                    "time_spooled": record["time_spooled"],
+                    "data": record["data"],
+                    "error": str(exception)
+                }))
+            dead_letter_file.flush()
+            if self.sync:
+                os.fsync(dead_letter_file.fileno())
+
+    def wait_for_records(self, timeout):
+        with self._lock:
+            if len(self._pending) == 0:
+                self._new_records.wait(timeout)
+
+    def mark_applied(self, sizes):
+        with self._lock:
+            for size in sizes:
+                self._pending.popleft()
+                self._pending_size -= size
+
+    def remove_segments_before(self, segment):
+        for old_segment in self.segments():
+            if old_segment < segment:
+                os.remove(self.segment_path(old_segment))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def statistics(self):
+        with self._lock:
+            if len(self._pending) > 0:
+                drain_lag = time.time() - self._pending[0][0]
+            else:
+                drain_lag = 0
+            return {
+                "depth": len(self._pending),
+                "size": self._pending_size,
+                "capacity": self.max_size,
+                "segment": self.segment,
+                "drain_lag": drain_lag
+            }
+
+
+class SpoolDrainer(object):
+    """
+    Background thread that applies the spool to the verdict database, one group of records per transaction.
+    """
+
+    def __init__(self, spool, position, max_group_size, interval):
+        self.spool = spool
+        self.position = position
+        self._max_group_size = max_group_size
+        self._interval = interval
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vypr-spool-drainer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Apply everything already spooled, then stop the drainer thread.
+        """
+        self._stopping = True
+        self._thread.join()
+
+    def dead_letter_callback(self, group, records):
+        """
+        Return the function called by apply_group with the intents of a group that failed, which moves the records
+        they were made from to the dead-letter file before the group is committed.  If the group has to be applied
+        again, its records may be added to the dead-letter file more than once.
+        """
+        records_by_intent = dict((id(intent), record) for (intent, record) in zip(group, records))
+
+        def dead_letter(failures):
+            if any(id(intent) not in records_by_intent for (intent, _) in failures):
+                # the checkpoint couldn't be written, so the group mustn't be committed without it
+                raise Exception("The spool checkpoint could not be written.")
+            self.spool.dead_letter([(records_by_intent[id(intent)], exception) for (intent, exception) in failures])
+        return dead_letter
+
+    def _run(self):
+        connection = get_connection()
+        connection.isolation_level = None
+        cursor = connection.cursor()
+
+        while True:
+            records = self.spool.read(self.position, self._max_group_size)
+            if len(records) == 0:
+                if self._stopping:
+                    break
+                self.spool.wait_for_records(self._interval)
+                continue
+
+            position = records[-1][1]
+            records = [record for (record, _) in records if record is not None]
+            group = [(spooled_writes[record["kind"]], record["data"], None) for record in records]
+            # the checkpoint is committed with the records, so they are applied exactly once
+            group.append((write_spool_checkpoint, position, None))
+            connection.prepare()
+            committed = apply_group(cursor, group, self.dead_letter_callback(group, records))
+            connection.count_rows_changed()
+            if committed:
+                self.position = position
+                self.spool.mark_applied([record["size"] for record in records])
+                self.spool.remove_segments_before(position[0])
+            else:
+                # the database may be locked by another process, so try the same records again later
+                time.sleep(self._interval)
+
+        connection.close()
+
+
+def read_spool_checkpoint(cursor):
+    row = cursor.execute("select segment, offset from spool_checkpoint where id = 0").fetchone()
+    if row is None:
+        return (0, 0)
+    return (row[0], row[1])
+
+
+def write_spool_checkpoint(cursor, position):
+    cursor.execute("insert or replace into spool_checkpoint (id, segment, offset) values(0, ?, ?)",
+                   [position[0], position[1]])
+
+
+def write_spooled_function_call_data(cursor, call_data):
+    from .insertion import write_function_call_data
+    return write_function_call_data(cursor, call_data)
+
+
+def write_spooled_function_call_and_verdicts(cursor, call_data):
+    from .insertion import write_function_call_and_verdicts
+    return write_function_call_and_verdicts(cursor, call_data)
+
+
+def write_spooled_verdicts(cursor, verdict_dictionary):
+    from .insertion import write_verdicts
+    return write_verdicts(cursor, verdict_dictionary)
+
+
+def write_spooled_compact_verdicts(cursor, verdict_array):
+    from .compact import write_compact_verdicts
+    return write_compact_verdicts(cursor, verdict_array)
+
+
+# map from the kinds of record in the spool to the functions that apply them
+spooled_writes = {
+    "function_call": write_spooled_function_call_data,
+    "function_call_and_verdicts": write_spooled_function_call_and_verdicts,
+    "verdicts": write_spooled_verdicts,
+    "compact_verdicts": write_spooled_compact_verdicts
+}
+
+spool = None
+drainer = None
+spool_lock = threading.Lock()
+
+
+def get_spool_path():
+    """
+    Return the path prefix of the spool segment files, which is derived from the verdict database's path
+    unless app.spool_path is set, so servers using different databases never share a spool.
+    """
+    if app.spool_path is not None:
+        return app.spool_path
+    return "%s.spool" % app.database_string
+
+
+def get_spool():
+    """
+    Get the spool, replaying anything left in it by a previous run and starting the drainer if needed.
+    """
+    global spool, drainer
+    with spool_lock:
+        if spool is None:
+            connection = get_connection()
+            cursor = connection.cursor()
+            position = read_spool_checkpoint(cursor)
+            new_spool = Spool(get_spool_path(), app.spool_max_size, app.spool_segment_size, app.spool_sync)
+            new_spool.recover(cursor, position)
+            connection.close()
+
+            drainer = SpoolDrainer(new_spool, position, app.group_commit_size, app.group_commit_interval)
+            drainer.start()
+            spool = new_spool
+            # make sure spooled writes are applied when the server exits
+            atexit.register(stop_spool)
+        return spool
+
+
+def stop_spool():
+    """
+    Apply the rest of the spool and stop the drainer, if it was started.
+    """
+    global spool, drainer
+    with spool_lock:
+        if spool is not None:
+            drainer.stop()
+            spool.close()
+            spool = None
+            drainer = None
+
+
+def spool_statistics():
+    with spool_lock:
+        if spool is None:
+            return None
+        return spool.statistics()
@@ -1,17 +1,211 @@
 """
 Module to provide database utility functions.
 """
+import base64
+import heapq
+import itertools
+import re
 import sqlite3
 import json
+import threading
+from flask import g, has_app_context
 import app
+from app.metrics import count_statement, count_rows_changed, connections_opened_total
+from .schema import upgrade_schema, create_schema_migration_table, list_pending_migrations, has_rows_to_migrate
+from .engine import get_engine
 
 #database_string = "verdicts.db"
 
+try:
+    blob_types = (bytes, bytearray, memoryview, buffer)
+except NameError:
+    blob_types = (bytes, bytearray, memoryview)
 
-def get_connection():
-    # for now, let exceptions appear in the log
-    print(app.database_string)
-    return sqlite3.connect(app.database_string)
+class PooledConnection(object):
+    """
+    Wrapper around a pooled sqlite connection.  Closing the wrapper returns the connection to its pool,
+    with any open transaction rolled back and any row factory or isolation level set through the wrapper reset.
+    """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self._total_changes = connection.total_changes
+        self.closed = False
+
+    @property
+    def row_factory(self):
+        return self._connection.row_factory
+
+    @row_factory.setter
+    def row_factory(self, row_factory):
+        self._connection.row_factory = row_factory
+
+    @property
+    def isolation_level(self):
+        return self._connection.isolation_level
+
+    @isolation_level.setter
+    def isolation_level(self, isolation_level):
+        self._connection.isolation_level = isolation_level
+
+    def cursor(self):
+        return self._connection.cursor()
+
+    def execute(self, *args):
+        return self._connection.execute(*args)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def prepare(self, time_range=None, group=None):
+        """
+        Prepare the connection again, for engines that change what it holds over time, or to query the given
+        group of partitions (see get_partition_groups).
+        Long-lived connections should call this outside of transactions.
+        """
+        self._pool.engine.prepare(self._connection, time_range, group)
+
+    def count_rows_changed(self):
+        """
+        Add the rows changed through this connection since it was taken from the pool (or since this was last called)
+        to the metrics.  This is called when the connection is closed, so only long-lived connections need to call it.
+        """
+        total_changes = self._connection.total_changes
+        count_rows_changed(total_changes - self._total_changes)
+        self._total_changes = total_changes
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.count_rows_changed()
+            self._pool.release(self._connection)
+            self._connection = None
+
+
+class ConnectionPool(object):
+    """
+    Pool of connections opened by one storage engine, each configured with app.sqlite_pragmas when it is opened.
+    At most app.connection_pool_size idle connections are kept.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def acquire(self):
+        with self._lock:
+            if len(self._idle) > 0:
+                return self._idle.pop()
+        return self.open()
+
+    def open(self):
+        connection = self.engine.connect()
+        connections_opened_total.inc()
+        if hasattr(connection, "set_trace_callback"):
+            connection.set_trace_callback(count_statement)
+        for (pragma, value) in app.sqlite_pragmas:
+            connection.execute("pragma %s = %s" % (pragma, value))
+        return connection
+
+    def release(self, connection):
+        # roll back anything left uncommitted (this fails harmlessly if there is no transaction)
+        try:
+            connection.execute("rollback")
+        except sqlite3.Error:
+            pass
+        connection.row_factory = None
+        connection.isolation_level = ""
+        with self._lock:
+            if len(self._idle) < app.connection_pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_connection(time_range=None, group=None):
+    """
+    Get a connection to the verdict database from the pool.  Closing the connection returns it to the pool,
+    and connections taken while handling a request are returned when the request ends if they weren't closed.
+    A time range (a pair of timestamps) limits the partitions queried, with the partitioned storage engine,
+    or a group of partitions to query can be given (see get_partition_groups).
+    """
+    engine = get_engine()
+    with pools_lock:
+        pool = pools.get(engine)
+        if pool is None:
+            pool = ConnectionPool(engine)
+            pools[engine] = pool
+    connection = PooledConnection(pool, pool.acquire())
+    connection.prepare(time_range, group)
+    if has_app_context():
+        if getattr(g, "database_connections", None) is None:
+            g.database_connections = []
+        g.database_connections.append(connection)
+    return connection
+
+
+def get_partition_groups(query_string, time_range=None):
+    """
+    Return the groups of partitions over which the given query must be run in turn to read every row it selects
+    (with any engine other than the partitioned storage engine, this is a single group, [None]).
+    """
+    return get_engine().partition_groups(time_range, query_string)
+
+
+def upgrade_database(verbose=False):
+    """
+    Bring the verdict database up to date when the server starts, before any request is handled.
+    Pending migrations are only applied here if the database holds no rows for them to rewrite or index, as when
+    it has just been created from verdict-schema.sql.  Otherwise they can take a long time, during which nothing
+    would be served, so they must be applied beforehand with migrate_database.py.
+    Returns whether the database is up to date.
+    """
+    engine = get_engine()
+    # the connection isn't pooled, since pooled connections are prepared by the engine for queries
+    connection = engine.connect()
+    try:
+        for (pragma, value) in app.sqlite_pragmas:
+            connection.execute("pragma %s = %s" % (pragma, value))
+        cursor = connection.cursor()
+        create_schema_migration_table(cursor)
+        pending = list_pending_migrations(cursor)
+        connection.commit()
+        if len(pending) > 0 and has_rows_to_migrate(cursor):
+            print("The verdict database '%s' has %i pending migrations, which can take a long time on the rows it "
+                  "holds.  Apply them with migrate_database.py --db %s before starting the server." %
+                  (app.database_string, len(pending), app.database_string))
+            return False
+        if not upgrade_schema(connection, verbose):
+            return False
+    finally:
+        connection.close()
+    engine.upgrade()
+    return True
+
+
+@app.app_object.teardown_appcontext
+def release_request_connections(exception):
+    for connection in getattr(g, "database_connections", []):
+        connection.close()
+
+
+def encode_value(value):
+    """
+    Used as the default of json.dumps for the values of columns that json can't hold,
+    which are blobs (such as pickled assignment values), given as base64 strings.
+    """
+    if isinstance(value, blob_types):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    raise TypeError("%r can't be given as json." % (value,))
 
 
 def query_db_one(query_string, arg):
@@ -19,19 +213,322 @@ def query_db_one(query_string, arg):
     connection.row_factory = sqlite3.Row
     # enables saving the rows as a dictionary with name of column as key
     cursor = connection.cursor()
-    list1 = cursor.execute(query_string, arg)
-    f = list1.fetchone()
+    # the row may be held by any group of partitions, which are queried in turn until it's found
+    for group in get_partition_groups(query_string):
+        connection.prepare(group=group)
+        f = cursor.execute(query_string, arg).fetchone()
+        if f is not None:
+            break
     connection.close()
     if f == None: return ("None")
-    return json.dumps(dict(f))
+    return json.dumps(dict(f), default=encode_value)
 
 
-def query_db_all(query_string, arg):
-    connection = get_connection()
+def has_where_clause(query_string):
+    """
+    Return whether a query has a where clause outside of its subqueries.
+    """
+    previous = None
+    while previous != query_string:
+        previous = query_string
+        query_string = re.sub(r"\([^()]*\)", "", query_string)
+    return re.search(r"\bwhere\b", query_string, re.IGNORECASE) is not None
+
+
+class Listing(object):
+    """
+    How a list is given by the analysis API: the page of rows requested, if any (see page_query), the fields of
+    each row to give (or None for every field), and the format of the response, which is
+    "json" for a json array of dictionaries,
+    "ndjson" for newline-delimited json, with one dictionary per line,
+    or "compact" for a dictionary {"columns": [...], "rows": [...]} holding the names of the fields once,
+    and the values of each row as an array.
+    """
+
+    def __init__(self, after_id=None, limit=None, response_format="json", fields=None):
+        self.after_id = after_id
+        self.limit = limit
+        self.response_format = response_format
+        self.fields = fields
+
+
+def page_query(query_string, arg, listing, key, order=None, merged=False, after_values=None):
+    """
+    Given a query (without an order by or limit clause) and a listing requesting a page, restrict the query to the
+    rows whose key (a qualified id column, such as observation.id) comes after listing.after_id, ordered by the key,
+    or by the columns in order (the last of which must be the key) if it is given.
+    Up to listing.limit + 1 rows are selected, so that we know if there is another page, and the key of each row
+    is selected first, as page_key.
+    If merged is True, the rows are to be merged with those of the same query over other groups of partitions
+    (see MergedCursor), so the values of the other columns in the order are also selected, as page_order_0, ...,
+    and the listing needn't request a page.  The values of the order columns in the row with key listing.after_id
+    are then given as after_values, since that row may be held by another group.
+    """
+    order = order or [key]
+    selected = ["%s as page_key" % key]
+    if merged:
+        selected += ["%s as page_order_%i" % (column, index) for (index, column) in enumerate(order[:-1])]
+    query_string = re.sub(r"^\s*select\s", "select %s, " % ", ".join(selected), query_string.strip().rstrip(";"),
+                          count=1, flags=re.IGNORECASE)
+    arg = list(arg)
+    if listing.after_id is not None:
+        if len(order) == 1:
+            condition = "%s > ?" % key
+            arg.append(listing.after_id)
+        elif after_values is not None:
+            condition = "(%s) > (%s)" % (", ".join(order), ", ".join(["?"] * len(order)))
+            arg += after_values
+        else:
+            # rows are ordered by other columns first, so the page starts after the values of those columns
+            # in the row with the given key
+            table = key.split(".")[0]
+            condition = "(%s) > (select %s from %s where %s = ?)" % (", ".join(order), ", ".join(order), table, key)
+            arg.append(listing.after_id)
+        query_string += " %s %s" % ("and" if has_where_clause(query_string) else "where", condition)
+    query_string += " order by %s" % ", ".join(order)
+    if listing.limit is not None:
+        query_string += " limit ?"
+        arg.append(listing.limit + 1)
+    return (query_string, arg)
+
+
+def project_query(cursor, query_string, arg, fields, key_columns):
+    """
+    Given a query, restrict the columns it selects to the given fields (after the given key_columns, such as
+    the page_key column of a paged query), so that no other columns are read or encoded.  The query's own order is kept.
+    An exception is raised if a field isn't selected by the query.
+    """
+    query_string = query_string.strip().rstrip(";")
+    columns = [column[0] for column in
+               cursor.execute("select * from (%s) limit 0" % query_string, arg).description]
+    unknown_fields = [field for field in fields if field not in columns or field in key_columns]
+    if len(unknown_fields) > 0:
+        raise ValueError("Unknown fields: %s.  The fields that can be given are %s." %
+                         (", ".join(unknown_fields),
+                          ", ".join(column for column in columns if column not in key_columns)))
+    selected = list(key_columns) + ['"%s"' % field for field in fields]
+    return "select %s from (%s)" % (", ".join(selected), query_string)
+
+
+def sql_sort_key(value):
+    """
+    Return a key giving values the order sqlite gives them: null, then numbers, then text, then blobs.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, bytes):
+        return (3, value)
+    return (2, value)
+
+
+class MergedCursor(object):
+    """
+    Gives the rows of a query run over several groups of partitions (see page_query with merged set), each on its
+    own connection, as the cursor of a single query would, merging the rows in the order given by the page_key and
+    page_order columns each query selects first.  Only page_key is kept, and only if keep_key is True.
+    Closing the merged cursor closes every connection.
+    """
+
+    def __init__(self, connections, cursors, order_length, keep_key):
+        self._connections = connections
+        # page_key is followed by a page_order column for each column in the order other than the key
+        key_length = order_length
+        description = tuple(cursors[0].description)
+        self.description = (description[:1] if keep_key else ()) + description[key_length:]
+
+        def ordered_rows(index, cursor):
+            for row in cursor:
+                # ties are broken by the position of the cursor, so rows themselves are never compared
+                yield (tuple(sql_sort_key(value) for value in row[1:key_length] + row[:1]), index,
+                       row[:1] + row[key_length:] if keep_key else row[key_length:])
+
+        self._rows = (row for (_, _, row) in heapq.merge(*[ordered_rows(index, cursor)
+                                                            for (index, cursor) in enumerate(cursors)]))
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self._rows, size))
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+
+
+def stream_rows(connection, cursor, listing):
+    """
+    Generate the rows given by a cursor as fragments of the response format requested by a listing, reading
+    app.stream_chunk_size rows at a time.  The connection is closed once every row has been given.
+    If the listing requests a page, the json array is given as {"results": [...], "next": after_id}, where after_id
+    gives the next page (or is null if there are no more rows), newline-delimited rows are followed by
+    a line {"next": after_id}, and the compact format holds "next" alongside "columns" and "rows".
+    """
+    try:
+        paged = listing.limit is not None
+        compact = listing.response_format == "compact"
+        ndjson = listing.response_format == "ndjson"
+        columns = [column[0] for column in cursor.description]
+        if paged:
+            # page_query selects page_key first
+            columns = columns[1:]
+        count = 0
+        last_key = None
+        next_after_id = None
+        page_full = False
+        if compact:
+            yield '{"columns": %s, "rows": [' % json.dumps(columns)
+        elif not ndjson:
+            yield '{"results": [' if paged else "["
+        while not page_full:
+            # no more rows are read than the page needs to give (with the partitioned storage engine, the rows of
+            # each group of partitions are only read as they're merged)
+            size = app.stream_chunk_size if not paged else min(app.stream_chunk_size, listing.limit + 1 - count)
+            rows = cursor.fetchmany(size)
+            if len(rows) == 0:
+                break
+            fragments = []
+            for row in rows:
+                if paged:
+                    if count == listing.limit:
+                        # page_query selects one more row than the page holds if there is another page, and
+                        # nothing more is read once it has been
+                        next_after_id = last_key
+                        page_full = True
+                        break
+                    last_key = row[0]
+                    row = tuple(row)[1:]
+                # sqlite only gives numbers, strings, blobs and nulls, so no row can fail to be encoded once
+                # the response has started
+                fragments.append(json.dumps(list(row) if compact else dict(zip(columns, row)), default=encode_value))
+                count += 1
+            if len(fragments) == 0:
+                continue
+            if ndjson:
+                yield "\n".join(fragments) + "\n"
+            else:
+                yield (", " if count > len(fragments) else "") + ", ".join(fragments)
+        if compact:
+            yield '], "next": %s}' % json.dumps(next_after_id) if paged else "]}"
+        elif ndjson:
+            if paged:
+                yield json.dumps({"next": next_after_id}) + "\n"
+        else:
+            yield '], "next": %s}' % json.dumps(next_after_id) if paged else "]"
+    finally:
+        connection.close()
+
+
+def query_db_all(query_string, arg, time_range=None, listing=None, key=None, order=None):
+    """
+    Run a query, returning the rows as a json list of dictionaries.
+    If a listing is given, a generator of the json fragments making up the rows is returned instead (see stream_rows),
+    so rows are read from the database as they are sent.  Rows are then restricted to the page requested by the
+    listing, using the given key and order (see page_query), and to the fields it requests (see project_query).
+    With the partitioned storage engine, a query without a time range is run over each group of partitions, and
+    the rows of a listing are merged in the order of its key (or the given order).
+    """
+    groups = get_partition_groups(query_string, time_range)
+    if listing is not None and len(groups) > 1:
+        return query_db_merged(groups, query_string, arg, listing, key, order)
+    paged = listing is not None and listing.limit is not None
+    if paged:
+        (query_string, arg) = page_query(query_string, arg, listing, key, order)
+    elif listing is not None and order is not None:
+        query_string += " order by %s" % ", ".join(order)
+    connection = get_connection(time_range, groups[0])
+    cursor = connection.cursor()
+    if listing is not None:
+        try:
+            if listing.fields is not None:
+                query_string = project_query(cursor, query_string, arg, listing.fields, ["page_key"] if paged else [])
+            results = cursor.execute(query_string, arg)
+        except:
+            connection.close()
+            raise
+        return stream_rows(connection, results, listing)
     connection.row_factory = sqlite3.Row
     cursor = connection.cursor()
-    results = cursor.execute(query_string, arg)
-    results = results.fetchall()
+    results = []
+    for group in groups:
+        connection.prepare(time_range, group)
+        results += cursor.execute(query_string, arg).fetchall()
     connection.close()
+    if len(groups) > 1 and order is not None:
+        # each group's rows are in order, but the groups' rows must be merged
+        results.sort(key=lambda row: tuple(sql_sort_key(row[column.split(".")[-1]]) for column in order))
     if results == None: return ("None")
-    return json.dumps([dict(r) for r in results])
+    return json.dumps([dict(r) for r in results], default=encode_value)
+
+
+def query_db_merged(groups, query_string, arg, listing, key, order):
+    """
+    Run a query for a listing over each of the given groups of partitions, on a connection for each group,
+    returning a generator of the json fragments making up the rows of every group, merged (see MergedCursor).
+    """
+    order = order or [key]
+    after_values = None
+    if listing.after_id is not None and len(order) > 1:
+        # the row with the given key may be held by any group
+        row = query_db_one("select %s from %s where %s = ?" % (", ".join(order), key.split(".")[0], key),
+                           [listing.after_id])
+        after_values = [json.loads(row)[column.split(".")[-1]] if row != "None" else None for column in order]
+    (query_string, arg) = page_query(query_string, arg, listing, key, order, merged=True, after_values=after_values)
+    key_columns = ["page_key"] + ["page_order_%i" % index for index in range(len(order) - 1)]
+    connections = []
+    cursors = []
+    try:
+        for group in groups:
+            connection = get_connection(group=group)
+            connections.append(connection)
+            cursor = connection.cursor()
+            if listing.fields is not None and len(cursors) == 0:
+                query_string = project_query(cursor, query_string, arg, listing.fields, key_columns)
+            cursors.append(cursor.execute(query_string, arg))
+    except:
+        for connection in connections:
+            connection.close()
+        raise
+    merged = MergedCursor(connections, cursors, len(order), listing.limit is not None)
+    return stream_rows(merged, merged, listing)
+
+
+def query_db_batch(ids, query_string, many=False):
+    """
+    Given a list of ids and a query selecting rows whose first column is batch_id, from temp.batch_ids joined with
+    the tables holding the rows, return a json dictionary mapping each id to the row with that id (or None if
+    there isn't one) - or, if many is True, to the list of rows with that id.
+    The ids are put in a temporary table (emptied before each use), so they are resolved by one query however many
+    there are.  With the partitioned storage engine, the query is run over each group of partitions in turn - ids whose
+    row has been found are removed from the table before the next group, unless many is True.
+    """
+    connection = get_connection()
+    # partitions can't be attached inside a transaction, so the changes to the temporary table are made in
+    # transactions begun (and committed) explicitly, between which groups of partitions are attached
+    connection.isolation_level = None
+    cursor = connection.cursor()
+    cursor.execute("begin")
+    cursor.execute("create temp table if not exists batch_ids (id integer not null primary key)")
+    cursor.execute("delete from temp.batch_ids")
+    cursor.executemany("insert or ignore into temp.batch_ids (id) values(?)", [[batch_id] for batch_id in ids])
+    cursor.execute("commit")
+    rows_by_id = dict((batch_id, [] if many else None) for batch_id in ids)
+    for group in get_partition_groups(query_string):
+        connection.prepare(group=group)
+        results = cursor.execute(query_string)
+        columns = [column[0] for column in results.description][1:]
+        found = []
+        for row in results:
+            row_dictionary = dict(zip(columns, row[1:]))
+            if many:
+                rows_by_id[row[0]].append(row_dictionary)
+            else:
+                rows_by_id[row[0]] = row_dictionary
+                found.append([row[0]])
+        if not many:
+            cursor.execute("begin")
+            cursor.executemany("delete from temp.batch_ids where id = ?", found)
+            cursor.execute("commit")
+            if all(row is not None for row in rows_by_id.values()):
+                break
+    connection.close()
+    return json.dumps(dict((str(batch_id), rows) for (batch_id, rows) in rows_by_id.items()), default=encode_value)
@@ -0,0 +1,89 @@
+"""
+Module to provide the typed forms of observed values and timestamps that are stored alongside their
+serialised forms, so that analysis can compare and plot observations, and filter by time, in SQL.
+"""
+import ast
+import datetime
+
+from dateutil import tz
+from dateutil.parser import isoparse
+
+epoch = datetime.datetime(1970, 1, 1)
+
+
+def parse_datetime(timestamp):
+    """
+    Given an ISO 8601 timestamp, return a naive datetime in UTC, or None if it can't be parsed.
+    Timestamps without a time zone are treated as UTC.
+    """
+    try:
+        # fromisoformat is much faster, and handles the timestamps sent by VyPR
+        parsed = datetime.datetime.fromisoformat(timestamp)
+    except (AttributeError, ValueError, TypeError):
+        try:
+            parsed = isoparse(timestamp)
+        except (ValueError, TypeError, OverflowError):
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(tz.tzutc()).replace(tzinfo=None)
+    return parsed
+
+
+def parse_timestamp(timestamp):
+    """
+    Given an ISO 8601 timestamp, return the number of seconds since the epoch, or None if it can't be parsed.
+    """
+    parsed = parse_datetime(timestamp)
+    if parsed is None:
+        return None
+    return (parsed - epoch).total_seconds()
+
+
+def timestamp_to_microseconds(timestamp):
+    """
+    Given an ISO 8601 timestamp, return the (integer) number of microseconds since the epoch,
+    or None if it can't be parsed.
+    """
+    parsed = parse_datetime(timestamp)
+    if parsed is None:
+        return None
+    delta = parsed - epoch
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def microseconds_to_datetime(microseconds):
+    return epoch + datetime.timedelta(microseconds=microseconds)
+
+
+def typed_observation_values(value):
+    """
+    Given an observed value, return a pair (numeric_value, time_value), either of which can be None.
+    Numbers (or strings holding numbers) are numeric values, as is the value of a state observation holding a
+    single number.  Transition observations hold the time at which the transition was taken.
+    """
+    if isinstance(value, dict):
+        if len(value) != 1:
+            return (None, None)
+        (key, value), = value.items()
+        if key == "time":
+            return (None, parse_timestamp(value))
+        if isinstance(value, (int, float)):
+            return (float(value), None)
+        return (None, None)
+    try:
+        return (float(value), None)
+    except (ValueError, TypeError):
+        return (None, None)
+
+
+def typed_observation_values_from_text(observed_value):
+    """
+    Given the serialised form of an observed value (as stored in observation.observed_value),
+    return its typed values.
+    """
+    try:
+        value = ast.literal_eval(observed_value)
+    except (ValueError, SyntaxError):
+        # strings aren't quoted when they're serialised
+        value = observed_value
+    return typed_observation_values(value)
@@ -3,6 +3,9 @@ Module to provide functions for the web analysis tool to use.
 
 """
 from .utils import get_connection
+from .catalog import catalog
+from .compaction import list_compacted_observations
+from .values import timestamp_to_microseconds, microseconds_to_datetime
 import json
 import dateutil.parser
 from dateutil.parser import isoparse
@@ -31,30 +34,42 @@ def list_calls_from_id(function_id, tests = None):
     """
     connection = get_connection()
     cursor = connection.cursor()
+    # the columns used by the front end, followed by the times in microseconds and the duration
+    columns = """id, function, time_of_call, end_time_of_call, trans,
+        (select path_condition_id_sequence from program_path where program_path.id = function_call.program_path),
+        time_of_call_us, end_time_of_call_us, duration_us"""
     if tests == None:
-        function_calls = cursor.execute("select * from function_call where function = ?", [function_id]).fetchall()
+        function_calls = cursor.execute("select %s from function_call where function = ?" % columns,
+                                        [function_id]).fetchall()
     else:
         names = []
         for name in tests:
             names.append('"%s"' %name)
-        function_calls = cursor.execute("""select * from function_call where function=?
+        function_calls = cursor.execute("""select %s from function_call where function=?
             and id in (select function_call.id from function_call inner join test_data
                         where function_call.time_of_call>=test_data.start_time
                         and function_call.end_time_of_call<=test_data.end_time
-                        and test_data.test_name in %s);"""%list_to_sql_string(names), [function_id]).fetchall()
+                        and test_data.test_name in %s);"""%(columns, list_to_sql_string(names)),
+            [function_id]).fetchall()
 
     # perform any processing on each function call that we need
     modified_calls = []
     for function_call in function_calls:
-        new_call = list(function_call)
-
-        # append the time taken
-        new_call.append(
-            (dateutil.parser.parse(new_call[3]) - dateutil.parser.parse(new_call[2])).total_seconds()
-        )
-        # format the timestamps
-        new_call[2] = dateutil.parser.parse(new_call[2]).strftime("%d/%m/%Y %H:%M:%S")
-        new_call[3] = dateutil.parser.parse(new_call[3]).strftime("%d/%m/%Y %H:%M:%S")
+        new_call = list(function_call[:6])
+        (time_of_call_us, end_time_of_call_us, duration_us) = function_call[6:]
+
+        if duration_us is not None:
+            # append the time taken, and format the timestamps
+            new_call.append(duration_us / 1000000.0)
+            new_call[2] = microseconds_to_datetime(time_of_call_us).strftime("%d/%m/%Y %H:%M:%S")
+            new_call[3] = microseconds_to_datetime(end_time_of_call_us).strftime("%d/%m/%Y %H:%M:%S")
+        else:
+            # the times of this call couldn't be parsed when it was inserted
+            new_call.append(
+                (dateutil.parser.parse(new_call[3]) - dateutil.parser.parse(new_call[2])).total_seconds()
+            )
+            new_call[2] = dateutil.parser.parse(new_call[2]).strftime("%d/%m/%Y %H:%M:%S")
+            new_call[3] = dateutil.parser.parse(new_call[3]).strftime("%d/%m/%Y %H:%M:%S")
 
         # append verdict data
         verdicts = map(
@@ -82,15 +97,16 @@ def list_calls_from_id(function_id, tests = None):
 
 def list_calls_in_interval(start, end, function_id, test_names = None):
     """start and end are strings in dd/mm/yyyy hh:mm:ss format"""
-    connection = get_connection()
-    cursor = connection.cursor()
-
     start_timestamp = dateutil.parser.parse(start.replace("%20"," ")).strftime("%Y-%m-%dT%H:%M:%S")
     end_timestamp = dateutil.parser.parse(end.replace("%20", " ")).strftime("%Y-%m-%dT%H:%M:%S")
 
+    connection = get_connection(time_range=(start_timestamp, end_timestamp))
+    cursor = connection.cursor()
+
     if test_names == None:
-        function_calls = cursor.execute("""select id from function_call where time_of_call>=?
-        and end_time_of_call <= ? and function=?""", [start_timestamp, end_timestamp, function_id]).fetchall()
+        function_calls = cursor.execute("""select id from function_call where function=? and time_of_call_us>=?
+        and end_time_of_call_us <= ?""", [function_id, timestamp_to_microseconds(start_timestamp),
+                                          timestamp_to_microseconds(end_timestamp)]).fetchall()
     else:
         names = []
         for name in test_names:
@@ -382,7 +398,7 @@ def get_calls_data(ids_list, property_hash):
 
     ids = list_to_sql_string(ids_list)
 
-    query_string = "select id, function, time_of_call, end_time_of_call, trans, path_condition_id_sequence " \
+    query_string = "select id, function, time_of_call, end_time_of_call, trans, program_path " \
                    "from function_call where id in %s;" % ids
     calls = cursor.execute(query_string).fetchall()
     #print(calls)
@@ -394,33 +410,24 @@ def get_calls_data(ids_list, property_hash):
         return error_dict
 
     # get the scfg of the function called by these calls and get all their path_condition_id_sequences
-    # but without duplicate instances of sequences - store them as keys in dictionary 'sequences'
-    # the corresponding value is a list of the IDs of the calls that generated the sequence (key)
-    function = cursor.execute("select fully_qualified_name from function where id = ?", [calls[0][1]]
-    ).fetchone()
-    func = function[0]
+    # but without duplicate instances of sequences - calls that followed the same path share a program path,
+    # so we group by program path and keep the first call of each
+    func = catalog.get_function_name(cursor, calls[0][1])
     scfg = get_scfg(func, location)
     sequences = {}
     inst_point_ids = set()
     lines = set()
 
     # get the set of binding IDs for the given function
-    bindings = map(
-        lambda row : row[0],
-        cursor.execute(
-            "select id from binding where function = ? and property_hash = ?",
-            [calls[0][1], property_hash]
-        ).fetchall()
-    )
+    bindings = catalog.get_bindings_of_function(cursor, calls[0][1], property_hash)
 
     print("bindings %s" % bindings)
 
-    for call in calls:
-        seq = call[5]  # get the list of path condition ids
-        if seq not in sequences.keys():
-            sequences[seq] = [call[0]]
-        else:
-            sequences[seq].append(call[0])
+    query_string = """select program_path.path_condition_id_sequence, min(function_call.id)
+    from function_call inner join program_path on function_call.program_path == program_path.id
+    where function_call.id in %s group by program_path.id""" % ids
+    for (seq, call_id) in cursor.execute(query_string).fetchall():
+        sequences[seq] = [call_id]
 
     for seq in sequences:
         # if there are more calls that generated the sequence, take the first one
@@ -448,9 +455,8 @@ def get_calls_data(ids_list, property_hash):
         # reconstruct the path to each observation to find the line in the code
         # that generates that observation (last element in the found path)
         for obs in observations:
-            instrumentation_point_path_length = cursor.execute("""select reaching_path_length from
-                instrumentation_point where id = ?""", [obs[1]]).fetchone()
-            path = edges_from_condition_sequence(scfg, subchain[1:(obs[2]+1)], instrumentation_point_path_length[0])
+            instrumentation_point_path_length = catalog.get_instrumentation_point(cursor, obs[1])[1]
+            path = edges_from_condition_sequence(scfg, subchain[1:(obs[2]+1)], instrumentation_point_path_length)
             path_elem = path[-1]
             inst_point_ids.add(obs[1])
             #TODO: path_elem type can be edge(_instruction), but also vertex(_structure_obj)
@@ -476,9 +482,7 @@ def get_calls_data(ids_list, property_hash):
     new_list = []
     for elem in binding_atom_list:
         elem = list(elem)
-        tmp = cursor.execute("""select binding_space_index from
-            binding where id=? and function=?""", [elem[0],calls[0][1]]).fetchone()[0]
-        elem[0] = tmp
+        elem[0] = catalog.get_binding(cursor, elem[0])[0]
         new_list.append(elem)
 
     binding_atom_list = new_list
@@ -536,17 +540,11 @@ def get_atom_type(atom_index, inst_point_id):
     cursor = connection.cursor()
 
     #atom_index defines an atom uniquely provided that we know the property
-    prop_hash = cursor.execute("""select distinct function_property_pair.property_hash from
-    (((function_property_pair inner join function_call on function_property_pair.function==function_call.function)
-    inner join verdict on function_call.id==verdict.function_call) inner join observation
-       on observation.verdict==verdict.id) where observation.instrumentation_point=?""",
-       [inst_point_id]).fetchone()[0]
+    prop_hash = catalog.get_property_hash_of_instrumentation_point(cursor, inst_point_id)
 
     print("%s -> inst point %s" % (prop_hash, inst_point_id))
 
-    print(prop_hash)
-    atom_structure = cursor.execute("""select serialised_structure from atom where index_in_atoms=?
-        and property_hash=?""", [atom_index, prop_hash]).fetchone()[0]
+    atom_structure = catalog.get_atom_structure(cursor, prop_hash, atom_index)
     atom_deserialised = pickle.loads(base64.b64decode(atom_structure))
 
     connection.close()
@@ -652,24 +650,24 @@ def get_plot_data_simple(dict):
         sub_index = dict["subatom"]
         points_list = dict["points"]
 
-        query_string = """select observation.observed_value, observation.observation_time,
+        query_string = """select observation.numeric_value, observation.observation_time,
             observation.observation_end_time, verdict.verdict
             from ((observation inner join verdict on observation.verdict==verdict.id)
             inner join binding on verdict.binding==binding.id) where observation.instrumentation_point in %s
             and observation.atom_index = %s and observation.sub_index = %s and verdict.function_call in %s
-            and binding.binding_space_index = %s order by observation.observation_time;""" % (
+            and binding.binding_space_index = %s and observation.numeric_value is not null
+            order by observation.observation_time;""" % (
                 list_to_sql_string(points_list), atom_index, sub_index,
                 list_to_sql_string(calls_list), binding_index)
-        result = cursor.execute(query_string).fetchall()
+        # each row is flagged with whether it's an aggregate, standing in for observations that have been compacted
+        # observations without a numeric value can't be plotted, so they're left out (as are aggregates without one)
+        result = [row + (False,) for row in cursor.execute(query_string).fetchall()]
+        compacted = list_compacted_observations(cursor, points_list, atom_index, sub_index, calls_list, binding_index)
+        result = sorted(result + [row + (True,) for row in compacted], key=lambda element: element[1])
 
-        prop_hash = cursor.execute("""select distinct function_property_pair.property_hash from
-        (((function_property_pair inner join function_call on function_property_pair.function==function_call.function)
-        inner join verdict on function_call.id==verdict.function_call) inner join observation
-           on observation.verdict==verdict.id) where observation.instrumentation_point=?""",
-           [points_list[0]]).fetchone()[0]
+        prop_hash = catalog.get_property_hash_of_instrumentation_point(cursor, points_list[0])
 
-        atom_structure = cursor.execute("""select serialised_structure from atom where index_in_atoms=?
-            and property_hash=?""", [atom_index, prop_hash]).fetchone()[0]
+        atom_structure = catalog.get_atom_structure(cursor, prop_hash, atom_index)
         formula = pickle.loads(base64.b64decode(atom_structure))
         try:
             interval = formula._interval
@@ -687,10 +685,12 @@ def get_plot_data_simple(dict):
         x_array = []
         y_array = []
         severity_array = []
+        aggregate_array = []
 
         for element in result:
             x_array.append(element[1])
-            y = float(element[0])
+            aggregate_array.append(element[4])
+            y = element[0]
             #d is the distance from observed value to the nearest interval bound
             d = min(abs(y-lower),abs(y-upper))
             #sign=-1 if verdict value=0 and sign=1 if verdict is true
@@ -699,7 +699,7 @@ def get_plot_data_simple(dict):
             y_array.append(y)
 
         # build the plot data dictionary
-        plot_data = {"x": x_array, "observation": y_array, "severity": severity_array}
+        plot_data = {"x": x_array, "observation": y_array, "severity": severity_array, "aggregate": aggregate_array}
         # generate a hash of the plot data
         plot_hash = hashlib.sha1()
         plot_hash.update(json.dumps(plot_data))
@@ -738,7 +738,7 @@ def get_plot_data_between(dict):
         atom_index = dict["atom"]
         points_list = dict["points"]
 
-        query_string = """select o1.observed_value, o2.observed_value,
+        query_string = """select o1.time_value, o2.time_value,
                                  o1.observation_time, o2.observation_time,
                                  verdict.verdict
                           from verdict inner join observation o1 on verdict.id==o1.verdict
@@ -753,14 +753,9 @@ def get_plot_data_between(dict):
                 list_to_sql_string(calls_list), binding_index, atom_index, atom_index)
         result = cursor.execute(query_string).fetchall()
 
-        prop_hash = cursor.execute("""select distinct function_property_pair.property_hash from
-        (((function_property_pair inner join function_call on function_property_pair.function==function_call.function)
-        inner join verdict on function_call.id==verdict.function_call) inner join observation
-           on observation.verdict==verdict.id) where observation.instrumentation_point=?""",
-           [points_list[0]]).fetchone()[0]
+        prop_hash = catalog.get_property_hash_of_instrumentation_point(cursor, points_list[0])
 
-        atom_structure = cursor.execute("""select serialised_structure from atom where index_in_atoms=?
-            and property_hash=?""", [atom_index, prop_hash]).fetchone()[0]
+        atom_structure = catalog.get_atom_structure(cursor, prop_hash, atom_index)
         formula = pickle.loads(base64.b64decode(atom_structure))
         interval=formula._interval
         lower=interval[0]
@@ -772,9 +767,7 @@ def get_plot_data_between(dict):
 
         for element in result:
             x_array.append(element[2])
-            time1 = element[1][12:-2]
-            time2 = element[0][12:-2]
-            y = abs((dateutil.parser.parse(time1) - dateutil.parser.parse(time2)).total_seconds())
+            y = abs(element[1] - element[0])
 
             #d is the distance from observed value to the nearest interval bound
             d=min(abs(y-lower),abs(y-upper))
@@ -824,9 +817,10 @@ def get_plot_data_mixed(dict):
         atom_index = dict["atom"]
         points_list = dict["points"]
 
-        query_string = """select o1.observed_value, o2.observed_value,
+        query_string = """select o1.numeric_value, o2.numeric_value,
                                  o1.observation_time, o2.observation_time,
-                                 verdict.verdict, o1.sub_index
+                                 verdict.verdict, o1.sub_index,
+                                 o1.observed_value, o2.observed_value
                           from verdict inner join observation o1 on verdict.id==o1.verdict
                           inner join observation o2 where o1.verdict=o2.verdict
                           and o1.instrumentation_point<o2.instrumentation_point
@@ -839,14 +833,9 @@ def get_plot_data_mixed(dict):
                 list_to_sql_string(calls_list), binding_index, atom_index, atom_index)
         result = cursor.execute(query_string).fetchall()
 
-        prop_hash = cursor.execute("""select distinct function_property_pair.property_hash from
-        (((function_property_pair inner join function_call on function_property_pair.function==function_call.function)
-        inner join verdict on function_call.id==verdict.function_call) inner join observation
-           on observation.verdict==verdict.id) where observation.instrumentation_point=?""",
-           [points_list[0]]).fetchone()[0]
+        prop_hash = catalog.get_property_hash_of_instrumentation_point(cursor, points_list[0])
 
-        atom_structure = cursor.execute("""select serialised_structure from atom where index_in_atoms=?
-            and property_hash=?""", [atom_index, prop_hash]).fetchone()[0]
+        atom_structure = catalog.get_atom_structure(cursor, prop_hash, atom_index)
         formula = pickle.loads(base64.b64decode(atom_structure))
 
         x1_array = []
@@ -857,21 +846,16 @@ def get_plot_data_mixed(dict):
 
         for element in result:
             if element[5] == 0:
-                dict0 = ast.literal_eval(element[0])
-                dict1 = ast.literal_eval(element[1])
+                elem0 = observation_state_value(element[0], element[6])
+                elem1 = observation_state_value(element[1], element[7])
                 x1_array.append(element[2])
                 x2_array.append(element[3])
             else:
-                dict0 = ast.literal_eval(element[1])
-                dict1 = ast.literal_eval(element[0])
+                elem0 = observation_state_value(element[1], element[7])
+                elem1 = observation_state_value(element[0], element[6])
                 x1_array.append(element[3])
                 x2_array.append(element[2])
 
-            for key in dict0:
-                elem0 = dict0[key]
-            for key in dict1:
-                elem1 = dict1[key]
-
             y1_array.append(elem0)
             y2_array.append(elem1)
 
@@ -941,15 +925,16 @@ def get_path_data_between(dict):
     points_list = dict["points"]
 
     # points_list contains a pair of points - we need the length of path up to each one
-    lengths = cursor.execute("""select reaching_path_length from instrumentation_point
-        where id in %s order by id"""%list_to_sql_string(points_list)).fetchall()
-    path_length_lhs = lengths[0][0]
-    path_length_rhs = lengths[1][0]
+    lengths = [catalog.get_instrumentation_point(cursor, point_id)[1]
+               for point_id in sorted(points_list, key=int)]
+    path_length_lhs = lengths[0]
+    path_length_rhs = lengths[1]
 
-    query_string = """select o1.observed_value, o2.observed_value,
+    query_string = """select o1.time_value, o2.time_value,
                              o1.observation_time, o2.observation_time,
                              o1.previous_condition_offset, o2.previous_condition_offset,
-                             verdict.verdict, function_call.path_condition_id_sequence
+                             verdict.verdict, (select path_condition_id_sequence from program_path
+                              where program_path.id = function_call.program_path)
                       from ((function_call inner join verdict on function_call.id == verdict.function_call)
                       inner join observation o1 on verdict.id==o1.verdict
                       inner join observation o2) where o1.verdict=o2.verdict
@@ -969,21 +954,15 @@ def get_path_data_between(dict):
         return error_dict
 
     # get the scfg of the function called by these calls
-    function = cursor.execute("""select function.fully_qualified_name from function inner join
-        function_call on function.id == function_call.function where function_call.id = ?""",
-        [calls_list[0]]).fetchone()
-    func = function[0]
+    function_id = cursor.execute("select function from function_call where id = ?", [calls_list[0]]).fetchone()[0]
+    func = catalog.get_function_name(cursor, function_id)
     scfg = get_scfg(func, location)
     grammar = scfg.derive_grammar()
 
     # get the atom from the structure in property to determine the interval
-    prop_hash = cursor.execute("""select distinct function_property_pair.property_hash from
-        (function_property_pair inner join function_call
-            on function_property_pair.function==function_call.function)
-        where function_call.id = ?""", [calls_list[0]]).fetchone()[0]
+    prop_hash = catalog.get_property_hashes(cursor, function_id)[0]
 
-    atom_structure = cursor.execute("""select serialised_structure from atom where index_in_atoms=?
-        and property_hash=?""", [atom_index, prop_hash]).fetchone()[0]
+    atom_structure = catalog.get_atom_structure(cursor, prop_hash, atom_index)
     formula = pickle.loads(base64.b64decode(atom_structure))
     interval=formula._interval
     lower=interval[0]
@@ -1007,9 +986,7 @@ def get_path_data_between(dict):
         else:
             path_difference = lhs_path[len(rhs_path):]
         parse_tree = ParseTree(path_difference, grammar, path_difference[0]._source_state)
-        lhs_time = isoparse(ast.literal_eval(element[0])["time"])
-        rhs_time = isoparse(ast.literal_eval(element[1])["time"])
-        time_taken = (rhs_time - lhs_time).total_seconds()
+        time_taken = element[1] - element[0]
         #d is the distance from observed value to the nearest interval bound
         d=min(abs(time_taken-lower),abs(time_taken-upper))
         #sign=-1 if verdict value=0 and sign=1 if verdict is true
@@ -1142,22 +1119,21 @@ def get_path_data_simple(dict):
     atom_index = dict["atom"]
     points_list = dict["points"]
     # all calls belong to the same function - find its ID
-    function_id = cursor.execute("""select function.id from function inner join
-        function_call on function.id == function_call.function where function_call.id = ?""",
-        [calls_list[0]]).fetchone()[0]
+    function_id = cursor.execute("select function from function_call where id = ?", [calls_list[0]]).fetchone()[0]
 
     # inst point should be unique - in case it's not, takes one
-    path_length = cursor.execute("""select reaching_path_length from instrumentation_point
-        where id in %s"""%list_to_sql_string(points_list)).fetchone()[0]
+    path_length = catalog.get_instrumentation_point(cursor, points_list[0])[1]
 
-    query_string = """select observation.observed_value, observation.previous_condition_offset,
-                        verdict.verdict, function_call.path_condition_id_sequence,
+    query_string = """select observation.numeric_value, observation.previous_condition_offset,
+                        verdict.verdict, (select path_condition_id_sequence from program_path
+                                          where program_path.id = function_call.program_path),
                         observation.observation_time
                       from (observation inner join verdict on observation.verdict == verdict.id)
                         inner join function_call on verdict.function_call==function_call.id
                       where observation.instrumentation_point in %s and observation.atom_index=%s
                         and function_call.id in %s and verdict.binding = (select id
-                        from binding where function=%s and binding_space_index=%s) """ % (
+                        from binding where function=%s and binding_space_index=%s)
+                        and observation.numeric_value is not null """ % (
             list_to_sql_string(points_list), atom_index, list_to_sql_string(calls_list),
             function_id, binding_index)
     result = cursor.execute(query_string).fetchall()
@@ -1168,19 +1144,15 @@ def get_path_data_simple(dict):
         return error_dict
 
     # get the scfg of the function called by these calls
-    function = cursor.execute("select fully_qualified_name from function where id = ?",
-        [function_id]).fetchone()
-    func = function[0]
+    func = catalog.get_function_name(cursor, function_id)
     scfg = get_scfg(func, location)
     grammar = scfg.derive_grammar()
 
     # get the atom from the structure in property to determine the interval
-    prop_hash = cursor.execute("""select distinct property_hash from function_property_pair
-        where function = ?""", [function_id]).fetchone()[0]
+    prop_hash = catalog.get_property_hashes(cursor, function_id)[0]
 
     # in order to determine the verdict severity, we need the condition set by the specification
-    atom_structure = cursor.execute("""select serialised_structure from atom where index_in_atoms=?
-        and property_hash=?""", [atom_index, prop_hash]).fetchone()[0]
+    atom_structure = catalog.get_atom_structure(cursor, prop_hash, atom_index)
     formula = pickle.loads(base64.b64decode(atom_structure))
     try:
         # in case the formula requires the value to be in interval
@@ -1206,7 +1178,7 @@ def get_path_data_simple(dict):
         path = edges_from_condition_sequence(scfg, path_condition_list, path_length)
 
         parse_tree = ParseTree(path, grammar, path[0]._source_state)
-        observed_value = json.loads(element[0])
+        observed_value = element[0]
         #d is the distance from observed value to the nearest interval bound
         # interval being [x, x] if condition is "observed_value = x"
         d=min(abs(observed_value-lower),abs(observed_value-upper))
@@ -1340,15 +1312,17 @@ def get_path_data_mixed(dict):
     atom_index = dict["atom"]
     points_list = dict["points"]
 
-    lengths = cursor.execute("""select reaching_path_length from instrumentation_point
-        where id in %s order by id"""%list_to_sql_string(points_list)).fetchall()
-    path_length_lhs = lengths[0][0]
-    path_length_rhs = lengths[1][0]
+    lengths = [catalog.get_instrumentation_point(cursor, point_id)[1]
+               for point_id in sorted(points_list, key=int)]
+    path_length_lhs = lengths[0]
+    path_length_rhs = lengths[1]
 
     query_string = """select o1.observed_value, o2.observed_value,
                              o1.observation_time, o2.observation_time,
                              o1.previous_condition_offset, o2.previous_condition_offset,
-                             verdict.verdict, function_call.path_condition_id_sequence
+                             verdict.verdict, (select path_condition_id_sequence from program_path
+                              where program_path.id = function_call.program_path),
+                             o1.numeric_value, o2.numeric_value
                       from ((function_call inner join verdict on function_call.id == verdict.function_call)
                       inner join observation o1 on verdict.id==o1.verdict
                       inner join observation o2) where o1.verdict=o2.verdict
@@ -1368,21 +1342,15 @@ def get_path_data_mixed(dict):
         return error_dict
 
     # get the scfg of the function called by these calls
-    function = cursor.execute("""select function.fully_qualified_name from function inner join
-        function_call on function.id == function_call.function where function_call.id = ?""",
-        [calls_list[0]]).fetchone()
-    func = function[0]
+    function_id = cursor.execute("select function from function_call where id = ?", [calls_list[0]]).fetchone()[0]
+    func = catalog.get_function_name(cursor, function_id)
     scfg = get_scfg(func, location)
     grammar = scfg.derive_grammar()
 
     # get the atom from the structure in property to determine the interval
-    prop_hash = cursor.execute("""select distinct function_property_pair.property_hash from
-        (function_property_pair inner join function_call
-            on function_property_pair.function==function_call.function)
-        where function_call.id = ?""", [calls_list[0]]).fetchone()[0]
+    prop_hash = catalog.get_property_hashes(cursor, function_id)[0]
 
-    atom_structure = cursor.execute("""select serialised_structure from atom where index_in_atoms=?
-        and property_hash=?""", [atom_index, prop_hash]).fetchone()[0]
+    atom_structure = catalog.get_atom_structure(cursor, prop_hash, atom_index)
     formula = pickle.loads(base64.b64decode(atom_structure))
 
     parse_trees_obs_value_pairs = []
@@ -1401,12 +1369,8 @@ def get_path_data_mixed(dict):
         path = rhs_path if (path_length_lhs < path_length_rhs) else lhs_path
         parse_tree = ParseTree(path, grammar, path[0]._source_state)
 
-        lhs_obs = ast.literal_eval(element[0])
-        rhs_obs = ast.literal_eval(element[1])
-        for key in lhs_obs:
-            lhs_value = lhs_obs[key]
-        for key in rhs_obs:
-            rhs_value = rhs_obs[key]
+        lhs_value = observation_state_value(element[8], element[0])
+        rhs_value = observation_state_value(element[9], element[1])
         observed_difference = rhs_value - lhs_value
         #d is the distance from observed value to the nearest interval bound
         d=abs(observed_difference)
@@ -1566,6 +1530,19 @@ def property_to_atoms_list(prop):
     return
 
 
+def observation_state_value(numeric_value, observed_value):
+    """
+    Given the numeric value and serialised form of a state observation, return the value of the state.
+    The numeric value is stored at insertion, so the serialised form is only parsed for non-numeric values.
+    """
+    if numeric_value is not None:
+        return numeric_value
+    observation = ast.literal_eval(observed_value)
+    for key in observation:
+        value = observation[key]
+    return value
+
+
 def list_to_sql_string(ids_list):
     """ Create a string which stores the list of ids as (1, 2, 3, 4)
      to be compatible with the sqlite query syntax: select * from ... where id in (1, 2, 3, 4)
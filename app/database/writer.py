@@ -0,0 +1,438 @@
+"""
+Module to provide the writer through which all insertions into the verdict database are performed.
+
+In the "synchronous" ingestion mode, each write is performed in its own transaction inside the request.
+In the "queued" ingestion mode, writes are placed on a bounded queue and applied by a single background
+thread, which commits them in groups so that many small requests share one transaction (and one fsync).
+
+When the server runs several worker processes (see app.serving), every write made by a worker is sent over a
+queue shared between processes to the writer process, which applies them in groups in the same way.
+"""
+import atexit
+import pickle
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import app
+from app import app_object
+from app.metrics import write_failures_total
+from .utils import get_connection
+
+
+# callbacks registered by the write currently being performed on each thread
+transaction_state = threading.local()
+
+
+def in_write():
+    """
+    Return whether a write is being performed on this thread, so anything it reads may yet be rolled back.
+    """
+    return getattr(transaction_state, "callbacks", None) is not None
+
+
+def after_commit(callback):
+    """
+    Register a callback to be called once the write currently being performed has been committed.
+    This is used to update in-memory caches, which must never refer to rows that were rolled back.
+    """
+    transaction_state.callbacks.append(callback)
+
+
+def report_failed_write(write_name, exception):
+    """
+    Record the failure of a write that nobody is waiting for, so it isn't lost once the request
+    making it has been answered.
+    """
+    write_failures_total.inc((write_name,))
+    app_object.logger.error("Queued write %s failed: %s", write_name, exception)
+
+
+def run_callbacks(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except:
+            print("ERROR OCCURRED IN POST-COMMIT CALLBACK:")
+            traceback.print_exc()
+
+
+class WriteFuture(object):
+    """
+    Holds the result of a queued write, which becomes available once the group containing it is committed.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def set_result(self, result):
+        self._result = result
+        self._event.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._event.set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise Exception("Timed out waiting for the write to be committed.")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class RemoteFuture(object):
+    """
+    Stands in for the WriteFuture of a write sent by a worker process to the writer process,
+    sending the result back to the worker once the write has been committed.
+    Writes that the worker doesn't wait for have no write number, and only their failures are sent back
+    (along with the name of the write), so the worker can report them.
+    """
+
+    def __init__(self, worker_index, write_number, write_name=None):
+        self.worker_index = worker_index
+        self.write_number = write_number
+        self.write_name = write_name
+
+    def set_result(self, result):
+        if self.write_number is not None:
+            result_queues[self.worker_index].put((self.write_number, result, None))
+
+    def set_exception(self, exception):
+        try:
+            pickle.dumps(exception)
+        except Exception:
+            exception = Exception(str(exception))
+        if self.write_number is None:
+            result_queues[self.worker_index].put((None, self.write_name, exception))
+        else:
+            result_queues[self.worker_index].put((self.write_number, None, exception))
+
+
+class GroupCommitWriter(object):
+    """
+    Background writer that drains a bounded queue of write intents and commits them in groups.
+    A group is closed when it reaches max_group_size intents, or max_group_delay seconds after its first intent.
+    The queue can be given, so that the writer process can drain the queue shared with the worker processes.
+    """
+
+    def __init__(self, max_queue_size, max_group_size, max_group_delay, intent_queue=None):
+        self._queue = intent_queue if intent_queue is not None else queue.Queue(max_queue_size)
+        self._max_group_size = max_group_size
+        self._max_group_delay = max_group_delay
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vypr-group-commit-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Apply everything already queued, then stop the writer thread.
+        """
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def join(self):
+        """
+        Wait until the writer thread stops, which happens once the queue is closed by putting None on it.
+        """
+        self._thread.join()
+
+    def submit(self, function, argument, with_future=True):
+        """
+        Queue a call function(cursor, argument), blocking while the queue is full.
+        If with_future is False, no result is kept and errors are only reported (see report_failed_write).
+        """
+        future = WriteFuture() if with_future else None
+        self._queue.put((function, argument, future))
+        return future
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _next_group(self):
+        """
+        Block until an intent arrives, then gather more until the group is full or the delay has passed.
+        """
+        group = []
+        intent = self._queue.get()
+        if intent is None:
+            return group, True
+        group.append(intent)
+
+        deadline = time.time() + self._max_group_delay
+        while len(group) < self._max_group_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    intent = self._queue.get(timeout=remaining)
+                else:
+                    intent = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if intent is None:
+                return group, True
+            group.append(intent)
+
+        return group, False
+
+    def _run(self):
+        connection = get_connection()
+        # transactions are controlled explicitly, since savepoints are used within each group
+        connection.isolation_level = None
+        cursor = connection.cursor()
+
+        stop = False
+        while not stop:
+            group, stop = self._next_group()
+            if len(group) > 0:
+                connection.prepare()
+                apply_group(cursor, group)
+                connection.count_rows_changed()
+            if self._stopping and self._queue.empty():
+                stop = True
+
+        connection.close()
+
+
+class WriterProcessClient(object):
+    """
+    Used by a worker process in place of the background writer, to send writes to the writer process.
+    Results are read back from the worker's own result queue by a background thread.
+    """
+
+    def __init__(self, worker_index, intent_queue, result_queue):
+        self._worker_index = worker_index
+        self._queue = intent_queue
+        self._result_queue = result_queue
+        self._lock = threading.Lock()
+        self._next_write_number = 0
+        # map from the numbers of writes sent by this worker to the futures waiting for them
+        self._futures = {}
+        self._idle = threading.Condition(self._lock)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vypr-writer-process-results")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Wait until the writer process has sent back the results of every write that is being waited for.
+        """
+        with self._lock:
+            deadline = time.time() + timeout if timeout is not None else None
+            while len(self._futures) > 0:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+
+    def submit(self, function, argument, with_future=True):
+        """
+        Send a call function(cursor, argument) to the writer process, blocking while the shared queue is full.
+        """
+        if not with_future:
+            self._queue.put((function, argument, RemoteFuture(self._worker_index, None, function.__name__)))
+            return None
+        future = WriteFuture()
+        with self._lock:
+            write_number = self._next_write_number
+            self._next_write_number += 1
+            self._futures[write_number] = future
+        self._queue.put((function, argument, RemoteFuture(self._worker_index, write_number)))
+        return future
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            (write_number, result, exception) = self._result_queue.get()
+            if write_number is None:
+                # a write that wasn't waited for failed, and the result holds its name
+                report_failed_write(result, exception)
+                continue
+            with self._lock:
+                future = self._futures.pop(write_number)
+                if len(self._futures) == 0:
+                    self._idle.notify_all()
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+
+def apply_group(cursor, group, before_commit=None):
+    """
+    Given a list of (function, argument, future) intents, apply them all in one transaction.
+    Each intent runs inside its own savepoint, so a failing intent doesn't affect the rest of its group.
+    Futures are only resolved once the group has been committed.
+    If before_commit is given, it is called with a list of (intent, exception) pairs for the intents that failed,
+    before the group is committed.
+    Returns True if the group was committed.
+    """
+    outcomes = []
+    callbacks = []
+    try:
+        cursor.execute("begin immediate")
+        for (function, argument, future) in group:
+            cursor.execute("savepoint write_intent")
+            transaction_state.callbacks = []
+            try:
+                outcomes.append((future, function(cursor, argument), None))
+                cursor.execute("release write_intent")
+                callbacks += transaction_state.callbacks
+            except Exception as e:
+                cursor.execute("rollback to write_intent")
+                cursor.execute("release write_intent")
+                outcomes.append((future, None, e))
+            finally:
+                transaction_state.callbacks = None
+        if before_commit is not None:
+            before_commit([(intent, exception) for (intent, (_, _, exception)) in zip(group, outcomes)
+                           if exception is not None])
+        cursor.execute("commit")
+        run_callbacks(callbacks)
+    except Exception as e:
+        print("ERROR OCCURRED DURING GROUP COMMIT:")
+        traceback.print_exc()
+        try:
+            cursor.execute("rollback")
+        except:
+            pass
+        outcomes = [(future, None, e) for (_, _, future) in group]
+        committed = False
+    else:
+        committed = True
+
+    for ((function, _, _), (future, result, exception)) in zip(group, outcomes):
+        if exception is not None:
+            if future is None:
+                report_failed_write(function.__name__, exception)
+            else:
+                future.set_exception(exception)
+        elif future is not None:
+            future.set_result(result)
+
+    return committed
+
+
+writer = None
+writer_lock = threading.Lock()
+# whether writes are sent to the writer process, which is the case in worker processes
+forward_writes = False
+# in the writer process, the queues on which results are sent back to each worker process
+result_queues = None
+
+
+def write_queue_depth():
+    """
+    Return the number of writes waiting for the background writer, or None if it hasn't been started.
+    """
+    with writer_lock:
+        if writer is None:
+            return None
+        return writer.depth()
+
+
+def get_writer():
+    """
+    Get the background writer, starting it if this is the first queued write.
+    """
+    global writer
+    with writer_lock:
+        if writer is None:
+            writer = GroupCommitWriter(app.write_queue_size, app.group_commit_size, app.group_commit_interval)
+            writer.start()
+            # make sure queued writes are committed when the server exits
+            atexit.register(stop_writer)
+        return writer
+
+
+def use_writer_process(worker_index, intent_queue, result_queue):
+    """
+    Send every write made by this (worker) process to the writer process.
+    """
+    global writer, forward_writes
+    with writer_lock:
+        writer = WriterProcessClient(worker_index, intent_queue, result_queue)
+        writer.start()
+        forward_writes = True
+
+
+def start_writer_process(intent_queue, worker_result_queues):
+    """
+    Start applying the writes sent by the worker processes in groups, until None is put on the shared queue.
+    Returns the writer, which is also used for the writes made by this (the writer) process.
+    """
+    global writer, result_queues
+    result_queues = worker_result_queues
+    with writer_lock:
+        writer = GroupCommitWriter(app.write_queue_size, app.group_commit_size, app.group_commit_interval,
+                                   intent_queue=intent_queue)
+        writer.start()
+        return writer
+
+
+def stop_writer():
+    """
+    Apply any queued writes and stop the background writer, if it was started.
+    """
+    global writer
+    with writer_lock:
+        if writer is not None:
+            writer.stop()
+            writer = None
+
+
+def execute_write(function, argument, wait=True):
+    """
+    Perform function(cursor, argument) against the verdict database using the current ingestion mode.
+    If wait is False and the background writer is in use, return as soon as the write is queued.
+    """
+    if forward_writes:
+        # in the synchronous ingestion mode, requests still wait for their writes to be committed
+        wait = wait or app.ingestion_mode != "queued"
+        future = get_writer().submit(function, argument, with_future=wait)
+        if wait:
+            return future.result()
+        return None
+
+    if app.ingestion_mode == "queued":
+        future = get_writer().submit(function, argument, with_future=wait)
+        if wait:
+            return future.result()
+        return None
+
+    connection = get_connection()
+    connection.isolation_level = None
+    cursor = connection.cursor()
+    try:
+        cursor.execute("begin immediate")
+        transaction_state.callbacks = []
+        try:
+            result = function(cursor, argument)
+            cursor.execute("commit")
+            callbacks = transaction_state.callbacks
+            transaction_state.callbacks = None
+            run_callbacks(callbacks)
+        except:
+            transaction_state.callbacks = None
+            cursor.execute("rollback")
+            raise
+        return result
+    finally:
+        connection.close()
@@ -6,6 +6,7 @@ from .database import   (get_events,
                         insert_instrumentation_event,
                         insert_monitoring_event,
                         get_function_name_to_code_map)
+from ..request_body import get_request_data
 from flask import request, jsonify, render_template, Response
 from flask_cors import cross_origin
 import json
@@ -18,7 +19,7 @@ def add_to_instrumentation_stream():
     Given an action, event data and a time, add an instrumentation event.
     :return: Success or failure
     """
-    request_data_dictionary = json.loads(request.get_data())
+    request_data_dictionary = json.loads(get_request_data())
     result = insert_instrumentation_event(
         request_data_dictionary["action"],
         request_data_dictionary["data"],
@@ -35,7 +36,7 @@ def add_to_monitoring_stream():
     Given an action, event data and a time, add a monitoring event.
     :return: Success or failure
     """
-    request_data_dictionary = json.loads(request.get_data())
+    request_data_dictionary = json.loads(get_request_data())
     result = insert_monitoring_event(
         request_data_dictionary["action"],
         request_data_dictionary["data"],
@@ -1,25 +1,70 @@
 """
 Verdict storage end points for use by the VyPR monitoring machinery.
 """
+import app
 from app import app_object
 from flask import request, jsonify, render_template
 from . import database
+from .request_body import get_request_data
 import json
 
 
 @app_object.route("/register_verdicts/", methods=["post"])
 def register_verdicts():
     """
-    Receives a verdict from a monitored service, and stores it
+    Receives a verdict from a monitored service, and stores it.
+    In the spooled ingestion mode, the verdict is accepted once it is in the spool.
     """
 
-    verdict_data = json.loads(request.data)
+    if request.mimetype == database.compact_content_type:
+        return register_compact_verdicts()
+
+    verdict_data = json.loads(get_request_data())
+
+    if app.ingestion_mode == "spooled":
+        if database.spool_verdicts(verdict_data):
+            return "accepted", 202
+        return "success"
 
     database.insert_verdicts(verdict_data)
 
     return "success"
 
 
+def register_compact_verdicts():
+    """
+    Stores a verdict sent in the compact format (see database.compact).
+    """
+    if not database.compact_format_available():
+        return "The compact format requires msgpack to be installed on the verdict server.", 415
+
+    verdict_array = database.decode_compact(get_request_data())
+
+    if app.ingestion_mode == "spooled":
+        if database.spool_compact_verdicts(verdict_array):
+            return "accepted", 202
+        return "success"
+
+    database.insert_compact_verdicts(verdict_array)
+
+    return "success"
+
+
+@app_object.route("/register_verdicts_batch/", methods=["post"])
+def register_verdicts_batch():
+    """
+    Receives a json list of verdict dictionaries, each of the form sent to /register_verdicts/,
+    so verdicts from many function calls can be stored in one request.
+    Returns a json list with the insertion status of each function call, in the order given.
+    """
+
+    verdict_data_list = json.loads(get_request_data())
+
+    statuses = database.insert_verdicts_batch(verdict_data_list)
+
+    return json.dumps(statuses)
+
+
 @app_object.route("/insert_function_call_data/", methods=["post"])
 def insert_function_call_data():
     """
@@ -28,11 +73,44 @@ def insert_function_call_data():
     to the appropriate previous condition is straightforward
     (we just have to follow the chain for the correct number of steps).
     """
-    call_data = json.loads(request.data)
+    if request.mimetype == database.compact_content_type:
+        if not database.compact_format_available():
+            return "The compact format requires msgpack to be installed on the verdict server.", 415
+        call_data = database.decode_compact_function_call(get_request_data())
+    else:
+        call_data = json.loads(get_request_data())
+
+    if app.ingestion_mode == "spooled":
+        insertion_result, spooled = database.spool_function_call_data(call_data)
+        return json.dumps(insertion_result), 202 if spooled else 200
+
     insertion_result = database.insert_function_call_data(call_data)
     return json.dumps(insertion_result)
 
 
+@app_object.route("/insert_function_call_and_verdicts/", methods=["post"])
+def insert_function_call_and_verdicts():
+    """
+    Receives the data sent to /insert_function_call_data/ for a function call, along with the verdicts
+    obtained during the call in "property_verdicts", so both can be stored with one request and one transaction.
+    Each element of "property_verdicts" has the form sent to /register_verdicts/, without the
+    function_call_id and function_id.
+    """
+    if request.mimetype == database.compact_content_type:
+        if not database.compact_format_available():
+            return "The compact format requires msgpack to be installed on the verdict server.", 415
+        call_data = database.decode_compact_function_call(get_request_data())
+    else:
+        call_data = json.loads(get_request_data())
+
+    if app.ingestion_mode == "spooled":
+        insertion_result, spooled = database.spool_function_call_data(call_data, "function_call_and_verdicts")
+        return json.dumps(insertion_result), 202 if spooled else 200
+
+    insertion_result = database.insert_function_call_and_verdicts(call_data)
+    return json.dumps(insertion_result)
+
+
 @app_object.route("/store_property/", methods=["post"])
 def store_property():
     """
@@ -40,7 +118,7 @@ def store_property():
     Note: the hash stored must be the same as the one given to the instruments in the
     monitored code.
     """
-    property_data = json.loads(request.data)
+    property_data = json.loads(get_request_data())
 
     atom_index_to_db_index, function_id = database.insert_property(property_data)
 
@@ -52,7 +130,7 @@ def store_binding():
     """
     Receives a serialised binding and stores it.
     """
-    binding_data = json.loads(request.data)
+    binding_data = json.loads(get_request_data())
     new_id = database.insert_binding(binding_data)
 
     return str(new_id)
@@ -66,7 +144,7 @@ def store_instrumentation_point():
     Note: this returns an ID which instrumentation then attaches to an instrument
     so we can determine which instrumentation point in the SCFG generated observations at runtime.
     """
-    instrumentation_point_data = json.loads(request.data)
+    instrumentation_point_data = json.loads(get_request_data())
     new_id = database.insert_instrumentation_point(instrumentation_point_data)
 
     return str(new_id)
@@ -78,12 +156,27 @@ def store_branching_condition():
     Receives a serialised branching condition.
     Note: this returns an ID which instrumentation then attaches to branch recording instruments.
     """
-    branching_condition_data = json.loads(request.data)
+    branching_condition_data = json.loads(get_request_data())
     new_id = database.insert_branching_condition(branching_condition_data)
 
     return str(new_id)
 
 
+@app_object.route("/store_instrumentation_manifest/", methods=["post"])
+def store_instrumentation_manifest():
+    """
+    Receives everything registered during instrumentation of a single function (properties, bindings,
+    instrumentation points and branching conditions) and stores it in one transaction.
+    Note: this returns the ids that would otherwise be returned by the individual /store_* end points.
+    """
+    manifest = json.loads(get_request_data())
+    insertion_result = database.insert_instrumentation_manifest(manifest)
+
+    if insertion_result == "failure":
+        return insertion_result
+    return json.dumps(insertion_result)
+
+
 @app_object.route("/get_property_from_hash/<hash>/", methods=["get"])
 def get_property_from_hash(hash):
     """
@@ -100,6 +193,6 @@ def insert_test_data():
     Insert test result data in the case that VyPR is being used in a test suite.
     :return: String of insertion result.
     """
-    test_data = json.loads(request.data)
+    test_data = json.loads(get_request_data())
     insertion_result = database.insert_test_call_data(test_data)
     return json.dumps(insertion_result)
\ No newline at end of file
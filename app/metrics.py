@@ -0,0 +1,191 @@
+"""
+Module to collect metrics about the verdict server, which are reported in the Prometheus text format by /metrics/.
+
+Each request is timed and counted by route, and the number of SQL statements executed and rows changed while
+handling it are recorded - for a streamed response, once the whole response has been sent.  Everything is held in
+memory and updated with a few dictionary operations, so collection can be left on in production.
+"""
+import threading
+import time
+
+from flask import request, g
+
+from app import app_object
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+count_buckets = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for (name, value) in labels
+    )
+
+
+class Counter(object):
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text), "# TYPE %s counter" % self.name]
+        with self._lock:
+            for (label_values, value) in sorted(self._values.items()):
+                lines.append("%s%s %s" % (self.name, format_labels(list(zip(self.label_names, label_values))), value))
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        # map from label values to [bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_values=()):
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = [[0] * len(self.buckets), 0, 0]
+                self._values[label_values] = state
+            for (index, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help_text), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            for (label_values, (bucket_counts, total, count)) in sorted(self._values.items()):
+                labels = list(zip(self.label_names, label_values))
+                cumulative = 0
+                for (bound, bucket_count) in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append("%s_bucket%s %i" % (self.name, format_labels(labels + [("le", bound)]), cumulative))
+                lines.append("%s_bucket%s %i" % (self.name, format_labels(labels + [("le", "+Inf")]), count))
+                lines.append("%s_sum%s %s" % (self.name, format_labels(labels), total))
+                lines.append("%s_count%s %i" % (self.name, format_labels(labels), count))
+        return lines
+
+
+def render_gauge(name, help_text, samples):
+    """
+    Given a list of (labels, value) pairs, where labels is a list of (name, value) pairs, render a gauge.
+    Samples whose value is None are left out.
+    """
+    lines = ["# HELP %s %s" % (name, help_text), "# TYPE %s gauge" % name]
+    for (labels, value) in samples:
+        if value is not None:
+            lines.append("%s%s %s" % (name, format_labels(labels), value))
+    return lines
+
+
+requests_total = Counter("vypr_http_requests_total", "Requests handled, by route, method and status.",
+                         ("route", "method", "status"))
+request_duration = Histogram("vypr_http_request_duration_seconds", "Time taken to handle requests, by route.",
+                             latency_buckets, ("route",))
+request_statements = Histogram("vypr_sql_statements_per_request",
+                               "SQL statements executed while handling a request, by route.",
+                               count_buckets, ("route",))
+request_rows_changed = Histogram("vypr_sql_rows_changed_per_request",
+                                 "Rows inserted, updated or deleted while handling a request, by route.",
+                                 count_buckets, ("route",))
+statements_total = Counter("vypr_sql_statements_total", "SQL statements executed against the verdict database.")
+rows_changed_total = Counter("vypr_sql_rows_changed_total",
+                             "Rows inserted, updated or deleted in the verdict database.")
+connections_opened_total = Counter("vypr_database_connections_opened_total",
+                                   "Connections opened to the verdict database.")
+write_failures_total = Counter("vypr_write_failures_total",
+                               "Queued writes that failed once the requests making them had been answered, by write.",
+                               ("write",))
+
+# counts for the request being handled on each thread
+request_state = threading.local()
+
+
+def count_statement(statement):
+    """
+    Trace callback installed on each connection to the verdict database.
+    """
+    statements_total.inc()
+    if getattr(request_state, "statements", None) is not None:
+        request_state.statements += 1
+
+
+def count_rows_changed(rows_changed):
+    if rows_changed == 0:
+        return
+    rows_changed_total.inc(amount=rows_changed)
+    if getattr(request_state, "rows_changed", None) is not None:
+        request_state.rows_changed += rows_changed
+
+
+def get_route():
+    if request.url_rule is None:
+        return "unmatched"
+    return request.url_rule.rule
+
+
+@app_object.before_request
+def start_request_metrics():
+    g.request_start_time = time.time()
+    g.request_recorded = False
+    request_state.statements = 0
+    request_state.rows_changed = 0
+
+
+def record_request(route, method, status, start_time):
+    requests_total.inc((route, method, str(status)))
+    request_duration.observe(time.time() - start_time, (route,))
+    # the counts are kept on the thread handling the request, which usually also sends its response
+    if getattr(request_state, "statements", None) is not None:
+        request_statements.observe(request_state.statements, (route,))
+        request_rows_changed.observe(request_state.rows_changed, (route,))
+    request_state.statements = None
+    request_state.rows_changed = None
+
+
+@app_object.after_request
+def finish_request_metrics(response):
+    g.request_recorded = True
+    (route, method, start_time) = (get_route(), request.method, g.request_start_time)
+    if response.is_streamed:
+        # the body of a streamed response is generated after this, and the request context may have been torn down
+        # by the time it has been sent, so the request is recorded once the response is closed
+        response.call_on_close(lambda: record_request(route, method, response.status_code, start_time))
+    else:
+        record_request(route, method, response.status_code, start_time)
+    return response
+
+
+@app_object.teardown_request
+def fail_request_metrics(exception):
+    # only reached without a response being recorded if the request raised an exception
+    if not getattr(g, "request_recorded", True):
+        g.request_recorded = True
+        record_request(get_route(), request.method, 500, g.request_start_time)
+
+
+def render():
+    lines = []
+    for metric in [requests_total, request_duration, request_statements, request_rows_changed,
+                   statements_total, rows_changed_total, connections_opened_total, write_failures_total]:
+        lines += metric.render()
+    return lines
@@ -0,0 +1,45 @@
+"""
+End point reporting metrics about the verdict server in the Prometheus text format.
+"""
+from flask import Response
+
+from app import app_object
+from . import database
+from . import metrics
+
+
+@app_object.route("/metrics/", methods=["get"], strict_slashes=False)
+def get_metrics():
+    """
+    Returns the request, SQL and connection metrics collected by the metrics module,
+    along with the state of the insertion caches, the write queue and the spool.
+    """
+    lines = metrics.render()
+
+    caches = [
+        ("assignment", database.assignment_cache.statistics()),
+        ("transaction", database.transaction_cache.statistics()),
+        ("program_path", database.program_path_cache.statistics())
+    ]
+    for (name, help_text, key) in [
+        ("vypr_cache_hits", "Lookups that found an entry in the cache.", "hits"),
+        ("vypr_cache_misses", "Lookups that didn't find an entry in the cache.", "misses"),
+        ("vypr_cache_entries", "Entries held by the cache.", "size"),
+        ("vypr_cache_hit_rate", "Proportion of lookups that found an entry in the cache.", "hit_rate")
+    ]:
+        lines += metrics.render_gauge(name, help_text,
+                                      [([("cache", cache)], statistics[key]) for (cache, statistics) in caches])
+
+    lines += metrics.render_gauge("vypr_write_queue_depth", "Writes waiting for the background writer.",
+                                  [([], database.write_queue_depth())])
+
+    spool_statistics = database.spool_statistics() or {}
+    lines += metrics.render_gauge("vypr_spool_depth", "Spooled insertions that haven't been applied.",
+                                  [([], spool_statistics.get("depth"))])
+    lines += metrics.render_gauge("vypr_spool_bytes", "Size of the spooled insertions that haven't been applied.",
+                                  [([], spool_statistics.get("size"))])
+    lines += metrics.render_gauge("vypr_spool_drain_lag_seconds",
+                                  "Time since the oldest spooled insertion that hasn't been applied was spooled.",
+                                  [([], spool_statistics.get("drain_lag"))])
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
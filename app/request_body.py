@@ -0,0 +1,68 @@
+"""
+Module to read the bodies of requests sent to the insertion, event stream and batch lookup end points.
+Bodies may be compressed (Content-Encoding gzip or deflate), in which case they are decompressed as they are read,
+and bodies larger than app.max_request_body_size once decompressed are rejected.
+"""
+import zlib
+
+from flask import request, abort
+import app
+
+chunk_size = 64 * 1024
+
+# window bits telling zlib which header to expect for each supported content encoding
+encoding_window_bits = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "x-gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS
+}
+
+
+def get_request_data():
+    """
+    Return the (decompressed) body of the current request.
+    """
+    encoding = request.headers.get("Content-Encoding", "identity").strip().lower()
+    if encoding in ("", "identity"):
+        chunks = read_chunks(request.stream)
+    elif encoding in encoding_window_bits:
+        chunks = decompress_chunks(read_chunks(request.stream), zlib.decompressobj(encoding_window_bits[encoding]))
+    else:
+        abort(415, "Unsupported Content-Encoding '%s'." % encoding)
+
+    data = []
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > app.max_request_body_size:
+                abort(413, "The request body is larger than %i bytes." % app.max_request_body_size)
+            data.append(chunk)
+    except zlib.error as e:
+        abort(400, "The request body could not be decompressed: %s" % e)
+
+    return b"".join(data)
+
+
+def read_chunks(stream):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def decompress_chunks(chunks, decompressor):
+    """
+    Decompress a sequence of chunks, producing at most chunk_size bytes at a time
+    so that a small, highly compressed body can't make us allocate a large buffer in one go.
+    A body that ends before the compressed stream does is an error, rather than being silently truncated.
+    """
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk, chunk_size)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+    # (the eof attribute isn't available before Python 3.3)
+    if not getattr(decompressor, "eof", True):
+        raise zlib.error("the compressed body is incomplete")
@@ -7,4 +7,6 @@ from .analysis_API import *
 from .insertion_API import *
 from .web_API import *
 from .web_front_end import *
+from .statistics_API import *
+from .metrics_API import *
 from .events.routes import *
@@ -0,0 +1,166 @@
+"""
+Module to serve the application with several worker processes, for use in production.
+
+The parent process listens on the port, and starts one writer process and app.worker_processes worker processes.
+Each worker accepts connections on the shared socket and handles requests on its own threads, with its own
+connections to the verdict database for reading.  Every write is sent to the writer process over a queue shared
+between processes (see app.database.writer), so only one process ever writes to the database.
+
+On SIGINT or SIGTERM, each worker stops accepting connections and waits (for at most app.worker_shutdown_timeout
+seconds) for the requests it is handling, and for the results of its writes.  Once every worker has stopped,
+the writer process applies the writes still queued and stops.
+"""
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+import app
+from app import app_object
+
+try:
+    multiprocessing_context = multiprocessing.get_context("fork")
+except AttributeError:
+    multiprocessing_context = multiprocessing
+
+
+class RequestCounter(object):
+    """
+    WSGI middleware counting the requests being handled, so a stopping worker can wait for them.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.active = 0
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.active += 1
+        try:
+            return ClosingIterator(self.application(environ, start_response), [self._finished])
+        except:
+            self._finished()
+            raise
+
+    def _finished(self):
+        with self._lock:
+            self.active -= 1
+            if self.active == 0:
+                self._idle.notify_all()
+
+    def wait(self, timeout):
+        """
+        Wait until no requests are being handled, or the timeout has passed.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while self.active > 0 and time.time() < deadline:
+                self._idle.wait(deadline - time.time())
+            return self.active
+
+
+def run_writer(intent_queue, result_queues, ready):
+    # the writer only stops once the workers have stopped, so it ignores the signals sent to stop them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # results aren't waited for by a worker that has stopped, so they mustn't keep this process from exiting
+    for result_queue in result_queues:
+        result_queue.cancel_join_thread()
+
+    # the schema must be up to date before any worker connects (serve raises an exception if it isn't)
+    if not app.database.upgrade_database():
+        return
+    app.database.load_catalog()
+    # compaction writes through the writer, so it's only started once the writer is installed
+    # (otherwise it could start a writer of its own)
+    writer = app.database.writer.start_writer_process(intent_queue, result_queues)
+    app.database.start_compaction()
+    ready.set()
+
+    writer.join()
+
+
+def run_worker(worker_index, listening_socket, intent_queue, result_queue, host):
+    app.database.writer.use_writer_process(worker_index, intent_queue, result_queue)
+    app.database.load_catalog()
+
+    request_counter = RequestCounter(app_object.wsgi_app)
+    app_object.wsgi_app = request_counter
+    server = make_server(host, listening_socket.getsockname()[1], app_object, threaded=True,
+                         fd=listening_socket.fileno())
+
+    def stop(signal_number, frame):
+        # shutdown waits for serve_forever to return, so it can't be called on the thread running it
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    server.serve_forever()
+
+    remaining = request_counter.wait(app.worker_shutdown_timeout)
+    if remaining > 0:
+        print("Worker %i stopped with %i requests unfinished" % (worker_index, remaining))
+    app.database.writer.writer.stop(app.worker_shutdown_timeout)
+
+
+def serve(host, port):
+    """
+    Serve the application on the given host and port with app.worker_processes worker processes,
+    returning once they, and the writer process, have stopped.
+    """
+    if app.storage_engine == "memory":
+        raise Exception("The memory storage engine can't be used with worker processes, since each process would "
+                        "hold its own database.")
+    if app.ingestion_mode == "spooled":
+        raise Exception("The spooled ingestion mode can't be used with worker processes, since the spool is appended "
+                        "to by a single process.")
+
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listening_socket.bind((host, port))
+    listening_socket.listen(128)
+
+    intent_queue = multiprocessing_context.Queue(app.write_queue_size)
+    result_queues = [multiprocessing_context.Queue() for _ in range(app.worker_processes)]
+
+    ready = multiprocessing_context.Event()
+    writer_process = multiprocessing_context.Process(target=run_writer, name="vypr-writer",
+                                                     args=(intent_queue, result_queues, ready))
+    writer_process.start()
+    while not ready.wait(1):
+        if not writer_process.is_alive():
+            raise Exception("The writer process stopped before it was ready.")
+
+    workers = []
+    for worker_index in range(app.worker_processes):
+        worker = multiprocessing_context.Process(
+            target=run_worker, name="vypr-worker-%i" % worker_index,
+            args=(worker_index, listening_socket, intent_queue, result_queues[worker_index], host)
+        )
+        worker.start()
+        workers.append(worker)
+    print("Serving on %s:%i with %i worker processes" % (host, port, len(workers)))
+
+    def stop(signal_number, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for worker in workers:
+        worker.join()
+    listening_socket.close()
+
+    # every worker has stopped, so this is the last thing put on the queue
+    intent_queue.put(None)
+    writer_process.join()
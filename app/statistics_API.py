@@ -0,0 +1,20 @@
+"""
+End points reporting on the state of the verdict server itself.
+"""
+from app import app_object
+from . import database
+import json
+
+
+@app_object.route("/statistics/", methods=["get"])
+def statistics():
+    """
+    Returns the hit and miss counts of the in-memory caches used during insertion,
+    and the depth and drain lag (in seconds) of the spool if it is in use.
+    """
+    return json.dumps({
+        "assignment_cache": database.assignment_cache.statistics(),
+        "transaction_cache": database.transaction_cache.statistics(),
+        "program_path_cache": database.program_path_cache.statistics(),
+        "spool": database.spool_statistics()
+    })
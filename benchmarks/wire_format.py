@@ -0,0 +1,121 @@
+"""
+Benchmark comparing the json and compact (msgpack) wire formats for verdict payloads.
+
+For each format, the same verdicts are encoded as VyPR would send them and posted to /register_verdicts/
+through Flask's test client, against a fresh verdict database built from verdict-schema.sql
+(held in memory with --engine memory, so that disk I/O is left out).
+The time taken to encode the payloads on the client side is reported separately from the time taken by the server.
+
+This should be run from the root of the verdict server, eg,
+    python benchmarks/wire_format.py --calls 500 --observations 50
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(".")
+
+import app
+from app import app_object, database
+
+
+def make_json_payload(function_call_id, observations):
+    observations_map = {}
+    path_map = {}
+    atom_to_state_dict_map = {}
+    for atom_index in range(observations):
+        observations_map[str(atom_index)] = {
+            "0": [atom_index * 0.5, 1, "2020-01-01T00:00:00.000000", "2020-01-01T00:00:01.000000"]
+        }
+        path_map[str(atom_index)] = {"0": atom_index}
+        atom_to_state_dict_map[str(atom_index)] = {"0": {"x": atom_index % 10, "y": "value"}}
+    return {
+        "function_call_id": function_call_id,
+        "function_id": 1,
+        "property_hash": "benchmark",
+        "verdicts": [{
+            "bind_space_index": 0,
+            "verdict": [1, "2020-01-01T00:00:02.000000", observations_map, path_map, 0, 0, atom_to_state_dict_map]
+        }]
+    }
+
+
+def make_compact_payload(function_call_id, observations):
+    return [function_call_id, 1, "benchmark", [
+        [0, 1, "2020-01-01T00:00:02.000000", 0, 0, [
+            [atom_index, 0, 1, atom_index * 0.5, "2020-01-01T00:00:00.000000", "2020-01-01T00:00:01.000000",
+             atom_index, [["x", atom_index % 10], ["y", "value"]]]
+            for atom_index in range(observations)
+        ]]
+    ]]
+
+
+def setup_database(directory, engine):
+    app.storage_engine = engine
+    app.database_string = os.path.join(directory, "verdicts.db")
+    if engine == "sqlite":
+        connection = sqlite3.connect(app.database_string)
+        with open("verdict-schema.sql") as schema_file:
+            connection.executescript(schema_file.read())
+        connection.close()
+    # the memory engine creates the schema itself
+    connection = database.get_engine().connect()
+    connection.execute("insert into function (fully_qualified_name) values('benchmark.function')")
+    connection.execute("insert into property values('benchmark', '', 0)")
+    connection.execute("insert into function_property_pair values(1, 'benchmark')")
+    connection.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(0, 1, 'benchmark', '[]')")
+    connection.execute("insert into instrumentation_point (serialised_condition_sequence, reaching_path_length) "
+                       "values('[]', 0)")
+    connection.commit()
+    connection.close()
+
+
+def run(name, payloads, content_type, encode):
+    client = app_object.test_client()
+
+    start = time.time()
+    bodies = [encode(payload) for payload in payloads]
+    encoding_time = time.time() - start
+
+    start = time.time()
+    for body in bodies:
+        client.post("/register_verdicts/", data=body, content_type=content_type)
+    server_time = time.time() - start
+
+    print("%s: %i bytes per call, encoding %.3fs, server %.3fs (%.1f calls/s)" % (
+        name, sum(len(body) for body in bodies) / len(bodies), encoding_time, server_time,
+        len(bodies) / server_time
+    ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Benchmark of the verdict wire formats")
+    parser.add_argument("--calls", type=int, default=500, help="number of function calls to send verdicts for")
+    parser.add_argument("--observations", type=int, default=50, help="number of observations per verdict")
+    parser.add_argument("--engine", type=str, choices=["sqlite", "memory"], default="sqlite",
+                        help="storage engine holding the verdict database")
+    args = parser.parse_args()
+
+    if not database.compact_format_available():
+        print("msgpack must be installed to benchmark the compact format.")
+        sys.exit(1)
+
+    for (name, make_payload, content_type, encode) in [
+        ("json", make_json_payload, "application/json", json.dumps),
+        ("compact", make_compact_payload, database.compact_content_type, database.encode_compact)
+    ]:
+        directory = tempfile.mkdtemp()
+        database.assignment_cache.clear()
+        try:
+            setup_database(directory, args.engine)
+            payloads = [make_payload(function_call_id, args.observations)
+                        for function_call_id in range(1, args.calls + 1)]
+            run(name, payloads, content_type, encode)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,29 @@
+"""
+Module to compact old observations in a verdict database into aggregates.
+
+This can be run while the server is using the database, since observations are compacted in small transactions.
+"""
+import argparse
+
+import app
+from app.database.compaction import compact_observations, get_retention_cutoff
+
+parser = argparse.ArgumentParser(prog="Compacting a VyPR verdict database")
+parser.add_argument("--db", type=str, help="name of the database containing verdicts", required=False)
+parser.add_argument("--older-than-days", type=float, help="age in days after which observations are compacted",
+                    required=True)
+parser.add_argument("--batch-size", type=int, help="number of observations compacted in each transaction",
+                    required=False)
+args = parser.parse_args()
+
+if args.db:
+    app.database_string = args.db
+
+app.observation_retention_days = args.older_than_days
+
+if __name__ == "__main__":
+
+    cutoff = get_retention_cutoff()
+    print("Compacting observations made before %s" % cutoff)
+    compacted = compact_observations(cutoff, args.batch_size)
+    print("Compacted %i observations" % compacted)
@@ -0,0 +1,38 @@
+"""
+Module to list and archive the partitions of a verdict database stored with the partitioned storage engine.
+
+Archiving a partition stops the server attaching it (once the server next reads the list of partitions),
+after which its file can be moved elsewhere.  Restoring a partition whose file is back in place attaches it again.
+"""
+import sqlite3
+import argparse
+
+import app
+
+parser = argparse.ArgumentParser(prog="Managing the partitions of a VyPR verdict database")
+parser.add_argument("--db", type=str, help="name of the catalog database", required=False)
+parser.add_argument("--archive", type=str, help="name of a partition to archive", required=False)
+parser.add_argument("--restore", type=str, help="name of an archived partition to restore", required=False)
+args = parser.parse_args()
+
+if args.db:
+    app.database_string = args.db
+
+if __name__ == "__main__":
+
+    connection = sqlite3.connect(app.database_string)
+
+    if args.archive or args.restore:
+        cursor = connection.execute("update verdict_partition set archived = ? where name = ?",
+                                    [1 if args.archive else 0, args.archive or args.restore])
+        connection.commit()
+        if cursor.rowcount == 0:
+            print("No partition named '%s' was found" % (args.archive or args.restore))
+            exit(1)
+
+    for (name, period_start, period_end, archived) in connection.execute(
+            "select name, period_start, period_end, archived from verdict_partition order by period_start"):
+        print("%s: %s to %s%s (%s.%s)" % (name, period_start, period_end, ", archived" if archived else "",
+                                         app.database_string, name))
+
+    connection.close()
@@ -0,0 +1,51 @@
+"""
+Module to apply schema migrations to a verdict database.
+
+The server only applies pending migrations when it starts if the database holds no rows for them to rewrite or
+index (as when it has just been created from verdict-schema.sql) - otherwise it refuses to start, and this must be
+run first.  This can be run while an older server is still using the database, since migrations that rewrite rows
+do so in batches, each committed separately.  Each index is built in one step, though, which holds the write lock
+for as long as the build takes on a large table, so writers of the older server may time out while it's built.
+"""
+import sqlite3
+import argparse
+
+import app
+from app.database.schema import upgrade_schema, get_schema_version, list_pending_migrations, analyze
+
+parser = argparse.ArgumentParser(prog="Migrating a VyPR verdict database")
+parser.add_argument("--db", type=str, help="name of the database containing verdicts", required=False)
+parser.add_argument("--status", action="store_true",
+                    help="list the migrations that haven't been applied, rather than applying them")
+parser.add_argument("--analyze", action="store_true",
+                    help="gather the statistics used by the query planner again once the migrations are applied")
+args = parser.parse_args()
+
+if args.db:
+    app.database_string = args.db
+
+if __name__ == "__main__":
+
+    connection = sqlite3.connect(app.database_string)
+    for (pragma, value) in app.sqlite_pragmas:
+        connection.execute("pragma %s = %s" % (pragma, value))
+    cursor = connection.cursor()
+
+    print("Schema version of '%s' is %i" % (app.database_string, get_schema_version(cursor)))
+    connection.commit()
+
+    if args.status:
+        for (version, migration) in list_pending_migrations(cursor):
+            print("Migration %i (%s) is pending" % (version, migration.__name__))
+    else:
+        succeeded = upgrade_schema(connection, verbose=True)
+        print("Schema version of '%s' is now %i" % (app.database_string, get_schema_version(cursor)))
+        connection.commit()
+        if succeeded and args.analyze:
+            analyze(cursor)
+            connection.commit()
+
+    connection.close()
+
+    if not args.status and not succeeded:
+        exit(1)
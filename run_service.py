@@ -10,6 +10,47 @@ parser.add_argument("--db", type=str, help="name of the database containing verd
 parser.add_argument("--events-db", type=str, help="name of the database containing events", required=False)
 parser.add_argument("--path", type=str, help="path to the source code of monitored service", required=False)
 parser.add_argument("--port", type=int, help="the port to server on")
+parser.add_argument("--storage-engine", type=str, choices=["sqlite", "memory", "partitioned"],
+                    help="whether verdicts are stored in the database file given by --db, held in memory, "
+                         "or stored in a database file per partition period alongside the file given by --db",
+                    required=False)
+parser.add_argument("--partition-period", type=str, choices=["day", "week"],
+                    help="period covered by each partition with the partitioned storage engine", required=False)
+parser.add_argument("--partitions-attached", type=int,
+                    help="number of partitions attached to a connection at once", required=False)
+parser.add_argument("--ingestion-mode", type=str, choices=["synchronous", "queued", "spooled"],
+                    help="whether insertions are committed inside each request, queued and committed in groups, "
+                         "or appended to a spool on disk and applied in the background",
+                    required=False)
+parser.add_argument("--group-commit-size", type=int, help="maximum number of queued insertions per commit",
+                    required=False)
+parser.add_argument("--group-commit-interval", type=float,
+                    help="maximum time in seconds a queued insertion waits for its group to be committed",
+                    required=False)
+parser.add_argument("--spool-path", type=str,
+                    help="path prefix of the spool segment files (by default, the database given by --db "
+                         "followed by .spool)", required=False)
+parser.add_argument("--spool-max-size", type=int,
+                    help="size in bytes of unapplied spool records above which insertions are synchronous",
+                    required=False)
+parser.add_argument("--observation-retention-days", type=float,
+                    help="age in days after which observations are compacted into aggregates", required=False)
+parser.add_argument("--compaction-interval", type=int, help="time in seconds between compactions", required=False)
+parser.add_argument("--max-request-body-size", type=int,
+                    help="maximum size in bytes of a decompressed request body sent to an insertion end point",
+                    required=False)
+parser.add_argument("--workers", type=int,
+                    help="number of worker processes serving requests, with writes performed by a separate writer "
+                         "process (by default, the Flask development server is used)", required=False)
+parser.add_argument("--shutdown-timeout", type=int,
+                    help="time in seconds a stopping worker process waits for the requests it is handling",
+                    required=False)
+parser.add_argument("--debug", action="store_true",
+                    help="run the Flask development server in debug mode (without the reloader, which would run "
+                         "a second server process)", required=False)
+parser.add_argument("--pragma", type=str, action="append",
+                    help="sqlite pragma (of the form name=value) to apply to each connection to the verdict database, "
+                         "overriding the default for that pragma", required=False)
 args = parser.parse_args()
 
 if args.db:
@@ -21,6 +62,51 @@ if args.events_db:
 if args.path:
     app.monitored_service_path = args.path
 
+if args.storage_engine:
+    app.storage_engine = args.storage_engine
+
+if args.partition_period:
+    app.partition_period = args.partition_period
+
+if args.partitions_attached:
+    app.partitions_attached = args.partitions_attached
+
+if args.ingestion_mode:
+    app.ingestion_mode = args.ingestion_mode
+
+if args.group_commit_size:
+    app.group_commit_size = args.group_commit_size
+
+if args.group_commit_interval:
+    app.group_commit_interval = args.group_commit_interval
+
+if args.spool_path:
+    app.spool_path = args.spool_path
+
+if args.spool_max_size:
+    app.spool_max_size = args.spool_max_size
+
+if args.observation_retention_days:
+    app.observation_retention_days = args.observation_retention_days
+
+if args.compaction_interval:
+    app.compaction_interval = args.compaction_interval
+
+if args.max_request_body_size:
+    app.max_request_body_size = args.max_request_body_size
+
+if args.workers:
+    app.worker_processes = args.workers
+
+if args.shutdown_timeout:
+    app.worker_shutdown_timeout = args.shutdown_timeout
+
+if args.pragma:
+    for pragma in args.pragma:
+        (name, value) = pragma.split("=", 1)
+        app.sqlite_pragmas = [(existing_name, existing_value) for (existing_name, existing_value)
+                              in app.sqlite_pragmas if existing_name != name] + [(name, value)]
+
 if args.port:
     port = args.port
 else:
@@ -28,5 +114,22 @@ else:
 
 if __name__ == "__main__":
 
+    if app.worker_processes > 0:
+        # serve with worker processes - the catalog is loaded, and compaction is started, by those processes
+        from app.serving import serve
+        serve("0.0.0.0", port)
+        exit(0)
+
+    # the schema must be up to date before handling requests (see migrate_database.py)
+    if not app.database.upgrade_database(verbose=True):
+        exit(1)
+
+    # read the static metadata written by instrumentation
+    app.database.load_catalog()
+
+    # compact old observations in the background, if a retention period is set
+    app.database.start_compaction()
+
     # run the application
-    app_object.run(host="0.0.0.0", debug=True, port=port)
+    # the reloader would run the server (and so compaction) again in a child process
+    app_object.run(host="0.0.0.0", debug=args.debug, port=port, use_reloader=False)
@@ -0,0 +1,119 @@
+"""
+Fixtures shared by the tests.  Each test runs against a fresh verdict database created from verdict-schema.sql,
+with the state kept in memory by the server (engines, connection pools, catalog and caches) reset around it.
+"""
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from app import app_object
+from app.database import engine, utils, writer, spool, insertion
+from app.database.catalog import catalog
+
+
+def reset_server_state():
+    writer.stop_writer()
+    spool.stop_spool()
+    engine.engines.clear()
+    for pool in utils.pools.values():
+        for connection in pool._idle:
+            connection.close()
+    utils.pools.clear()
+    catalog.__init__()
+    for cache in [insertion.assignment_cache, insertion.transaction_cache, insertion.program_path_cache]:
+        cache.clear()
+
+
+def create_database(path):
+    connection = sqlite3.connect(path)
+    with open(engine.schema_path) as schema_file:
+        connection.executescript(schema_file.read())
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture
+def database_path(tmpdir, monkeypatch):
+    path = str(tmpdir.join("verdicts.db"))
+    create_database(path)
+    monkeypatch.setattr(app, "database_string", path)
+    monkeypatch.setattr(app, "spool_path", str(tmpdir.join("verdicts.spool")))
+    reset_server_state()
+    # as when the server starts
+    utils.upgrade_database()
+    yield path
+    reset_server_state()
+
+
+@pytest.fixture
+def client(database_path):
+    return app_object.test_client()
+
+
+@pytest.fixture
+def instrumented(database_path):
+    """
+    Add the metadata written at instrumentation time for a function m.f monitored with one property (hash h)
+    with one binding and one instrumentation point, returning the function id.
+    """
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into function (fully_qualified_name) values('m.f')")
+    connection.execute("insert into property values('h', '{}', 0)")
+    connection.execute("insert into function_property_pair values(1, 'h')")
+    connection.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(0, 1, 'h', '[1]')")
+    connection.execute("insert into instrumentation_point (serialised_condition_sequence, reaching_path_length) "
+                       "values('[]', 1)")
+    connection.execute("insert into binding_instrumentation_point_pair values(1, 1)")
+    connection.commit()
+    connection.close()
+    return 1
+
+
+def insert_call(client, time_of_call="2020-01-01T00:00:00", transaction_time="2020-01-01T00:00:00"):
+    """
+    Insert a function call of m.f, returning its id.
+    """
+    response = client.post("/insert_function_call_data/", data=json.dumps({
+        "transaction_time": transaction_time,
+        "function_name": "m.f",
+        "program_path": [],
+        "time_of_call": time_of_call,
+        "end_time_of_call": time_of_call
+    }))
+    # function calls are accepted once they are spooled, in the spooled ingestion mode
+    assert response.status_code in (200, 202)
+    return json.loads(response.data)["function_call_id"]
+
+
+def verdict_dictionary(function_call_id, values, bind_space_index=0, state=None):
+    """
+    Build the verdicts of a function call of m.f, with one verdict holding one observation for each value given.
+    """
+    return {
+        "function_call_id": function_call_id,
+        "function_id": 1,
+        "property_hash": "h",
+        "verdicts": [
+            {
+                "bind_space_index": bind_space_index,
+                "verdict": [1, "2020-01-01T00:00:01", {"0": {"0": [value, 1, "2020-01-01T00:00:00",
+                                                                    "2020-01-01T00:00:01"]}},
+                            {"0": {"0": 0}}, 0, 0, {"0": {"0": state if state is not None else {"x": value}}}]
+            }
+            for value in values
+        ]
+    }
+
+
+def count_rows(database_path, table):
+    connection = sqlite3.connect(database_path)
+    count = connection.execute("select count(*) from %s" % table).fetchone()[0]
+    connection.close()
+    return count
@@ -0,0 +1,61 @@
+"""
+Tests of the interning of assignments through the assignment cache and the unique index on assignment.
+"""
+import json
+import pickle
+import sqlite3
+
+from app.database import insertion
+from app.database.cache import LRUCache
+from conftest import insert_call, verdict_dictionary, count_rows
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    statistics = cache.statistics()
+    assert (statistics["size"], statistics["hits"], statistics["misses"]) == (2, 3, 1)
+    assert statistics["hit_rate"] == 0.75
+
+
+def test_repeated_assignments_are_found_in_the_cache(client, instrumented, database_path):
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0], state={"user": 7})))
+    statistics = insertion.assignment_cache.statistics()
+
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [2.0, 3.0], state={"user": 7})))
+
+    assert count_rows(database_path, "assignment") == 1
+    assert count_rows(database_path, "observation_assignment_pair") == 3
+    # the first verdict finds the assignment in the cache, and the second in the ids found during the write
+    after = json.loads(client.get("/statistics/").data)["assignment_cache"]
+    assert (after["hits"], after["misses"]) == (statistics["hits"] + 1, statistics["misses"])
+
+
+def test_assignments_missing_from_the_cache_are_found_in_the_database(client, instrumented, database_path):
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0], state={"user": 7})))
+    # as when the assignment was evicted, or inserted by another process
+    insertion.assignment_cache.clear()
+
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [2.0], state={"user": 7})))
+
+    assert count_rows(database_path, "assignment") == 1
+    connection = sqlite3.connect(database_path)
+    assert connection.execute("select distinct assignment from observation_assignment_pair").fetchall() == [(1,)]
+    connection.close()
+    assert insertion.assignment_cache.get(("user", pickle.dumps(7))) == 1
+
+
+def test_values_of_different_types_are_different_assignments(client, instrumented, database_path):
+    call = insert_call(client)
+    for value in [1, 1.0, "1"]:
+        client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0], state={"x": value})))
+
+    assert count_rows(database_path, "assignment") == 3
@@ -0,0 +1,29 @@
+"""
+Tests of the batch lookups of the analysis API.
+"""
+import base64
+import json
+import pickle
+
+from conftest import insert_call, verdict_dictionary
+
+
+def test_assignments_are_looked_up(client, instrumented):
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0])))
+
+    response = client.post("/client/assignment/batch/", data=json.dumps({"ids": [1, 2]}))
+    assert response.status_code == 200
+    assignments = json.loads(response.data)
+    assert assignments["2"] is None
+    assert assignments["1"]["variable"] == "x"
+    # values are pickled, and given in base64
+    assert pickle.loads(base64.b64decode(assignments["1"]["value"])) == 1.0
+
+    response = client.post("/client/observation/assignments/batch/", data=json.dumps({"ids": [1, 2]}))
+    assert response.status_code == 200
+    assert json.loads(response.data) == {"1": [assignments["1"]], "2": []}
+
+
+def test_ids_must_be_given(client, instrumented):
+    assert client.post("/client/assignment/batch/", data=json.dumps({"id": [1]})).status_code == 400
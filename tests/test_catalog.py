@@ -0,0 +1,87 @@
+"""
+Tests of the catalog of static metadata.
+"""
+import json
+import sqlite3
+
+import pytest
+
+from app.database import load_catalog, writer
+from app.database.catalog import catalog
+from app.database.utils import get_connection
+from conftest import insert_call, verdict_dictionary
+
+
+def add_duplicate_binding(database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(0, 1, 'h', '[2]')")
+    connection.commit()
+    connection.close()
+
+
+def test_first_of_duplicate_bindings_is_used(client, instrumented, database_path):
+    add_duplicate_binding(database_path)
+    load_catalog()
+
+    connection = get_connection()
+    assert catalog.get_binding_id(connection.cursor(), 1, "h", 0) == 1
+    connection.close()
+
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0])))
+    assert json.loads(client.get("/client/function_call/id/%i/verdicts/" % call).data)[0]["binding"] == 1
+
+
+def test_first_of_duplicate_bindings_is_used_without_loading(instrumented, database_path):
+    add_duplicate_binding(database_path)
+
+    connection = get_connection()
+    catalog.loaded = True
+    assert catalog.get_binding_id(connection.cursor(), 1, "h", 0) == 1
+    # a duplicate added later doesn't replace the binding already found
+    catalog.add_binding(3, 0, 1, "h", "[3]")
+    assert catalog.get_binding_id(connection.cursor(), 1, "h", 0) == 1
+    connection.close()
+
+
+def test_metadata_added_by_another_process_is_found(instrumented, database_path):
+    load_catalog()
+    # as if another process instrumented a second property and binding of m.f after the catalog was loaded
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into property values('g', '{}', 1)")
+    connection.execute("insert into function_property_pair values(1, 'g')")
+    connection.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(1, 1, 'h', '[2]')")
+    connection.commit()
+    connection.close()
+
+    connection = get_connection()
+    assert catalog.get_property_hashes(connection.cursor(), 1) == ["h", "g"]
+    assert catalog.get_bindings_of_function(connection.cursor(), 1, "h") == [1, 2]
+    connection.close()
+
+
+def test_metadata_found_by_a_rolled_back_write_is_not_kept(instrumented, database_path):
+    load_catalog()
+
+    def insert_and_look_up(cursor, binding_space_index):
+        cursor.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(?, 1, 'h', '[2]')", [binding_space_index])
+        binding_id = catalog.get_binding_id(cursor, 1, "h", binding_space_index)
+        assert binding_id is not None
+        # nothing is added to the catalog until the write has been committed
+        assert (1, "h", binding_space_index) not in catalog.binding_ids
+        if binding_space_index == 1:
+            raise Exception("The write fails after the lookup.")
+        return binding_id
+
+    with pytest.raises(Exception):
+        writer.execute_write(insert_and_look_up, 1)
+    assert (1, "h", 1) not in catalog.binding_ids
+    connection = get_connection()
+    assert catalog.get_binding_id(connection.cursor(), 1, "h", 1) is None
+    connection.close()
+
+    binding_id = writer.execute_write(insert_and_look_up, 2)
+    assert catalog.binding_ids[(1, "h", 2)] == binding_id
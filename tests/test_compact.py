@@ -0,0 +1,100 @@
+"""
+Tests of the compact (msgpack) wire format accepted by the insertion end points.
+"""
+import json
+import pickle
+import sqlite3
+
+import app
+from app.database import compact, spool
+from conftest import count_rows
+
+headers = {"Content-Type": compact.compact_content_type}
+
+
+def compact_call(time_of_call="2020-01-01T00:00:00", property_verdicts=None):
+    call_array = ["2020-01-01T00:00:00", "m.f", time_of_call, time_of_call, []]
+    if property_verdicts is not None:
+        call_array.append(property_verdicts)
+    return compact.encode_compact(call_array)
+
+
+def compact_verdicts(values, bind_space_index=0):
+    """
+    Build the compact form of the verdicts built by verdict_dictionary, without the function call and function ids.
+    """
+    return [
+        [bind_space_index, 1, "2020-01-01T00:00:01", 0, 0,
+         [[0, 0, 1, value, "2020-01-01T00:00:00", "2020-01-01T00:00:01", 0, [["x", value]]]]]
+        for value in values
+    ]
+
+
+def read_observations(database_path):
+    connection = sqlite3.connect(database_path)
+    observations = connection.execute(
+        "select observed_value, numeric_value, observation_time_us from observation order by id"
+    ).fetchall()
+    assignments = [(variable, pickle.loads(value)) for (variable, value) in
+                   connection.execute("select variable, value from assignment order by id").fetchall()]
+    connection.close()
+    return (observations, assignments)
+
+
+def test_compact_call_and_verdicts_are_stored(client, instrumented, database_path):
+    response = client.post("/insert_function_call_data/", data=compact_call(), headers=headers)
+    call = json.loads(response.data)["function_call_id"]
+
+    response = client.post("/register_verdicts/", headers=headers,
+                           data=compact.encode_compact([call, 1, "h", compact_verdicts([1.5, 2])]))
+    assert response.data == b"success"
+
+    (observations, assignments) = read_observations(database_path)
+    assert observations == [("1.5", 1.5, 1577836800000000), ("2", 2.0, 1577836800000000)]
+    assert assignments == [("x", 1.5), ("x", 2)]
+    # the observations can be read back through the analysis end points
+    response = client.get("/client/function_call/id/%i/observations/" % call)
+    assert sorted(row["observed_value"] for row in json.loads(response.data)) == ["1.5", "2"]
+
+
+def test_compact_call_can_hold_its_verdicts(client, instrumented, database_path):
+    response = client.post("/insert_function_call_and_verdicts/", headers=headers,
+                           data=compact_call(property_verdicts=[["h", compact_verdicts([1.0, 1.0])]]))
+
+    assert json.loads(response.data)["function_call_id"] == 1
+    assert count_rows(database_path, "verdict") == 2
+    # both observations share the same assignment
+    assert count_rows(database_path, "assignment") == 1
+    assert count_rows(database_path, "observation_assignment_pair") == 2
+
+
+def test_spooled_compact_verdicts_keep_binary_values(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "ingestion_mode", "spooled")
+    call = json.loads(client.post("/insert_function_call_data/", data=compact_call(), headers=headers).data)[
+        "function_call_id"]
+
+    # msgpack's bin type is decoded to bytes, which json can't represent
+    response = client.post("/register_verdicts/", headers=headers,
+                           data=compact.encode_compact([call, 1, "h", compact_verdicts([b"\x00\xff"])]))
+    assert response.status_code == 202
+
+    spool.stop_spool()
+    (observations, assignments) = read_observations(database_path)
+    assert observations == [(str(b"\x00\xff"), None, 1577836800000000)]
+    assert assignments == [("x", b"\x00\xff")]
+
+
+def test_failed_spooled_compact_verdicts_keep_binary_values(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "ingestion_mode", "spooled")
+    verdict_array = [1, 1, "h", compact_verdicts([b"\x00\xff"], bind_space_index=5)]
+    response = client.post("/register_verdicts/", headers=headers, data=compact.encode_compact(verdict_array))
+    assert response.status_code == 202
+
+    dead_letter_path = spool.get_spool().dead_letter_path()
+    spool.stop_spool()
+    with open(dead_letter_path) as dead_letter_file:
+        dead_letters = [json.loads(line, object_hook=spool.decode_binary) for line in dead_letter_file]
+    assert len(dead_letters) == 1
+    assert dead_letters[0]["kind"] == "compact_verdicts"
+    assert dead_letters[0]["data"] == verdict_array
+    assert "No binding was found" in dead_letters[0]["error"]
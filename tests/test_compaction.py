@@ -0,0 +1,100 @@
+"""
+Tests of the compaction of old observations into aggregates.
+"""
+import json
+import sqlite3
+
+from app.database import compaction
+from app.database.utils import get_connection
+from conftest import insert_call, verdict_dictionary, count_rows
+
+
+def read_aggregates(database_path):
+    connection = sqlite3.connect(database_path)
+    rows = connection.execute(
+        "select binding, bucket_start, observation_count, sum_value from observation_aggregate order by binding"
+    ).fetchall()
+    connection.close()
+    return rows
+
+
+def add_second_binding(database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(1, 1, 'h', '[2]')")
+    connection.execute("insert into binding_instrumentation_point_pair values(2, 1)")
+    connection.commit()
+    connection.close()
+
+
+def test_observations_are_compacted_before_a_utc_cutoff(client, instrumented, database_path):
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0, 3.0])))
+
+    # the observations were made at 00:00:00 UTC, which is after 00:30:00 at an offset of +01:00
+    assert compaction.compact_observations("2020-01-01T00:30:00+01:00") == 0
+    assert compaction.compact_observations("2020-01-01T01:30:00+01:00") == 2
+
+    assert count_rows(database_path, "observation") == 0
+    assert read_aggregates(database_path) == [(1, "2020-01-01T00:00:00", 2, 4.0)]
+
+
+def test_observations_without_a_time_are_kept(client, instrumented, database_path):
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0, 3.0])))
+    connection = sqlite3.connect(database_path)
+    connection.execute("update observation set observation_time_us = null where id = 1")
+    connection.commit()
+    connection.close()
+
+    assert compaction.compact_observations("2020-01-02T00:00:00") == 1
+
+    # the observation that couldn't be given a bucket is neither removed nor counted
+    assert count_rows(database_path, "observation") == 1
+    assert read_aggregates(database_path) == [(1, "2020-01-01T00:00:00", 1, 3.0)]
+
+
+def test_compacted_observations_are_listed_by_binding_and_call(client, instrumented, database_path):
+    add_second_binding(database_path)
+    call = insert_call(client)
+    later_call = insert_call(client, time_of_call="2020-01-05T00:00:00")
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0, 3.0])))
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [10.0], bind_space_index=1)))
+    compaction.compact_observations("2020-01-02T00:00:00")
+    assert len(read_aggregates(database_path)) == 2
+
+    connection = get_connection()
+    cursor = connection.cursor()
+    # each binding has its own aggregate, holding the mean of its values
+    assert compaction.list_compacted_observations(cursor, [1], 0, 0, [call], 0) == \
+        [(2.0, "2020-01-01T00:00:00", "2020-01-01T00:00:00", 1)]
+    assert compaction.list_compacted_observations(cursor, [1], 0, 0, [call], 1) == \
+        [(10.0, "2020-01-01T00:00:00", "2020-01-01T00:00:00", 1)]
+    # the bucket doesn't overlap a call made days later
+    assert compaction.list_compacted_observations(cursor, [1], 0, 0, [later_call], 0) == []
+    connection.close()
+
+
+def test_batches_are_found_through_an_index(database_path):
+    connection = get_connection()
+    plan = connection.cursor().execute(
+        "explain query plan select id from main.observation where observation_time_us < ? "
+        "order by observation_time_us limit ?", [0, 1]
+    ).fetchall()
+    connection.close()
+    assert "USING COVERING INDEX observation_time_us" in " ".join(row[-1] for row in plan)
+
+
+def test_summary_is_unaffected_by_compaction(client, instrumented):
+    call = insert_call(client)
+    dictionary = verdict_dictionary(call, [1.0, 3.0])
+    # 23:30 at an offset of -01:00 is 00:30 UTC, in the first bucket of 2020-01-01
+    for verdict in dictionary["verdicts"]:
+        verdict["verdict"][2]["0"]["0"][2] = "2019-12-31T23:30:00-01:00"
+    client.post("/register_verdicts/", data=json.dumps(dictionary))
+
+    url = "/client/instrumentation_point/id/1/atom/0/observations/summary/?start=2020-01-01T01:00:00%2B01:00"
+    before = json.loads(client.get(url).data)
+    assert [(bucket["bucket_start"], bucket["count"]) for bucket in before] == [("2020-01-01T00:00:00", 2)]
+    compaction.compact_observations("2020-01-02T00:00:00")
+    assert json.loads(client.get(url).data) == before
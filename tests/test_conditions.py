@@ -0,0 +1,79 @@
+"""
+Tests of the interning of branching conditions by content hash.
+"""
+import sqlite3
+import threading
+
+from app import app_object
+from app.database import load_catalog
+from app.database.catalog import catalog
+from app.database.schema import content_hash
+from conftest import insert_call, count_rows
+
+
+def store_condition(client, serialised_condition):
+    return int(client.post("/store_branching_condition/",
+                           data='{"serialised_condition": "%s"}' % serialised_condition).data)
+
+
+def test_condition_is_stored_once(client, database_path):
+    first = store_condition(client, "x > 1")
+    assert store_condition(client, "y > 1") != first
+    assert store_condition(client, "x > 1") == first
+
+    connection = sqlite3.connect(database_path)
+    assert connection.execute("select hash from path_condition_structure where id = ?", [first]).fetchone()[0] == \
+        content_hash("x > 1")
+    connection.close()
+    assert count_rows(database_path, "path_condition_structure") == 2
+
+
+def test_conditions_are_loaded_with_the_catalog(client, database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into path_condition_structure (serialised_condition, hash) values(?, ?)",
+                       ["x > 1", content_hash("x > 1")])
+    connection.commit()
+    connection.close()
+
+    load_catalog()
+    assert catalog.condition_ids["x > 1"] == 1
+    assert store_condition(client, "x > 1") == 1
+
+
+def test_condition_stored_by_another_process_is_found(client, database_path):
+    load_catalog()
+    # the catalog has been loaded, so the condition is only found by its hash
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into path_condition_structure (serialised_condition, hash) values(?, ?)",
+                       ["x > 1", content_hash("x > 1")])
+    connection.commit()
+    connection.close()
+
+    assert store_condition(client, "x > 1") == 1
+    assert count_rows(database_path, "path_condition_structure") == 1
+
+
+def test_empty_condition_is_shared_by_calls(client, instrumented, database_path):
+    for _ in range(3):
+        insert_call(client)
+
+    connection = sqlite3.connect(database_path)
+    assert connection.execute("select count(*) from path_condition_structure "
+                              "where serialised_condition = ''").fetchone()[0] == 1
+    connection.close()
+
+
+def test_concurrent_instrumentation_stores_a_condition_once(database_path):
+    ids = []
+
+    def send_condition():
+        ids.append(store_condition(app_object.test_client(), "x > 1"))
+
+    threads = [threading.Thread(target=send_condition) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert ids == [1] * 8
+    assert count_rows(database_path, "path_condition_structure") == 1
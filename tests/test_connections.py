@@ -0,0 +1,77 @@
+"""
+Tests of the pool of connections to the verdict database.
+"""
+import sqlite3
+
+import app
+from app import app_object
+from app.database import utils
+from app.metrics import connections_opened_total
+
+
+def connections_opened():
+    return connections_opened_total._values.get((), 0)
+
+
+def idle_connections():
+    return sum(len(pool._idle) for pool in utils.pools.values())
+
+
+def test_connections_are_configured_with_the_pragmas(database_path, monkeypatch):
+    monkeypatch.setattr(app, "sqlite_pragmas", app.sqlite_pragmas + [("cache_size", -1024)])
+    connection = utils.get_connection()
+    pragmas = dict((pragma, connection.execute("pragma %s" % pragma).fetchone()[0])
+                   for pragma in ["journal_mode", "synchronous", "busy_timeout", "cache_size", "temp_store"])
+    connection.close()
+
+    # synchronous = normal is 1, and temp_store = memory is 2
+    assert pragmas == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000, "cache_size": -1024,
+                       "temp_store": 2}
+
+
+def test_closed_connections_are_reused(database_path):
+    first = utils.get_connection()
+    first_connection = first._connection
+    first.close()
+    opened = connections_opened()
+
+    second = utils.get_connection()
+    assert second._connection is first_connection
+    second.close()
+    assert connections_opened() == opened
+
+
+def test_released_connections_are_reset(database_path):
+    connection = utils.get_connection()
+    connection.row_factory = sqlite3.Row
+    connection.execute("insert into function (fully_qualified_name) values('m.f')")
+    connection.close()
+
+    connection = utils.get_connection()
+    assert connection.row_factory is None
+    # the insertion was never committed
+    assert connection.execute("select count(*) from function").fetchone()[0] == 0
+    connection.close()
+
+
+def test_idle_connections_are_limited(database_path, monkeypatch):
+    monkeypatch.setattr(app, "connection_pool_size", 2)
+    connections = [utils.get_connection() for _ in range(4)]
+    for connection in connections:
+        connection.close()
+    assert idle_connections() == 2
+
+
+def test_connections_are_released_when_a_request_ends(client, instrumented):
+    with app_object.app_context():
+        utils.get_connection()
+        idle = idle_connections()
+    assert idle_connections() == idle + 1
+
+    # the connection of a list is returned to the pool once the list has been sent
+    assert b"m.f" in client.get("/client/function/").data
+    opened = connections_opened()
+    for _ in range(3):
+        assert b"m.f" in client.get("/client/function/").data
+        assert b"m.f" in client.get("/client/function/id/1/").data
+    assert connections_opened() == opened
@@ -0,0 +1,93 @@
+"""
+Tests of the storage engines behind the verdict database, including the memory engine.
+"""
+import json
+import os
+
+import pytest
+
+import app
+from app import app_object
+from app.database import engine, utils
+from conftest import reset_server_state, insert_call, verdict_dictionary
+
+
+def add_metadata():
+    # as the instrumented fixture does, through the engine rather than the database file
+    connection = utils.get_connection()
+    connection.execute("insert into function (fully_qualified_name) values('m.f')")
+    connection.execute("insert into property values('h', '{}', 0)")
+    connection.execute("insert into function_property_pair values(1, 'h')")
+    connection.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(0, 1, 'h', '[1]')")
+    connection.execute("insert into instrumentation_point (serialised_condition_sequence, reaching_path_length) "
+                       "values('[]', 1)")
+    connection.execute("insert into binding_instrumentation_point_pair values(1, 1)")
+    connection.commit()
+    connection.close()
+
+
+def use_memory_database(monkeypatch, name):
+    monkeypatch.setattr(app, "database_string", name)
+    assert utils.upgrade_database()
+
+
+@pytest.fixture
+def memory(tmpdir, monkeypatch):
+    """
+    Use the memory engine, with a database named after the test's directory (which is also the working directory),
+    returning the name.
+    """
+    monkeypatch.setattr(app, "storage_engine", "memory")
+    monkeypatch.chdir(str(tmpdir))
+    name = "verdicts-%s" % tmpdir.basename
+    reset_server_state()
+    use_memory_database(monkeypatch, name)
+    yield name
+    reset_server_state()
+
+
+def test_memory_engine_holds_verdicts_without_files(memory, tmpdir):
+    add_metadata()
+    client = app_object.test_client()
+    call = insert_call(client)
+    assert client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0, 2.0]))).data == \
+        b"success"
+
+    verdicts = json.loads(client.get("/client/function_call/id/%i/verdicts/" % call).data)
+    assert len(verdicts) == 2
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_memory_databases_are_separate(memory, monkeypatch):
+    add_metadata()
+    insert_call(app_object.test_client())
+
+    use_memory_database(monkeypatch, memory + "-other")
+    connection = utils.get_connection()
+    assert connection.execute("select count(*) from function_call").fetchone()[0] == 0
+    connection.close()
+
+    monkeypatch.setattr(app, "database_string", memory)
+    connection = utils.get_connection()
+    assert connection.execute("select count(*) from function_call").fetchone()[0] == 1
+    connection.close()
+
+
+def test_connections_are_opened_by_the_configured_engine(database_path, monkeypatch):
+    connected = []
+
+    class CountingEngine(engine.SQLiteEngine):
+        def connect(self):
+            connected.append(self.database_string)
+            return super(CountingEngine, self).connect()
+
+    monkeypatch.setitem(engine.storage_engines, "counting", CountingEngine)
+    monkeypatch.setattr(app, "storage_engine", "counting")
+    reset_server_state()
+
+    connection = utils.get_connection()
+    assert connection.execute("select count(*) from function").fetchone()[0] == 0
+    connection.close()
+    assert isinstance(engine.get_engine(), CountingEngine)
+    assert connected == [database_path]
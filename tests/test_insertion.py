@@ -0,0 +1,128 @@
+"""
+Tests of the insertion end points.
+"""
+import json
+import pickle
+
+from app.database import insertion
+from conftest import insert_call, verdict_dictionary, count_rows
+
+
+def test_batch_keeps_nothing_from_a_failed_call(client, instrumented, database_path):
+    calls = [insert_call(client) for _ in range(3)]
+    failing = verdict_dictionary(calls[1], [1.0], state={"z": 99})
+    # the second verdict has no binding, so the call fails after the first verdict's assignment was inserted
+    failing["verdicts"] += verdict_dictionary(calls[1], [2.0], bind_space_index=5)["verdicts"]
+
+    response = client.post("/register_verdicts_batch/", data=json.dumps([
+        verdict_dictionary(calls[0], [1.0, 2.0]),
+        failing,
+        verdict_dictionary(calls[2], [3.0])
+    ]))
+
+    statuses = json.loads(response.data)
+    assert [status["status"] for status in statuses] == ["success", "failure", "success"]
+    assert [status["function_call_id"] for status in statuses] == calls
+    assert count_rows(database_path, "verdict") == 3
+    assert count_rows(database_path, "observation") == 3
+    # only the assignments of the calls that succeeded were kept, and cached
+    assert count_rows(database_path, "assignment") == 3
+    assert insertion.assignment_cache.get(("z", pickle.dumps(99))) is None
+    assert insertion.assignment_cache.get(("x", pickle.dumps(3.0))) is not None
+
+
+def test_batch_shares_assignments_between_calls(client, instrumented, database_path):
+    calls = [insert_call(client) for _ in range(2)]
+    response = client.post("/register_verdicts_batch/", data=json.dumps([
+        verdict_dictionary(calls[0], [1.0]),
+        verdict_dictionary(calls[1], [1.0])
+    ]))
+
+    assert [status["status"] for status in json.loads(response.data)] == ["success", "success"]
+    assert count_rows(database_path, "assignment") == 1
+    assert count_rows(database_path, "observation_assignment_pair") == 2
+
+
+manifest = {
+    "function": "m.g",
+    "properties": [{
+        "formula_hash": "p",
+        "serialised_bind_variables": "bind",
+        "serialised_formula_structure": "formula",
+        "formula_index": 0,
+        "serialised_atom_list": [[0, "atom 0"], [1, "atom 1"]]
+    }],
+    "bindings": [{"binding_space_index": 0, "binding_statement_lines": [3], "property_hash": "p"}],
+    "instrumentation_points": [
+        {"serialised_condition_sequence": ["a"], "reaching_path_length": 1, "property_hash": "p",
+         "atom_index": atom_index, "binding_space_index": 0}
+        for atom_index in [0, 1]
+    ],
+    "branching_conditions": [{"serialised_condition": "x > 1"}]
+}
+
+
+def test_manifest_can_be_sent_again(client, database_path):
+    first = json.loads(client.post("/store_instrumentation_manifest/", data=json.dumps(manifest)).data)
+    counts = dict((table, count_rows(database_path, table)) for table in [
+        "function", "property", "function_property_pair", "atom", "binding", "instrumentation_point",
+        "atom_instrumentation_point_pair", "binding_instrumentation_point_pair", "path_condition_structure"
+    ])
+
+    second = json.loads(client.post("/store_instrumentation_manifest/", data=json.dumps(manifest)).data)
+
+    assert second == first
+    assert len(first["instrumentation_points"]) == 2
+    for (table, count) in counts.items():
+        assert count_rows(database_path, table) == count, table
+
+
+def call_and_verdicts(property_verdicts):
+    """
+    Build the data sent to /insert_function_call_and_verdicts/ for a call of m.f, given verdict dictionaries
+    built by verdict_dictionary (from which the function call and function ids are removed).
+    """
+    for verdicts in property_verdicts:
+        del verdicts["function_call_id"]
+        del verdicts["function_id"]
+    return json.dumps({
+        "transaction_time": "2020-01-01T00:00:00",
+        "function_name": "m.f",
+        "program_path": [],
+        "time_of_call": "2020-01-01T00:00:00",
+        "end_time_of_call": "2020-01-01T00:00:01",
+        "property_verdicts": property_verdicts
+    })
+
+
+def test_call_and_verdicts_are_inserted_together(client, instrumented, database_path):
+    response = client.post("/insert_function_call_and_verdicts/",
+                           data=call_and_verdicts([verdict_dictionary(None, [1.0, 2.0])]))
+
+    assert json.loads(response.data) == {"function_call_id": 1, "function_id": 1}
+    verdicts = json.loads(client.get("/client/function_call/id/1/verdicts/").data)
+    assert [verdict["function_call"] for verdict in verdicts] == [1, 1]
+    observations = json.loads(client.get("/client/function_call/id/1/observations/").data)
+    assert sorted(observation["observed_value"] for observation in observations) == ["1.0", "2.0"]
+    assert count_rows(database_path, "observation_assignment_pair") == 2
+
+
+def test_call_is_not_kept_when_its_verdicts_fail(client, instrumented, database_path):
+    # the second property's verdicts have no binding, so the call fails after the first property's were prepared
+    response = client.post("/insert_function_call_and_verdicts/", data=call_and_verdicts([
+        verdict_dictionary(None, [1.0], state={"z": 99}),
+        verdict_dictionary(None, [2.0], bind_space_index=5)
+    ]))
+
+    assert response.status_code == 500
+    for table in ["trans", "function_call", "verdict", "observation", "assignment"]:
+        assert count_rows(database_path, table) == 0, table
+    assert insertion.transaction_cache.get("2020-01-01T00:00:00") is None
+    assert insertion.assignment_cache.get(("z", pickle.dumps(99))) is None
+
+    # the call can be sent again, without the verdicts that failed
+    response = client.post("/insert_function_call_and_verdicts/",
+                           data=call_and_verdicts([verdict_dictionary(None, [1.0], state={"z": 99})]))
+    assert json.loads(response.data)["function_call_id"] == 1
+    assert count_rows(database_path, "verdict") == 1
+    assert count_rows(database_path, "assignment") == 1
@@ -0,0 +1,30 @@
+"""
+Tests of the metrics collected about requests.
+"""
+from app.metrics import requests_total, request_duration
+
+
+def requests_counted(route, status):
+    return requests_total._values.get((route, "GET", str(status)), 0)
+
+
+def test_streamed_request_is_recorded_once_sent(client, instrumented):
+    route = "/client/function/"
+    counted = requests_counted(route, 200)
+    timed = request_duration._values.get((route,), [None, 0, 0])[2]
+
+    response = client.get(route, buffered=False)
+    # the rows haven't been generated yet
+    assert requests_counted(route, 200) == counted
+
+    assert b"m.f" in response.get_data()
+    response.close()
+    assert requests_counted(route, 200) == counted + 1
+    assert request_duration._values[(route,)][2] == timed + 1
+
+
+def test_request_is_recorded(client, instrumented):
+    route = "/client/function/id/<function_id>/"
+    counted = requests_counted(route, 200)
+    client.get("/client/function/id/1/")
+    assert requests_counted(route, 200) == counted + 1
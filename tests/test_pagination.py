@@ -0,0 +1,77 @@
+"""
+Tests of the pages of lists given by the analysis API.
+"""
+import json
+
+import app
+from app.database import utils
+from conftest import insert_call, verdict_dictionary
+
+
+def read_pages(client, url, limit):
+    """
+    Follow the next cursor of each page of the given list, returning the ids in each page.
+    """
+    pages = []
+    after_id = None
+    while True:
+        response = json.loads(client.get("%s?limit=%i%s" % (
+            url, limit, "&after_id=%i" % after_id if after_id is not None else "")).data)
+        pages.append([row["id"] for row in response["results"]])
+        after_id = response["next"]
+        if after_id is None:
+            return pages
+
+
+def test_pages_follow_next(client, instrumented):
+    calls = [insert_call(client) for _ in range(5)]
+    assert read_pages(client, "/client/function/id/m.f/function_calls/", 2) == [calls[0:2], calls[2:4], calls[4:5]]
+
+
+def test_last_full_page_has_no_next(client, instrumented):
+    calls = [insert_call(client) for _ in range(4)]
+    assert read_pages(client, "/client/function/id/m.f/function_calls/", 2) == [calls[0:2], calls[2:4]]
+
+
+def test_limit_is_capped(client, instrumented, monkeypatch):
+    monkeypatch.setattr(app, "max_page_size", 2)
+    calls = [insert_call(client) for _ in range(3)]
+    # a page given by after_id alone holds at most max_page_size rows
+    response = json.loads(client.get("/client/function/id/m.f/function_calls/?after_id=0").data)
+    assert [row["id"] for row in response["results"]] == calls[0:2]
+    assert response["next"] == calls[1]
+    assert read_pages(client, "/client/function/id/m.f/function_calls/", 100) == [calls[0:2], calls[2:3]]
+
+
+def test_unpaged_list_has_every_row(client, instrumented):
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0, 2.0, 3.0])))
+    observations = json.loads(client.get("/client/instrumentation_point/id/1/observations/").data)
+    assert [observation["id"] for observation in observations] == [1, 2, 3]
+
+
+class CountingCursor(object):
+    """
+    Stands in for the cursor of a paged query, counting the rows read from it.
+    """
+    description = (("page_key",), ("id",))
+
+    def __init__(self, row_count):
+        self.rows = [(row_id, row_id) for row_id in range(1, row_count + 1)]
+        self.read = 0
+
+    def fetchmany(self, size):
+        rows = self.rows[self.read:self.read + size]
+        self.read += len(rows)
+        return rows
+
+    def close(self):
+        pass
+
+
+def test_page_reads_no_more_rows_than_it_needs():
+    cursor = CountingCursor(100)
+    page = json.loads("".join(utils.stream_rows(cursor, cursor, utils.Listing(limit=2))))
+    assert page == {"results": [{"id": 1}, {"id": 2}], "next": 2}
+    # the row after the page is read to find whether there's another page, but no more
+    assert cursor.read == 3
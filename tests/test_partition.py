@@ -0,0 +1,122 @@
+"""
+Tests of the partitioned storage engine, with rows held by more partitions than can be attached at once.
+"""
+import datetime
+import json
+import sqlite3
+
+import pytest
+
+import app
+from app.database import partition, utils
+from app.database.engine import get_engine
+from conftest import reset_server_state, verdict_dictionary
+
+# days before today of the old partitions, each holding one function call (with ids 1 to 5)
+old_days = [9, 8, 7, 6, 5]
+
+
+@pytest.fixture
+def partitioned(database_path, monkeypatch):
+    """
+    Use the partitioned storage engine, attaching at most two partitions at once, over a catalog holding function
+    m.f and five old partitions, each holding a function call with a verdict and an observation.
+    """
+    monkeypatch.setattr(app, "storage_engine", "partitioned")
+    monkeypatch.setattr(app, "partitions_attached", 2)
+    monkeypatch.setattr(partition, "partition_refresh_interval", 0)
+    reset_server_state()
+    utils.upgrade_database()
+
+    connection = sqlite3.connect(database_path)
+    connection.execute("insert into function (fully_qualified_name) values('m.f')")
+    connection.execute("insert into property values('h', '{}', 0)")
+    connection.execute("insert into binding (binding_space_index, function, property_hash, binding_statement_lines) "
+                       "values(0, 1, 'h', '[1]')")
+    connection.execute("insert into instrumentation_point (serialised_condition_sequence, reaching_path_length) "
+                       "values('[]', 1)")
+    connection.execute("insert into binding_instrumentation_point_pair values(1, 1)")
+    connection.execute("insert into trans (time_of_transaction) values('2020-01-01T00:00:00')")
+    connection.commit()
+    connection.close()
+
+    engine = get_engine()
+    for (call_id, days) in enumerate(old_days, 1):
+        period = partition.get_period(datetime.datetime.now() - datetime.timedelta(days=days))
+        engine.create_partition(period)
+        connection = sqlite3.connect(engine.partition_path(period[0]))
+        connection.execute("insert into function_call (id, function, time_of_call, end_time_of_call, trans, "
+                           "path_condition_id_sequence) values(?, 1, ?, ?, 1, '')", [call_id, period[1], period[1]])
+        connection.execute("insert into verdict (id, binding, verdict, time_obtained, function_call, collapsing_atom, "
+                           "collapsing_atom_sub_index) values(?, 1, 1, ?, ?, 0, 0)", [call_id, period[1], call_id])
+        # values decrease with age, so the order of values differs from the order of ids
+        connection.execute("insert into observation (id, instrumentation_point, verdict, observed_value, "
+                           "numeric_value, observation_time, observation_end_time, atom_index, sub_index, "
+                           "previous_condition_offset) values(?, 1, ?, ?, ?, ?, ?, 0, 0, 0)",
+                           [call_id, call_id, str(6 - call_id), 6 - call_id, period[1], period[1]])
+        connection.commit()
+        connection.close()
+    return engine
+
+
+def test_old_rows_are_found_by_id(client, partitioned):
+    assert json.loads(client.get("/client/function_call/id/1/").data)["id"] == 1
+    assert json.loads(client.get("/client/verdict/id/2/").data)["function_call"] == 2
+    assert client.get("/client/function_call/id/100/").data == b"None"
+
+
+def test_batch_lookup_over_partitions(client, partitioned):
+    response = client.post("/client/function_call/batch/", data=json.dumps({"ids": [1, 5, 100]}))
+    results = json.loads(response.data)
+    assert results["1"]["id"] == 1
+    assert results["5"]["id"] == 5
+    assert results["100"] is None
+
+    response = client.post("/client/function_call/verdicts/batch/", data=json.dumps({"ids": [1, 3]}))
+    assert [[verdict["id"] for verdict in verdicts] for verdicts in json.loads(response.data).values()] in \
+        ([[1], [3]], [[3], [1]])
+
+
+def test_list_over_partitions(client, partitioned):
+    calls = json.loads(client.get("/client/function/id/m.f/function_calls/").data)
+    assert sorted(call["id"] for call in calls) == [1, 2, 3, 4, 5]
+
+
+def test_pages_over_partitions(client, partitioned):
+    ids = []
+    after_id = None
+    while True:
+        response = json.loads(client.get("/client/function/id/m.f/function_calls/?limit=2%s" %
+                                         ("&after_id=%i" % after_id if after_id is not None else "")).data)
+        ids += [call["id"] for call in response["results"]]
+        after_id = response["next"]
+        if after_id is None:
+            break
+    assert ids == [1, 2, 3, 4, 5]
+
+
+def test_pages_in_order_of_value_over_partitions(client, partitioned):
+    url = "/client/instrumentation_point/id/1/atom/0/observations/range/?lower=2&limit=2&fields=id,numeric_value"
+    response = json.loads(client.get(url).data)
+    assert response["results"] == [{"id": 4, "numeric_value": 2.0}, {"id": 3, "numeric_value": 3.0}]
+    response = json.loads(client.get(url + "&after_id=%i" % response["next"]).data)
+    assert response["results"] == [{"id": 2, "numeric_value": 4.0}, {"id": 1, "numeric_value": 5.0}]
+    assert response["next"] is None
+
+
+def test_oversized_range_is_refused(client, partitioned):
+    start = (datetime.datetime.now() - datetime.timedelta(days=9)).isoformat()
+    end = datetime.datetime.now().isoformat()
+    response = client.get("/client/function_call/between/%s/%s/" % (start, end))
+    assert response.status_code == 400
+
+
+def test_verdicts_are_inserted_alongside_their_call(client, partitioned):
+    # the function call with id 5 is held by the most recent old partition, which is attached by default
+    response = client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(5, [1.0])))
+    assert response.data == b"success"
+    period = partition.get_period(datetime.datetime.now() - datetime.timedelta(days=old_days[-1]))
+    connection = sqlite3.connect(partitioned.partition_path(period[0]))
+    assert connection.execute("select count(*) from verdict where function_call = 5").fetchone()[0] == 2
+    assert connection.execute("select count(*) from observation").fetchone()[0] == 2
+    connection.close()
@@ -0,0 +1,60 @@
+"""
+Tests of the storage of the program paths of function calls, each distinct path being stored once.
+"""
+import json
+import sqlite3
+
+from app.database import insertion
+from conftest import count_rows
+
+
+def insert_call_with_path(client, program_path):
+    response = client.post("/insert_function_call_data/", data=json.dumps({
+        "transaction_time": "2020-01-01T00:00:00",
+        "function_name": "m.f",
+        "program_path": program_path,
+        "time_of_call": "2020-01-01T00:00:00",
+        "end_time_of_call": "2020-01-01T00:00:01"
+    }))
+    return json.loads(response.data)["function_call_id"]
+
+
+def program_paths_of_calls(database_path):
+    connection = sqlite3.connect(database_path)
+    rows = connection.execute("select id, program_path from function_call order by id").fetchall()
+    connection.close()
+    return rows
+
+
+def test_calls_following_a_path_share_it(client, instrumented, database_path):
+    for program_path in [[2, 3], [2, 3], [4], [2, 3]]:
+        insert_call_with_path(client, program_path)
+
+    assert program_paths_of_calls(database_path) == [(1, 1), (2, 1), (3, 2), (4, 1)]
+    connection = sqlite3.connect(database_path)
+    # the empty condition (inserted by the first call) starts every path
+    assert connection.execute("select id, path_condition_id_sequence from program_path order by id").fetchall() == \
+        [(1, "[1, 2, 3]"), (2, "[1, 4]")]
+    connection.close()
+
+
+def test_paths_missing_from_the_cache_are_found_in_the_database(client, instrumented, database_path):
+    insert_call_with_path(client, [2, 3])
+    # as when the path was evicted, or inserted by another process
+    insertion.program_path_cache.clear()
+    insert_call_with_path(client, [2, 3])
+
+    assert count_rows(database_path, "program_path") == 1
+    assert program_paths_of_calls(database_path) == [(1, 1), (2, 1)]
+
+
+def test_calls_are_listed_with_their_paths(client, instrumented, database_path):
+    insert_call_with_path(client, [2, 3])
+    insert_call_with_path(client, [4])
+
+    listed = json.loads(client.get("/client/function/id/m.f/function_calls/").data)
+    assert [call["path_condition_id_sequence"] for call in listed] == ["[1, 2, 3]", "[1, 4]"]
+    call = json.loads(client.get("/client/function_call/id/2/").data)
+    assert (call["path_condition_id_sequence"], call["program_path"]) == ("[1, 4]", 2)
+    batch = json.loads(client.post("/client/function_call/batch/", data=json.dumps({"ids": [1, 2]})).data)
+    assert [batch[key]["path_condition_id_sequence"] for key in sorted(batch)] == ["[1, 2, 3]", "[1, 4]"]
@@ -0,0 +1,18 @@
+"""
+Tests of the fields given by the analysis API lists.
+"""
+import json
+
+from conftest import insert_call, verdict_dictionary
+
+
+def test_verdicts_of_function_are_given_by_verdict_id(client, instrumented):
+    for _ in range(2):
+        call = insert_call(client)
+        client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0])))
+
+    for url in ["/client/function/id/1/verdicts/", "/client/function/id/1/verdict/value/1/"]:
+        verdicts = json.loads(client.get(url).data)
+        assert [(verdict["id"], verdict["binding"]) for verdict in verdicts] == [(1, 1), (2, 1)]
+        # the projected rows agree with the full rows
+        assert json.loads(client.get(url + "?fields=id").data) == [{"id": 1}, {"id": 2}]
@@ -0,0 +1,66 @@
+"""
+Tests of the reading of (possibly compressed) request bodies by the insertion end points.
+"""
+import gzip
+import io
+import json
+import zlib
+
+import app
+from conftest import count_rows
+
+
+def call_body():
+    return json.dumps({
+        "transaction_time": "2020-01-01T00:00:00",
+        "function_name": "m.f",
+        "program_path": [],
+        "time_of_call": "2020-01-01T00:00:00",
+        "end_time_of_call": "2020-01-01T00:00:00"
+    }).encode("utf-8")
+
+
+def gzip_compress(data):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gzip_file:
+        gzip_file.write(data)
+    return buffer.getvalue()
+
+
+def post_call(client, data, encoding):
+    return client.post("/insert_function_call_data/", data=data, headers={"Content-Encoding": encoding})
+
+
+def test_compressed_bodies_are_accepted(client, instrumented, database_path):
+    for (encoding, data) in [("gzip", gzip_compress(call_body())), ("x-gzip", gzip_compress(call_body())),
+                             ("deflate", zlib.compress(call_body())), ("identity", call_body())]:
+        response = post_call(client, data, encoding)
+        assert response.status_code == 200, encoding
+    assert count_rows(database_path, "function_call") == 4
+
+
+def test_unsupported_encoding_is_rejected(client, instrumented, database_path):
+    response = post_call(client, call_body(), "br")
+    assert response.status_code == 415
+    assert b"Unsupported Content-Encoding" in response.data
+    assert count_rows(database_path, "function_call") == 0
+
+
+def test_corrupt_body_is_rejected(client, instrumented, database_path):
+    compressed = gzip_compress(call_body())
+    for data in [b"not compressed", compressed[:len(compressed) // 2]]:
+        response = post_call(client, data, "gzip")
+        assert response.status_code == 400
+        assert b"could not be decompressed" in response.data
+    assert count_rows(database_path, "function_call") == 0
+
+
+def test_body_is_limited_once_decompressed(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "max_request_body_size", 4096)
+    # a body smaller than the limit that decompresses to far more
+    data = gzip_compress(b" " * (1024 * 1024) + call_body())
+    assert len(data) < 4096
+
+    response = post_call(client, data, "gzip")
+    assert response.status_code == 413
+    assert count_rows(database_path, "function_call") == 0
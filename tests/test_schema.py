@@ -0,0 +1,187 @@
+"""
+Tests of the migrations bringing a database created from the original verdict-schema.sql (kept in
+baseline-verdict-schema.sql) up to date, including the merging of duplicate assignments and transactions.
+"""
+import os
+import sqlite3
+
+import pytest
+
+import app
+from app.database import schema, utils
+from app.database.values import timestamp_to_microseconds
+from conftest import reset_server_state
+
+baseline_schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline-verdict-schema.sql")
+
+
+@pytest.fixture
+def baseline_database(tmpdir, monkeypatch):
+    """
+    Create a database with the original schema, holding duplicate assignments, transactions and branching
+    conditions, and use batches of a single row so that every migration takes several batches.
+    """
+    monkeypatch.setattr(schema, "migration_batch_size", 1)
+    connection = sqlite3.connect(str(tmpdir.join("baseline.db")))
+    with open(baseline_schema_path) as schema_file:
+        connection.executescript(schema_file.read())
+    connection.executemany("insert into trans (id, time_of_transaction) values(?, ?)",
+                           [(1, "2020-01-01T00:00:00"), (2, "2020-01-01T00:00:00"), (3, "2020-01-02T00:00:00")])
+    connection.executemany(
+        "insert into function_call (id, function, time_of_call, end_time_of_call, trans, path_condition_id_sequence) "
+        "values(?, 1, ?, ?, ?, ?)",
+        [(1, "2020-01-01T00:00:00", "2020-01-01T00:00:01", 1, "[1]"),
+         (2, "2020-01-01T00:00:02", "2020-01-01T00:00:03", 2, "[1]"),
+         (3, "2020-01-02T00:00:00", "2020-01-02T00:00:01", 3, "[1, 2]")]
+    )
+    connection.executemany("insert into path_condition_structure (id, serialised_condition) values(?, ?)",
+                           [(1, "a"), (2, "b"), (3, "a")])
+    connection.executemany("insert into assignment (id, variable, value, type) values(?, ?, ?, 'int')",
+                           [(1, "x", "1"), (2, "x", "1"), (3, "y", "2"), (4, "x", "1")])
+    connection.executemany(
+        "insert into observation (id, instrumentation_point, verdict, observed_value, observation_time, "
+        "observation_end_time, atom_index, sub_index, previous_condition_offset) values(?, 1, ?, ?, ?, ?, 0, 0, 0)",
+        [(1, 1, "1.5", "2020-01-01T00:00:00", "2020-01-01T00:00:00"),
+         (2, 2, "2", "2020-01-01T00:00:02", "2020-01-01T00:00:02"),
+         (3, 3, "text", "2020-01-02T00:00:00", "2020-01-02T00:00:00")]
+    )
+    connection.executemany("insert into observation_assignment_pair (observation, assignment) values(?, ?)",
+                           [(1, 1), (1, 3), (2, 2), (3, 1), (3, 4)])
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def index_names(connection):
+    return set(row[0] for row in connection.execute("select name from sqlite_master where type = 'index'"))
+
+
+def check_upgraded(connection):
+    assert connection.execute("select id, variable, value from assignment order by id").fetchall() == \
+        [(1, "x", "1"), (3, "y", "2")]
+    assert connection.execute("select observation, assignment from observation_assignment_pair "
+                              "order by observation, assignment").fetchall() == [(1, 1), (1, 3), (2, 1), (3, 1)]
+    assert connection.execute("select id from trans order by id").fetchall() == [(1,), (3,)]
+    assert connection.execute("select id, trans from function_call order by id").fetchall() == \
+        [(1, 1), (2, 1), (3, 3)]
+    # only the first of the duplicate conditions is given a hash
+    assert connection.execute("select id from path_condition_structure where hash is not null "
+                              "order by id").fetchall() == [(1,), (2,)]
+    program_paths = connection.execute("select function_call.id, program_path.path_condition_id_sequence "
+                                       "from function_call inner join program_path "
+                                       "on function_call.program_path = program_path.id order by function_call.id")
+    assert program_paths.fetchall() == [(1, "[1]"), (2, "[1]"), (3, "[1, 2]")]
+    assert connection.execute("select count(*) from program_path").fetchone()[0] == 2
+    assert connection.execute("select id, numeric_value from observation order by id").fetchall() == \
+        [(1, 1.5), (2, 2.0), (3, None)]
+    assert connection.execute("select duration_us from function_call where id = 1").fetchone()[0] == 1000000
+
+    indices = index_names(connection)
+    for index in ["assignment_variable_value", "trans_time_of_transaction", "path_condition_structure_hash",
+                  "function_call_program_path", "observation_point_atom_value", "function_call_trans",
+                  "observation_time_us"]:
+        assert index in indices
+    assert not any(index.endswith("_duplicates") for index in indices)
+    assert connection.execute("select name from sqlite_master where name = 'assignment_remap'").fetchone() is None
+
+
+def test_baseline_database_is_upgraded(baseline_database):
+    assert schema.upgrade_schema(baseline_database)
+    check_upgraded(baseline_database)
+    assert len(schema.list_pending_migrations(baseline_database.cursor())) == 0
+
+
+def test_epoch_columns_are_filled_in_utc(baseline_database):
+    baseline_database.execute("update function_call set time_of_call = '2020-01-02T01:00:00+01:00', "
+                              "end_time_of_call = '2020-01-02T01:00:01.5+01:00' where id = 3")
+    baseline_database.execute("update observation set observation_time = '2020-01-01T19:00:00-05:00' where id = 3")
+    baseline_database.execute("update observation set observation_time = 'not a time' where id = 2")
+    baseline_database.execute("insert into verdict (binding, verdict, time_obtained, function_call, collapsing_atom, "
+                              "collapsing_atom_sub_index) values(1, 1, '2020-01-01T00:00:01Z', 1, 0, 0)")
+    baseline_database.commit()
+    assert schema.upgrade_schema(baseline_database)
+
+    day_us = 86400 * 1000000
+    january_first_us = 1577836800 * 1000000
+    assert baseline_database.execute(
+        "select id, time_of_call_us, end_time_of_call_us, duration_us from function_call order by id"
+    ).fetchall() == [(1, january_first_us, january_first_us + 1000000, 1000000),
+                     (2, january_first_us + 2000000, january_first_us + 3000000, 1000000),
+                     (3, january_first_us + day_us, january_first_us + day_us + 1500000, 1500000)]
+    # observation times that can't be parsed are left without a time
+    assert baseline_database.execute("select id, observation_time_us from observation order by id").fetchall() == \
+        [(1, january_first_us), (2, None), (3, january_first_us + day_us)]
+    assert baseline_database.execute("select time_obtained_us from verdict").fetchall() == \
+        [(january_first_us + 1000000,)]
+    assert baseline_database.execute("select id, time_of_transaction_us from trans order by id").fetchall() == \
+        [(1, january_first_us), (3, january_first_us + day_us)]
+
+
+def test_timestamps_are_converted_to_utc_microseconds():
+    assert timestamp_to_microseconds("1970-01-01T00:00:00") == 0
+    assert timestamp_to_microseconds("1970-01-01T00:00:01.000002") == 1000002
+    # timestamps without a time zone are in UTC
+    for timestamp in ["2020-01-01T01:00:00+01:00", "2019-12-31T19:00:00-05:00", "2020-01-01T00:00:00Z",
+                      "2020-01-01T05:30:00+05:30", "2020-01-01 00:00:00+00:00"]:
+        assert timestamp_to_microseconds(timestamp) == 1577836800 * 1000000, timestamp
+    assert timestamp_to_microseconds("1969-12-31T23:59:59.5") == -500000
+    for value in ["not a time", "", None, 1.5]:
+        assert timestamp_to_microseconds(value) is None
+
+
+def test_rows_added_during_upgrade_are_included(baseline_database, monkeypatch):
+    """
+    Rows written by a server running an older version after a batched migration has finished
+    are included by the step building the index that depends on it.
+    """
+    migrations = schema.schema_migrations
+    monkeypatch.setattr(schema, "schema_migrations", [(version, migration) for (version, migration) in migrations
+                                                      if version not in (6, 10, 15, 18, 21)])
+    assert schema.upgrade_schema(baseline_database)
+    assert "assignment_variable_value" not in index_names(baseline_database)
+
+    baseline_database.execute("insert into assignment (id, variable, value, type) values(5, 'x', '1', 'int')")
+    baseline_database.execute(
+        "insert into observation (id, instrumentation_point, verdict, observed_value, observation_time, "
+        "observation_end_time, atom_index, sub_index, previous_condition_offset) "
+        "values(4, 1, 3, '4', '2020-01-02T00:00:00', '2020-01-02T00:00:00', 0, 0, 0)"
+    )
+    baseline_database.execute("insert into observation_assignment_pair (observation, assignment) values(4, 5)")
+    baseline_database.execute("insert into trans (id, time_of_transaction) values(4, '2020-01-02T00:00:00')")
+    baseline_database.execute(
+        "insert into function_call (id, function, time_of_call, end_time_of_call, trans, path_condition_id_sequence) "
+        "values(4, 1, '2020-01-02T00:00:02', '2020-01-02T00:00:03', 4, '[2]')"
+    )
+    baseline_database.commit()
+
+    monkeypatch.setattr(schema, "schema_migrations", migrations)
+    assert schema.upgrade_schema(baseline_database)
+    assert baseline_database.execute("select assignment from observation_assignment_pair "
+                                     "where observation = 4").fetchall() == [(1,)]
+    assert baseline_database.execute("select trans from function_call where id = 4").fetchone()[0] == 3
+    assert baseline_database.execute("select count(*) from trans").fetchone()[0] == 2
+    assert baseline_database.execute("select program_path is not null from function_call "
+                                     "where id = 4").fetchone()[0] == 1
+    assert baseline_database.execute("select numeric_value from observation where id = 4").fetchone()[0] == 4.0
+
+
+def test_server_refuses_to_start_with_rows_to_migrate(baseline_database, tmpdir, monkeypatch):
+    monkeypatch.setattr(app, "database_string", str(tmpdir.join("baseline.db")))
+    reset_server_state()
+    assert not utils.upgrade_database()
+    # nothing was migrated
+    assert len(schema.list_pending_migrations(baseline_database.cursor())) == len(schema.schema_migrations)
+    reset_server_state()
+
+
+def test_server_migrates_an_empty_database(tmpdir, monkeypatch):
+    path = str(tmpdir.join("empty.db"))
+    connection = sqlite3.connect(path)
+    with open(baseline_schema_path) as schema_file:
+        connection.executescript(schema_file.read())
+    monkeypatch.setattr(app, "database_string", path)
+    reset_server_state()
+    assert utils.upgrade_database()
+    assert len(schema.list_pending_migrations(connection.cursor())) == 0
+    connection.close()
+    reset_server_state()
@@ -0,0 +1,27 @@
+"""
+Tests of the formats in which lists are streamed by the analysis API.
+"""
+import base64
+import json
+import pickle
+
+from conftest import insert_call, verdict_dictionary
+
+
+def test_blobs_are_streamed_as_base64(client, instrumented):
+    call = insert_call(client)
+    client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0])))
+    url = "/client/observation/id/1/assignments/"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assignments = json.loads(response.data)
+    assert [assignment["variable"] for assignment in assignments] == ["x"]
+    assert pickle.loads(base64.b64decode(assignments[0]["value"])) == 1.0
+
+    lines = client.get(url + "?format=ndjson").data.decode("utf-8").splitlines()
+    assert [json.loads(line)["value"] for line in lines] == [assignments[0]["value"]]
+
+    compact = json.loads(client.get(url + "?format=compact&limit=10").data)
+    assert compact["rows"] == [[assignment[column] for column in compact["columns"]] for assignment in assignments]
+    assert compact["next"] is None
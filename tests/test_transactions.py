@@ -0,0 +1,59 @@
+"""
+Tests of the resolution of transactions through the transaction cache and the unique index on trans.
+"""
+import json
+import sqlite3
+import threading
+
+from app import app_object
+from app.database import insertion
+from conftest import insert_call, count_rows
+
+
+def transactions_of_calls(database_path):
+    connection = sqlite3.connect(database_path)
+    rows = connection.execute("select id, trans from function_call order by id").fetchall()
+    connection.close()
+    return rows
+
+
+def test_calls_in_a_transaction_share_it(client, instrumented, database_path):
+    statistics = insertion.transaction_cache.statistics()
+    insert_call(client, "2020-01-01T00:00:01")
+    insert_call(client, "2020-01-01T00:00:02")
+    insert_call(client, "2020-01-01T00:00:03", transaction_time="2020-01-01T00:00:03")
+
+    assert transactions_of_calls(database_path) == [(1, 1), (2, 1), (3, 2)]
+    after = json.loads(client.get("/statistics/").data)["transaction_cache"]
+    assert (after["hits"], after["misses"]) == (statistics["hits"] + 1, statistics["misses"] + 2)
+
+
+def test_transactions_missing_from_the_cache_are_found_in_the_database(client, instrumented, database_path):
+    insert_call(client)
+    # as when the transaction was evicted, or inserted by another process
+    insertion.transaction_cache.clear()
+    insert_call(client)
+
+    assert count_rows(database_path, "trans") == 1
+    assert transactions_of_calls(database_path) == [(1, 1), (2, 1)]
+    assert insertion.transaction_cache.get("2020-01-01T00:00:00") == 1
+
+
+def test_concurrent_calls_resolve_to_one_transaction(instrumented, database_path):
+    errors = []
+
+    def send_call():
+        try:
+            insert_call(app_object.test_client())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=send_call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert count_rows(database_path, "function_call") == 8
+    assert count_rows(database_path, "trans") == 1
@@ -0,0 +1,101 @@
+"""
+Tests of the ingestion modes, in which writes are performed inside requests or by the background writer.
+"""
+import json
+
+import app
+from app.database import writer, spool
+from app.metrics import write_failures_total
+from conftest import insert_call, verdict_dictionary, count_rows
+
+
+def failures_counted(write_name):
+    return write_failures_total._values.get((write_name,), 0)
+
+
+def test_queued_writes_are_committed(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "ingestion_mode", "queued")
+    calls = [insert_call(client, "2020-01-01T00:00:0%i" % index) for index in range(3)]
+    assert calls == [1, 2, 3]
+    for call in calls:
+        assert client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0]))).data == b"success"
+
+    writer.stop_writer()
+    assert count_rows(database_path, "function_call") == 3
+    assert count_rows(database_path, "verdict") == 3
+
+
+def test_failed_queued_write_is_counted(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "ingestion_mode", "queued")
+    call = insert_call(client)
+    failures = failures_counted("write_verdicts")
+
+    # the verdicts have no binding, which is only found once the request has been answered
+    response = client.post("/register_verdicts/",
+                           data=json.dumps(verdict_dictionary(call, [1.0], bind_space_index=5)))
+    assert response.data == b"success"
+
+    writer.stop_writer()
+    assert count_rows(database_path, "verdict") == 0
+    assert failures_counted("write_verdicts") == failures + 1
+    assert 'vypr_write_failures_total{write="write_verdicts"}' in client.get("/metrics/").data.decode()
+
+
+def test_spooled_writes_are_applied(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "ingestion_mode", "spooled")
+    monkeypatch.setattr(app, "spool_path", None)
+    calls = [insert_call(client, "2020-01-01T00:00:0%i" % index) for index in range(3)]
+    for call in calls:
+        response = client.post("/register_verdicts/", data=json.dumps(verdict_dictionary(call, [1.0])))
+        assert response.status_code == 202
+
+    # the spool is kept alongside the database it belongs to
+    assert spool.get_spool().path == database_path + ".spool"
+    spool.stop_spool()
+    assert count_rows(database_path, "function_call") == 3
+    assert count_rows(database_path, "verdict") == 3
+
+
+def test_failed_spooled_record_is_dead_lettered(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "ingestion_mode", "spooled")
+    calls = [insert_call(client, "2020-01-01T00:00:0%i" % index) for index in range(2)]
+    failing = verdict_dictionary(calls[0], [1.0], bind_space_index=5)
+    assert client.post("/register_verdicts/", data=json.dumps(failing)).status_code == 202
+    assert client.post("/register_verdicts/",
+                       data=json.dumps(verdict_dictionary(calls[1], [1.0]))).status_code == 202
+
+    dead_letter_path = spool.get_spool().dead_letter_path()
+    spool.stop_spool()
+    assert count_rows(database_path, "verdict") == 1
+    with open(dead_letter_path) as dead_letter_file:
+        dead_letters = [json.loads(line) for line in dead_letter_file]
+    assert len(dead_letters) == 1
+    assert dead_letters[0]["kind"] == "verdicts"
+    assert dead_letters[0]["data"] == failing
+    assert "No binding was found" in dead_letters[0]["error"]
+
+
+def test_failed_spooled_call_and_verdicts_are_dead_lettered(client, instrumented, database_path, monkeypatch):
+    monkeypatch.setattr(app, "ingestion_mode", "spooled")
+    failing = verdict_dictionary(None, [1.0], bind_space_index=5)
+    del failing["function_call_id"]
+    del failing["function_id"]
+    response = client.post("/insert_function_call_and_verdicts/", data=json.dumps({
+        "transaction_time": "2020-01-01T00:00:00",
+        "function_name": "m.f",
+        "program_path": [],
+        "time_of_call": "2020-01-01T00:00:00",
+        "end_time_of_call": "2020-01-01T00:00:01",
+        "property_verdicts": [failing]
+    }))
+    assert response.status_code == 202
+    assert json.loads(response.data)["function_call_id"] == 1
+
+    dead_letter_path = spool.get_spool().dead_letter_path()
+    spool.stop_spool()
+    # the call is dead-lettered along with its verdicts, rather than being kept without them
+    assert count_rows(database_path, "function_call") == 0
+    with open(dead_letter_path) as dead_letter_file:
+        dead_letters = [json.loads(line) for line in dead_letter_file]
+    assert [dead_letter["kind"] for dead_letter in dead_letters] == ["function_call_and_verdicts"]
+    assert dead_letters[0]["data"]["property_verdicts"] == [failing]
@@ -2,6 +2,7 @@ CREATE TABLE function (
     id integer primary key autoincrement,
     fully_qualified_name text not null
 );
+CREATE INDEX function_fully_qualified_name ON function(fully_qualified_name);
 CREATE TABLE function_property_pair (
     function integer not null,
     property_hash text not null,
@@ -22,6 +23,7 @@ CREATE TABLE binding (
     binding_statement_lines text not null,
     foreign key(function) references function(id)
 );
+CREATE INDEX binding_function_property ON binding(function, property_hash, binding_space_index);
 CREATE TABLE function_call (
     id integer primary key autoincrement,
     function int not null,
@@ -29,9 +31,26 @@ CREATE TABLE function_call (
     end_time_of_call timestamp not null,
     trans int not null,
     path_condition_id_sequence text not null,
+    program_path int,
+    time_of_call_us integer,
+    end_time_of_call_us integer,
+    duration_us integer,
     foreign key(function) references function(id),
-    foreign key(trans) references trans(id)
+    foreign key(trans) references trans(id),
+    foreign key(program_path) references program_path(id)
+);
+CREATE INDEX function_call_program_path ON function_call(program_path);
+CREATE INDEX function_call_time ON function_call(time_of_call);
+CREATE INDEX function_call_function_time_us ON function_call(function, time_of_call_us);
+CREATE INDEX function_call_time_us ON function_call(time_of_call_us);
+CREATE INDEX function_call_trans ON function_call(trans, function);
+CREATE INDEX function_call_function_id ON function_call(function, id);
+CREATE TABLE program_path (
+    id integer not null primary key autoincrement,
+    hash text not null,
+    path_condition_id_sequence text not null
 );
+CREATE UNIQUE INDEX program_path_hash ON program_path(hash);
 CREATE TABLE test_data (
     id integer primary key autoincrement,
     test_name text,
@@ -47,13 +66,20 @@ CREATE TABLE verdict (
     function_call int not null,
     collapsing_atom int not null,
     collapsing_atom_sub_index int not null,
+    time_obtained_us integer,
     foreign key(binding) references binding(id),
     foreign key(function_call) references function_call(id)
 );
+CREATE INDEX verdict_function_call ON verdict(function_call, verdict);
+CREATE INDEX verdict_binding ON verdict(binding, verdict);
+CREATE INDEX verdict_binding_id ON verdict(binding, id);
 CREATE TABLE trans (
     id integer primary key autoincrement,
-    time_of_transaction timestamp not null
+    time_of_transaction timestamp not null,
+    time_of_transaction_us integer
 );
+CREATE UNIQUE INDEX trans_time_of_transaction ON trans(time_of_transaction);
+CREATE INDEX trans_time_of_transaction_us ON trans(time_of_transaction_us);
 CREATE TABLE atom (
     id integer not null primary key autoincrement,
     property_hash text not null,
@@ -61,6 +87,7 @@ CREATE TABLE atom (
     index_in_atoms int not null,
     foreign key(property_hash) references property(hash)
 );
+CREATE INDEX atom_property_index ON atom(property_hash, index_in_atoms);
 CREATE TABLE atom_instrumentation_point_pair (
     atom int not null,
     instrumentation_point int not null,
@@ -90,9 +117,29 @@ CREATE TABLE observation (
     atom_index int not null,
     sub_index int not null,
     previous_condition_offset integer not null,
+    numeric_value real,
+    time_value real,
+    observation_time_us integer,
     foreign key(instrumentation_point) references instrumentation_point(id),
     foreign key(verdict) references verdict(id)
 );
+CREATE INDEX observation_point_atom_value ON observation(instrumentation_point, atom_index, numeric_value);
+CREATE INDEX observation_verdict ON observation(verdict);
+CREATE INDEX observation_point_id ON observation(instrumentation_point, id);
+CREATE INDEX observation_time_us ON observation(observation_time_us);
+CREATE TABLE observation_aggregate (
+    instrumentation_point int not null,
+    atom_index int not null,
+    sub_index int not null,
+    binding int not null,
+    bucket_start timestamp not null,
+    observation_count int not null,
+    violation_count int not null,
+    min_value real,
+    max_value real,
+    sum_value real,
+    primary key(instrumentation_point, atom_index, sub_index, binding, bucket_start)
+);
 CREATE TABLE observation_assignment_pair (
     observation int not null,
     assignment int not null,
@@ -106,13 +153,36 @@ CREATE TABLE assignment (
     value text not null,
     type text not null
 );
+CREATE UNIQUE INDEX assignment_variable_value ON assignment(variable, value);
 CREATE TABLE path_condition_structure (
     id integer not null primary key autoincrement,
-    serialised_condition text not null
+    serialised_condition text not null,
+    hash text
 );
+CREATE UNIQUE INDEX path_condition_structure_hash ON path_condition_structure(hash);
 CREATE TABLE plot (
     hash text not null primary key,
     description text not null,
     data text not null,
     creation_time timestamp not null
-);
\ No newline at end of file
+);
+CREATE TABLE spool_checkpoint (
+    id integer not null primary key check (id = 0),
+    segment integer not null,
+    offset integer not null
+);
+CREATE TABLE schema_migration (
+    version integer not null primary key,
+    name text not null,
+    time_applied timestamp not null
+);
+CREATE TABLE verdict_partition (
+    name text not null primary key,
+    period_start timestamp not null,
+    period_end timestamp not null,
+    archived int not null
+);
+CREATE TABLE schema_migration_progress (
+    name text not null primary key,
+    position integer not null
+);